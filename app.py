@@ -1,21 +1,27 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import pandas as pd
-import win32com.client as win32
-import pythoncom
 from datetime import datetime
 import json
 import os
-import re
-import requests
-from functools import lru_cache
-from io import BytesIO
-import tempfile
-import shutil
-from docxtpl import DocxTemplate
-import time
+import copy
 import sys
 import io
+from mail_transport import open_transport, send_bulk
+from mailbox_reader import open_reader, load_cursor, save_cursor, advance_cursor
+from offer_parser import parser as offer_parser, build_offer
+from storage import OfferQuery, open_store, cache_stats
+from offers_table import build_comparison, format_comparison, rate_history_frame
+from carrier_registry import get_registry
+from currency_rates import RATES_TTL, get_rate_service
+from notifications import NOTIFY_STATUSES, get_notification_worker
+from archive import ARCHIVE_AFTER_DAYS, archive_closed_bids, archived_offers, list_partitions, start_archiver
+from attachments import get_attachment_store
+from exports import available_formats, export_frame
+from carrier_import import merge_carriers, read_carrier_file, validate_carriers
+from metrics import METRICS_WINDOW, span, timed, snapshot, prometheus_text, start_exporter
+from contracts import (TEMPLATE_PATH, CONTRACTS_DIR, build_contract_context, contract_file_name,
+                       contract_record, render_contract, render_contracts_batch, build_zip)
 # --- Конфигурация ---
 CONFIG_FILE = "requirements.txt"
 BIDS_FILE = "bids.json"
@@ -23,6 +29,13 @@ CARRIERS_FILE = "carriers.json"
 OFFERS_FILE = "offers.json"
 CONTRACTS_FILE = "contracts.json"
 CARRIERS_INFO_FILE = "carriers_info.xlsx"
+# Локальный почтовый ящик (mbox/maildir/каталог .eml) вместо Outlook, пусто - Outlook
+MAILBOX_SOURCE = os.environ.get("TT_MAILBOX_SOURCE", "")
+# Справочники экранов
+OFFER_STATUSES = ["Новое", "В работе", "Отклонено", "Принято"]
+DELIVERY_METHODS = ["Море+ЖД", "Прямое ЖД", "Авто", "Авиа"]
+OFFER_SORT_OPTIONS = {"Дата получения": "email_date", "ID заявки": "bid_id", "Перевозчик": "sender", "Статус": "status"}
+OFFERS_PAGE_SIZES = [50, 100, 200]
 # --- Инициализация файлов ---
 def init_files():
     """Создает необходимые файлы, если они отсутствуют"""
@@ -43,103 +56,97 @@ def init_files():
             df_example.to_excel(CARRIERS_INFO_FILE, index=False)
         except Exception as e:
             st.error(f"Ошибка при создании файла {CARRIERS_INFO_FILE}: {str(e)}")
-init_files()
-# --- Функции для работы с данными ---
-def load_json_file(filename):
-    """Загружает данные из JSON файла"""
-    try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        st.error(f"Ошибка загрузки файла {filename}: {str(e)}")
-        return []
-def save_json_file(filename, data):
-    """Сохраняет данные в JSON файл"""
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        st.error(f"Ошибка сохранения файла {filename}: {str(e)}")
-# --- Функция инициализации Outlook ---
-def init_outlook():
-    """Инициализирует соединение с Outlook"""
-    pythoncom.CoInitialize()
-    return win32.Dispatch("Outlook.Application")
-# --- Работа с Outlook ---
-def send_email(to, subject, body_text, attachments=None):
-    """Отправляет email через Outlook с возможностью вложений"""
+# --- Инициализация (один раз на процесс) ---
+@st.cache_resource
+def init_resources():
+    """Создает файлы данных, открывает хранилища и запускает фоновые потоки.
+    Streamlit выполняет скрипт заново при каждом действии пользователя,
+    поэтому все это делается один раз на процесс, а не при каждой перерисовке."""
+    init_files()
+    # JSON файлы или SQLite (TT_STORAGE=sqlite), экраны читают и пишут только через store
+    data_store = open_store(
+        bids_file=BIDS_FILE,
+        offers_file=OFFERS_FILE,
+        carriers_file=CARRIERS_FILE,
+        contracts_file=CONTRACTS_FILE
+    )
+    # Фоновый перенос закрытых заявок в архив
+    start_archiver(data_store)
+    # Отправка уведомлений из очереди: после перезапуска досылаются ожидающие
+    # и прерванные уведомления, не дожидаясь открытия "Просмотр предложений"
+    get_notification_worker(data_store)
+    # Запись замеров времени в файл Prometheus, если задан TT_METRICS_FILE
+    start_exporter()
+    # Вложения заявок по хэшу содержимого (attachments/)
+    return data_store, get_attachment_store()
+store, attachment_store = init_resources()
+# --- Отправка почты ---
+@timed("send_email")
+def send_email(to, subject, body_text, attachments=None, transport=None):
+    """Отправляет email через почтовый транспорт с возможностью вложений.
+    Если transport не передан, открывается отдельная сессия на одно письмо."""
+    # Проверка существования вложений
+    existing_attachments = []
+    for file in attachments or []:
+        if os.path.exists(file):
+            existing_attachments.append(file)
+        else:
+            st.warning(f"Файл {file} не найден и не будет прикреплен")
+    if transport is None:
+        try:
+            with open_transport() as single_transport:
+                single_transport.send(to, subject, body_text, existing_attachments)
+            return True
+        except Exception as e:
+            st.error(f"Ошибка отправки: {str(e)}")
+            return False
     try:
-        outlook = init_outlook()
-        mail = outlook.CreateItem(0)
-        mail.To = to
-        mail.Subject = subject
-        mail.Body = body_text
-        # Добавление вложений
-        if attachments:
-            for file in attachments:
-                if os.path.exists(file):  # Проверка существования файла
-                    mail.Attachments.Add(file)
-                else:
-                    st.warning(f"Файл {file} не найден и не будет прикреплен")
-        mail.Send()
+        transport.send(to, subject, body_text, existing_attachments)
         return True
     except Exception as e:
         st.error(f"Ошибка отправки: {str(e)}")
         return False
-    finally:
-        pythoncom.CoUninitialize()
-# --- Кэширование курсов валют ---
-@lru_cache(maxsize=1)
+# --- Сообщения пользователю ---
+FLASH_ICONS = {"success": "✅", "info": "ℹ️", "warning": "⚠️", "error": "❌"}
+def flash(message, kind="success"):
+    """Ставит сообщение в очередь сессии: оно будет показано при следующей отрисовке
+    (например, после st.rerun), без задержки выполнения"""
+    st.session_state.setdefault("flash_messages", []).append((kind, message))
+def show_flash_messages():
+    """Показывает и очищает очередь сообщений: успех и информация - всплывающими
+    уведомлениями, предупреждения и ошибки - в начале страницы"""
+    for kind, message in st.session_state.pop("flash_messages", []):
+        if kind in ("warning", "error"):
+            getattr(st, kind)(message)
+        else:
+            st.toast(message, icon=FLASH_ICONS.get(kind))
+# --- Курсы валют ---
+@timed("currency_rates")
 def get_currency_rates():
-    """Получает текущие курсы валют с кэшированием"""
-    try:
-        data = requests.get("https://www.cbr-xml-daily.ru/daily_json.js", timeout=5).json()
-        return {
-            "USD": data["Valute"]["USD"]["Value"],
-            "EUR": data["Valute"]["EUR"]["Value"],
-            "date": data["Date"][:10]
-        }
-    except Exception:
-        return {"USD": 90.0, "EUR": 100.0, "date": "N/A"}
+    """Текущие курсы валют из сервиса курсов (без ожидания сети)"""
+    return get_rate_service().current()
 # --- Виджет курсов валют ---
+def format_rate_delta(today_value, yesterday_value):
+    """Дельта курса: знак + для положительных, округление до 2 знаков"""
+    delta_value = today_value - yesterday_value
+    delta_percent = (delta_value / yesterday_value) * 100
+    return f"{'+' if delta_value >= 0 else ''}{delta_value:.2f} ({'+' if delta_percent >= 0 else ''}{delta_percent:.2f}%)"
 def currency_rates_widget():
     """Отображает виджет курсов валют в сайдбаре с дельтой и подробной информацией"""
     st.sidebar.title("💰 Курсы валют")
-    rates_today = get_currency_rates()
-    # Получаем курсы за вчерашний день
-    try:
-        # Для получения вчерашних данных нужно запросить их отдельно
-        # ЦБ РФ API предоставляет исторические данные
-        from datetime import datetime, timedelta
-        yesterday = datetime.now() - timedelta(days=1)
-        yesterday_str = yesterday.strftime("%Y/%m/%d") # Формат даты для API ЦБ РФ
-        url_yesterday = f"https://www.cbr-xml-daily.ru/archive/{yesterday_str}/daily_json.js"
-        data_yesterday = requests.get(url_yesterday, timeout=5).json()
-        rates_yesterday = {
-            "USD": data_yesterday["Valute"]["USD"]["Value"],
-            "EUR": data_yesterday["Valute"]["EUR"]["Value"],
-        }
-    except Exception:
-        # Если не удалось получить данные за вчера, используем "вчерашние" из кэша сегодняшних как заглушку
-        # или фиксированные значения для расчета дельты
-        # В реальном приложении лучше обработать эту ситуацию более изящно
-        # Например, можно хранить предыдущие значения в файле или сессии
-        rates_yesterday = {"USD": rates_today["USD"] / 1.005, "EUR": rates_today["EUR"] / 0.997}
-        # st.warning("Не удалось получить курсы за вчерашний день, дельта может быть неточной.")
+    rate_service = get_rate_service()
+    rates_today = rate_service.current()
+    # Курсы за предыдущий день берутся из локальной истории курсов
+    rates_yesterday = rate_service.previous(rates_today["date"]) if rates_today["date"] != "N/A" else None
     # Рассчитываем дельты
     try:
-        usd_delta_value = rates_today["USD"] - rates_yesterday["USD"]
-        usd_delta_percent = (usd_delta_value / rates_yesterday["USD"]) * 100
-        # Форматируем дельту: знак + для положительных, округляем до 2 знаков
-        usd_delta = f"{'+' if usd_delta_value >= 0 else ''}{usd_delta_value:.2f} ({'+' if usd_delta_percent >= 0 else ''}{usd_delta_percent:.2f}%)"
-    except:
-        usd_delta = "N/A"
+        usd_delta = format_rate_delta(rates_today["USD"], rates_yesterday["USD"])
+    except Exception:
+        usd_delta = None
     try:
-        eur_delta_value = rates_today["EUR"] - rates_yesterday["EUR"]
-        eur_delta_percent = (eur_delta_value / rates_yesterday["EUR"]) * 100
-        eur_delta = f"{'+' if eur_delta_value >= 0 else ''}{eur_delta_value:.2f} ({'+' if eur_delta_percent >= 0 else ''}{eur_delta_percent:.2f}%)"
-    except:
-        eur_delta = "N/A"
+        eur_delta = format_rate_delta(rates_today["EUR"], rates_yesterday["EUR"])
+    except Exception:
+        eur_delta = None
     # Основные курсы с дельтами
     col1, col2 = st.sidebar.columns(2)
     with col1:
@@ -149,266 +156,178 @@ def currency_rates_widget():
     # Блок с подробной информацией
     with st.sidebar.expander("ℹ️ Подробности"):
         st.write(f"Последнее обновление: {rates_today['date']}")
-        st.write(f"Курс USD вчера: {rates_yesterday['USD']:.2f}")
-        st.write(f"Курс EUR вчера: {rates_yesterday['EUR']:.2f}")
-        st.write("""
+        for code in ("USD", "EUR"):
+            if rates_yesterday and code in rates_yesterday:
+                st.write(f"Курс {code} на {rates_yesterday['date']}: {rates_yesterday[code]:.2f}")
+        if rate_service.last_error:
+            st.write(f"Ошибка последнего обновления: {rate_service.last_error}")
+        # Остальные валюты таблицы ЦБ (курс за одну единицу)
+        other_rates = {code: value for code, value in rates_today.items() if code not in ("USD", "EUR", "date")}
+        if other_rates:
+            st.dataframe(pd.Series(other_rates, name="₽ за единицу").rename_axis("Валюта"), use_container_width=True)
+        st.write(f"""
         **Источник:** [ЦБ РФ API](https://www.cbr-xml-daily.ru )  
-        **Кэширование:** 1 час  
+        **Кэширование:** {RATES_TTL // 60} мин, обновление в фоне  
         **Резервные значения:** USD=90.0, EUR=100.0
         """)
     # Кнопка обновления
     if st.sidebar.button("🔄 Обновить данные", type="secondary"):
-        get_currency_rates.cache_clear()
-        st.rerun()
+        try:
+            rate_service.refresh()
+        except Exception as e:
+            st.sidebar.error(f"Не удалось обновить курсы: {str(e)}")
+        else:
+            st.rerun()
+# --- Виджет кэша данных ---
+def data_cache_widget():
+    """Отображает в сайдбаре счетчики общего кэша файлов данных"""
+    stats = cache_stats()
+    total = stats["hits"] + stats["misses"]
+    with st.sidebar.expander("🗄️ Кэш данных"):
+        st.write(f"Попаданий: {stats['hits']}")
+        st.write(f"Промахов: {stats['misses']}")
+        st.write(f"Доля попаданий: {stats['hits'] / total * 100:.1f}%" if total else "Доля попаданий: —")
+        st.write(f"Файлов в кэше: {stats['entries']}")
+# --- Виджет производительности ---
+def performance_widget():
+    """Отображает в сайдбаре время основных операций (p50/p95 по последним замерам)
+    и выгрузку замеров в формате Prometheus"""
+    items = snapshot()
+    with st.sidebar.expander("⏱️ Производительность"):
+        if not items:
+            st.write("Замеров пока нет")
+            return
+        st.dataframe(
+            pd.DataFrame([{
+                "Операция": item["span"],
+                "Вызовов": item["count"],
+                "p50, мс": round(item["p50"] * 1000, 1),
+                "p95, мс": round(item["p95"] * 1000, 1),
+                "Макс, мс": round(item["max"] * 1000, 1),
+                "Ошибок": item["errors"],
+            } for item in items]),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(f"Перцентили по последним {METRICS_WINDOW} замерам каждой операции")
+        st.download_button(
+            "📈 Выгрузить (Prometheus)",
+            prometheus_text(items),
+            file_name="metrics.prom",
+            mime="text/plain"
+        )
 # --- Получение информации о перевозчике из Excel ---
-def get_carrier_info(carrier_name):
-    """Получает информацию о перевозчике из Excel файла"""
+def get_carrier_info(carrier_name, carrier_email=None):
+    """Получает информацию о перевозчике из справочника carriers_info.xlsx.
+    Справочник загружается один раз и перечитывается только при изменении файла."""
     try:
-        if os.path.exists(CARRIERS_INFO_FILE):
-            df = pd.read_excel(CARRIERS_INFO_FILE)
-            # Используем точное совпадение по имени
-            carrier_info = df[df['name'] == carrier_name]
-            if not carrier_info.empty:
-                return carrier_info.iloc[0].to_dict()
+        registry = get_registry(CARRIERS_INFO_FILE)
+        # Используем точное совпадение по имени, затем - по email отправителя
+        carrier_info = registry.get(carrier_name)
+        if not carrier_info and carrier_email:
+            carrier_info = registry.by_email(carrier_email)
+        return carrier_info
     except Exception as e:
         st.error(f"Ошибка при загрузке информации о перевозчике: {str(e)}")
     return {}
 # --- Генерация договора ---
+@timed("generate_contract")
 def generate_contract(bid_data, offer_data):
-    """Генерирует договор на основе данных заявки и предложения"""
+    """Генерирует договор на основе данных заявки и предложения.
+    Возвращает (путь к файлу в contracts, содержимое .docx) или (None, None)"""
     try:
         # Создаем папку templates если ее нет
         os.makedirs("templates", exist_ok=True)
-        template_path = os.path.join("templates", "template.docx")
-        if not os.path.exists(template_path):
+        if not os.path.exists(TEMPLATE_PATH):
             raise FileNotFoundError("Шаблон договора не найден")
-        doc = DocxTemplate(template_path)
         # Получаем информацию о перевозчике
-        carrier_info = get_carrier_info(offer_data['sender'])
-        # Используем email из carriers_info, если он там есть, иначе - из предложения
-        carrier_email_for_template = carrier_info.get('email', offer_data.get('sender_email', ''))
+        carrier_info = get_carrier_info(offer_data['sender'], offer_data.get('sender_email'))
         # Подготовка данных
-        context = {
-            'id': bid_data['id'],
-            'date_created': datetime.now().strftime('%d.%m.%Y'),
-            'carrier_name': offer_data['sender'],
-            'carrier_email': carrier_email_for_template, # Используем улучшенный email
-            'country_from': bid_data['details']['country_from'],
-            'loading_address': bid_data['details']['loading_address'],
-            'cargo_type': bid_data['details']['cargo_type'],
-            'cargo_description': bid_data['details'].get('cargo_description', ''), # Передаем описание груза
-            'container_type': bid_data['details']['container_type'],
-            'hs_code': bid_data['details']['hs_code'],
-            'incoterm': bid_data['details']['incoterm'],
-            'ready_date': bid_data['details']['ready_date'],
-            'payment_terms': bid_data['details']['payment_terms'],
-            'notes': bid_data['details']['notes'],
-            # Инициализация всех полей стоимости
-            'pre_carriage_cost': 0,
-            'pre_carriage_currency': '',
-            'othc_cost': 0,
-            'othc_currency': '',
-            'sea_freight_cost': 0,
-            'sea_freight_currency': '',
-            # Добавляем информацию о перевозчике
-            'name': carrier_info.get('name', ''), # Добавлено
-            'email': carrier_info.get('email', ''), # Добавлено
-            'legal_name': carrier_info.get('legal_name', ''),
-            'inn': carrier_info.get('inn', ''),
-            'kpp': carrier_info.get('kpp', ''),
-            'ogrn': carrier_info.get('ogrn', ''),
-            'address': carrier_info.get('address', ''),
-            'bank_name': carrier_info.get('bank_name', ''),
-            'bik': carrier_info.get('bik', ''),
-            'rs': carrier_info.get('rs', ''),
-            'ks': carrier_info.get('ks', ''),
-            'contract_number': carrier_info.get('contract_number', ''),
-            'contract_date': carrier_info.get('contract_date', ''),
-        }
-        # Заполняем данные о стоимости из предложения
-        for cost in offer_data.get('costs', []):
-            item_name = cost.get('ITEM', '')
-            if 'Pre-carriage' in item_name:
-                context['pre_carriage_cost'] = cost.get('COST', 0)
-                context['pre_carriage_currency'] = cost.get('CURRENCY', 'USD')
-            elif 'OTHC' in item_name:
-                context['othc_cost'] = cost.get('COST', 0)
-                context['othc_currency'] = cost.get('CURRENCY', 'USD')
-            elif 'Sea freight' in item_name:
-                context['sea_freight_cost'] = cost.get('COST', 0)
-                context['sea_freight_currency'] = cost.get('CURRENCY', 'USD')
-        doc.render(context)
-        # Сохранение во временный файл
-        temp_dir = tempfile.gettempdir()
-        contract_path = os.path.join(temp_dir, f"contract_{bid_data['id']}_{offer_data['sender']}.docx")
-        doc.save(contract_path)
-        # Сохраняем копию в папку contracts
-        os.makedirs("contracts", exist_ok=True)
-        shutil.copy(contract_path, os.path.join("contracts", os.path.basename(contract_path)))
+        context = build_contract_context(bid_data, offer_data, carrier_info)
+        # Рендеринг в памяти по закэшированному шаблону
+        contract_data = render_contract(context)
+        # Сохраняем договор в папку contracts (одна запись на диск)
+        os.makedirs(CONTRACTS_DIR, exist_ok=True)
+        contract_path = os.path.abspath(os.path.join(CONTRACTS_DIR, contract_file_name(bid_data['id'], offer_data['sender'])))
+        with open(contract_path, 'wb') as f:
+            f.write(contract_data)
         # Сохраняем информацию о договоре
-        contracts = load_json_file(CONTRACTS_FILE)
-        contracts.append({
-            "bid_id": bid_data['id'],
-            "offer_id": offer_data.get('bid_id', ''),
-            "carrier": offer_data['sender'],
-            "date": datetime.now().isoformat(),
-            "file_path": os.path.join("contracts", os.path.basename(contract_path)),
-            "status": "generated"
-        })
-        save_json_file(CONTRACTS_FILE, contracts)
-        return contract_path
+        store.add_contract(contract_record(bid_data, offer_data, os.path.join(CONTRACTS_DIR, os.path.basename(contract_path))))
+        return contract_path, contract_data
     except Exception as e:
         st.error(f"Ошибка при генерации договора: {str(e)}")
-        return None
+        return None, None
+# --- Пакетная генерация договоров ---
+def generate_contracts_batch(selected_rows):
+    """Генерирует договоры для выбранных строк таблицы сравнения (рендеринг в нескольких
+    процессах), регистрирует их одной записью и возвращает (ZIP, число договоров, ошибки).
+    Ошибка всей пачки (нет шаблона) показывается сразу, результат - (None, 0, ошибки)"""
+    jobs = []
+    pairs = []
+    errors = []
+    try:
+        for bid_id, sender in zip(selected_rows["bid_id"], selected_rows["sender"]):
+            offer = store.find_offer(bid_id, sender)
+            bid = store.get_bid(bid_id) if offer else None
+            if not offer or not bid:
+                errors.append(f"{sender} ({bid_id}): не найдены заявка или предложение")
+                continue
+            carrier_info = get_carrier_info(offer['sender'], offer.get('sender_email'))
+            jobs.append((contract_file_name(bid['id'], offer['sender']), build_contract_context(bid, offer, carrier_info)))
+            pairs.append((bid, offer))
+        results = render_contracts_batch(jobs) if jobs else []
+        os.makedirs(CONTRACTS_DIR, exist_ok=True)
+        files = []
+        records = []
+        for (bid, offer), (file_name, data, error) in zip(pairs, results):
+            if error:
+                errors.append(f"{offer['sender']} ({bid['id']}): {error}")
+                continue
+            file_path = os.path.join(CONTRACTS_DIR, file_name)
+            try:
+                with open(file_path, 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                # Договор, который не удалось сохранить, не попадает ни в архив, ни в реестр
+                errors.append(f"{offer['sender']} ({bid['id']}): {str(e)}")
+                continue
+            files.append((file_name, data))
+            records.append(contract_record(bid, offer, file_path))
+        if records:
+            store.add_contracts(records)
+        return build_zip(files), len(files), errors
+    except Exception as e:
+        st.error(f"Ошибка при генерации договоров: {str(e)}")
+        return None, 0, errors
 # --- Парсинг предложений из Outlook ---
-def parse_offers_from_outlook(folder_name="Предложения"):
-    """Парсит непрочитанные письма с предложениями из Outlook"""
+@timed("parse_offers")
+def parse_offers_from_outlook(folder_name="Предложения", source=None):
+    """Парсит новые письма с предложениями из Outlook или локального почтового ящика.
+    Обрабатываются только письма новее сохраненного курсора (ingest_state.json)."""
     try:
-        outlook = init_outlook()
-        namespace = outlook.GetNamespace("MAPI")
-        inbox = namespace.GetDefaultFolder(6)  # Inbox
-        folder = inbox
-        if folder_name != "Входящие":
-            for i in range(1, inbox.Folders.Count + 1):
-                if inbox.Folders.Item(i).Name == folder_name:
-                    folder = inbox.Folders.Item(i)
-                    break
-        messages = folder.Items
+        reader = open_reader(source or MAILBOX_SOURCE, folder_name)
+        cursor = load_cursor(reader.source_id)
         new_offers = []
-        for msg in messages:
-            if msg.UnRead:
-                body = msg.Body
-                # Улучшенное получение email адреса
-                sender_email = msg.SenderEmailAddress
-                # Попытка получить SMTP адрес, если SenderEmailAddress не является обычным email
-                if not (sender_email and "@" in sender_email and "." in sender_email.split("@")[-1]):
-                    try:
-                        sender_obj = msg.Sender
-                        if sender_obj:
-                            # Попробуем получить SMTP адрес через свойство PropertyAccessor
-                            # Это может не сработать для всех типов отправителей
-                            smtp_address = sender_obj.PropertyAccessor.GetProperty("http://schemas.microsoft.com/mapi/proptag/0x39FE001E")
-                            if smtp_address and "@" in smtp_address:
-                                sender_email = smtp_address
-                    except Exception as e:
-                        # Если не удалось получить SMTP адрес, оставляем оригинальный SenderEmailAddress
-                        pass
-                offer_data = {
-                    "sender": msg.SenderName,
-                    "sender_email": sender_email,  # Используем улучшенный email
-                    "email_date": msg.ReceivedTime.strftime("%Y-%m-%d %H:%M:%S"),
-                    "subject": msg.Subject,
-                    "bid_id": "",
-                    "order_number": "—",
-                    "rate": "",
-                    "currency": "",
-                    "conditions": "",
-                    "status": "Новое",
-                    "costs": []
-                }
-                # Парсинг ID заявки
-                # Ищем ID заявки, который может содержать буквы, цифры, дефисы и подчеркивания
-                id_patterns = [
-                    r"ID\s*заявки[^\w]*([A-Za-z0-9\-_]+)",
-                    r"Заявка\s*№?[^\w]*([A-Za-z0-9\-_]+)",
-                    r"(SHIP-\d{8}-\d{4})"  # Специфичный формат
-                ]
-                for pattern in id_patterns:
-                    id_match = re.search(pattern, body, re.IGNORECASE)
-                    if id_match:
-                        offer_data["bid_id"] = id_match.group(1)
-                        break
-                # Парсинг номера заказа
-                # Ищем номер заказа, который может содержать буквы, цифры, дефисы, подчеркивания и пробелы
-                order_patterns = [
-                    r"Номер\s*заказа[^\w]*([A-Z0-9]{2}\d{2}[-_]\d{3,})",
-                    r"Номер\s*заказа[^\w]*([A-Za-z0-9\-_\s/]+?)(?:\r?|$)",
-                    r"Order\s*Number[^\w]*([A-Za-z0-9\-_\s/]+?)(?:\r?|$)"
-                ]
-                for pattern in order_patterns:
-                    order_number_match = re.search(pattern, body, re.IGNORECASE)
-                    if order_number_match:
-                        offer_data["order_number"] = order_number_match.group(1).strip()
-                        #print(f"DEBUG: Extracted order_number: '{offer_data['order_number']}' for email from {sender_email}") проверить что спарсил!!!!!!    
-                        break
-                if offer_data["order_number"] == "—":  # Если не нашли по паттернам
-                    # Более общий поиск
-                    #order_number_match = re.search(r"([A-Z0-9]+[-_]?[A-Z0-9]+)", body, re.IGNORECASE) -старый!!!!!!!!!!!!!
-                    order_number_match = re.search(r"([A-Z]{2,}\d+[-_]\d{2,})", body, re.IGNORECASE)
-                    if order_number_match:
-                        offer_data["order_number"] = order_number_match.group(1)
-                # Парсинг ставки
-                rate_match = re.search(r"Ставка:\s*([\d,.]+)\s*([A-Z]{3})", body, re.IGNORECASE)
-                if rate_match:
-                    offer_data["rate"] = rate_match.group(1).replace(',', '.').strip()
-                    offer_data["currency"] = rate_match.group(2).strip()
-                # Парсинг условий
-                cond_match = re.search(r"Условия:\s*(.*?)(?:\r?\r?|\r??$)", body, re.DOTALL | re.IGNORECASE)
-                if cond_match:
-                    offer_data["conditions"] = cond_match.group(1).strip()
-                # Парсинг стоимости
-                cost_start = body.find("Расчет стоимости")
-                if cost_start > -1:
-                    cost_end = body.find("Условия оплаты", cost_start) or \
-                               body.find("Примечания", cost_start) or \
-                               len(body)
-                    cost_section = body[cost_start:cost_end]
-                    # ИСПРАВЛЕНО: Используем вместо символа новой строки в строке
-                    lines = [line.strip() for line in cost_section.split('\n') if line.strip()]
-                    cost_items = [
-                        "Pre-carriage",
-                        "OTHC (Origin Terminal Handling Charges)",
-                        "Sea freight",
-                        "ЖД перевозка",
-                        "Прямое ЖД",
-                        "Станционные затраты",
-                        "Доставка со станции"
-                    ]
-                    for line in lines[1:]:  # Пропускаем заголовок
-                      for item in cost_items:
-                        if line.startswith(item):
-                            # --- ИСПРАВЛЕНИЕ НАЧАЛО ---
-                            # Ищем стоимость и валюту в оставшейся части строки после названия пункта
-                            # Пример строки: "ЖД перевозка            213 300     RUB"
-                            # или "Sea freight            1 470,50     USD"
-                            # или "Pre-carriage            0.0     USD"
-                            rest_of_line = line[len(item):].strip()
-                            # Используем регулярное выражение для поиска числа (возможно с пробелами/запятыми/точками) и валюты
-                            # ([\d\s.,]+) - группа 1: цифры, пробелы, точки, запятые
-                            # \s+ - один или несколько пробелов
-                            # ([A-Z]{3}) - группа 2: ровно 3 заглавные буквы (валюта)
-                            cost_currency_match = re.search(r'([\d\s.,]+)\s+([A-Z]{3})', rest_of_line)
-                            if cost_currency_match:
-                                cost_str = cost_currency_match.group(1) # Например, "213 300" или "1 470,50" или "0.0"
-                                currency = cost_currency_match.group(2) # Например, "RUB" или "USD"
-                                try:
-                                    # Убираем пробелы и заменяем запятую на точку для корректного парсинга float
-                                    cost_str_cleaned = cost_str.replace(' ', '').replace(',', '.')
-                                    cost = float(cost_str_cleaned)
-                                    offer_data["costs"].append({
-                                        "ITEM": item,
-                                        "COST": cost,
-                                        "CURRENCY": currency
-                                    })
-                                except ValueError:
-                                    # Если не удалось преобразовать в число, пропускаем
-                                    # st.warning(f"Не удалось распарсить стоимость '{cost_str}' в строке: {line}")
-                                    continue
-                                break # Нашли нужный пункт, переходим к следующей строке
-                            else:
-                                # Если не нашли по паттерну, можно попробовать старый способ как запасной вариант
-                                # (или просто пропустить)
-                                # st.warning(f"Не удалось извлечь стоимость и валюту из строки: {line}")
-                                continue
-                            # --- ИСПРАВЛЕНИЕ КОНЕЦ ---                if offer_data["bid_id"]:
+        processed = []
+        with reader:
+            for msg in reader.iter_new(cursor):
+                processed.append(msg)
+                result = offer_parser.parse(msg["body"])
+                if result.is_offer:
+                    offer_data = build_offer(msg, result)
+                    offer_data["parse_confidence"] = round(result.confidence, 2)
                     new_offers.append(offer_data)
-                    msg.UnRead = False
+                    reader.mark_read(msg)
         if new_offers:
             try:
-                existing_offers = load_json_file(OFFERS_FILE)
-                save_json_file(OFFERS_FILE, existing_offers + new_offers)
+                store.add_offers(new_offers)
             except Exception as e:
                 st.error(f"Ошибка сохранения предложений: {str(e)}")
+                return new_offers
+        # Курсор сдвигаем только после успешного сохранения предложений
+        if processed:
+            save_cursor(reader.source_id, advance_cursor(cursor, processed))
+        if new_offers:
             return new_offers
         else:
             st.info("Новых предложений не найдено")
@@ -416,8 +335,6 @@ def parse_offers_from_outlook(folder_name="Предложения"):
     except Exception as e:
         st.error(f"Ошибка при парсинге писем: {str(e)}")
         return []
-    finally:
-        pythoncom.CoUninitialize()
 
 # --- Форматирование email для перевозчика ---
 def format_bid_email(bid):
@@ -502,7 +419,7 @@ def create_bid_form():
             port_from = st.text_input("Порт отправки*", "Shanghai")
             ready_date = st.date_input("Дата готовности груза*", datetime.now())
             container_type = st.selectbox("Тип контейнера*", ["20 фут", "40 фут", "40 фут HQ", "Авто 20тн", "Сборный груз"] )
-            delivery_method = st.selectbox("Способ доставки*", ["Море+ЖД", "Прямое ЖД", "Авто", "Авиа"], key="delivery_method")
+            delivery_method = st.selectbox("Способ доставки*", DELIVERY_METHODS, key="delivery_method")
         st.subheader("Детали груза")
         cargo_type = st.text_input("Тип груза*", "не опасный")
         hs_code = st.text_input("Код ТНВЭД", "")
@@ -534,8 +451,16 @@ def create_bid_form():
                 else:
                     total_size += file.size
                     valid_files.append(file)
-            if total_size > 15 * 1024 * 1024:
-                st.error("Суммарный размер всех файлов превышает 15 МБ. Некоторые файлы будут проигнорированы.")
+        # Файлы из предыдущих заявок берутся из хранилища вложений без повторной загрузки
+        stored_files = attachment_store.list()
+        reused_files = st.multiselect(
+            "Файлы из предыдущих заявок",
+            stored_files,
+            format_func=lambda item: f"{item['name']} ({item['size'] / 1024:.0f} КБ, заявки: {', '.join(item['refs'][-3:])})"
+        ) if stored_files else []
+        total_size += sum(item["size"] for item in reused_files)
+        if total_size > 15 * 1024 * 1024:
+            st.error("Суммарный размер всех файлов превышает 15 МБ. Некоторые файлы будут проигнорированы.")
         st.subheader("Финансовые условия")
         payment_terms = st.text_area("Условия оплаты*", 
                                    "50% TT in advance / 50% 14 days after delivery")
@@ -592,19 +517,20 @@ def create_bid_form():
                     "costs": costs
                 }
                 try:
-                    bids = load_json_file(BIDS_FILE)
-                    bids.append(bid_data)
-                    save_json_file(BIDS_FILE, bids)
-                    carriers = load_json_file(CARRIERS_FILE)
+                    # Файлы сохраняются один раз по хэшу содержимого; заявка хранит ссылки на них
+                    attachment_links = [attachment_store.put(file.getbuffer(), file.name) for file in valid_files]
+                    attachment_links += [{key: item[key] for key in ("sha256", "name", "size")} for item in reused_files
+                                         if item["sha256"] not in {link["sha256"] for link in attachment_links}]
+                    bid_data["attachments"] = attachment_links
+                    store.add_bid(bid_data)
+                    attachment_store.acquire(bid_id, attachment_links)
+                    carriers = store.load_carriers()
                     email_body = format_bid_email(bid_data)
                     success_count = 0
-                    attachments = []
-                    if valid_files:
-                        for file in valid_files:
-                            temp_file_path = os.path.join(tempfile.gettempdir(), file.name)
-                            with open(temp_file_path, "wb") as f:
-                                f.write(file.getbuffer())
-                            attachments.append(temp_file_path)
+                    attachments = [attachment_store.path(link) for link in attachment_links]
+                    # Формируем список писем для рассылки
+                    messages = []
+                    delivery_report = []
                     for carrier in carriers:
                         # Разделяем email по всем возможным разделителям: запятая, точка с запятой, двоеточие
                         email_list = []
@@ -614,29 +540,73 @@ def create_bid_form():
                             email_list = [e.strip() for e in normalized_emails.split(',') if e.strip()]
                         for email in email_list:
                             if email and '@' in email:  # Проверяем, что email содержит @
-                                if send_email(email, f"Новая заявка {bid_id}", email_body, attachments):
-                                    success_count += 1
-                                else:
-                                    st.error(f"Ошибка отправки для {carrier['name']} ({email})")
+                                messages.append({
+                                    "carrier": carrier['name'],
+                                    "to": email,
+                                    "subject": f"Новая заявка {bid_id}",
+                                    "body": email_body,
+                                    "attachments": attachments
+                                })
                             elif email:  # Если email есть, но не содержит @
                                 st.warning(f"Некорректный email для {carrier['name']}: {email}")
-                    # Удаление временных файлов
-                    if attachments:
-                        for file in attachments:
-                            try:
-                                os.remove(file)
-                            except Exception as e:
-                                st.warning(f"Не удалось удалить временный файл {file}: {e}")
+                                delivery_report.append({
+                                    "carrier": carrier['name'],
+                                    "email": email,
+                                    "status": "invalid",
+                                    "attempts": 0,
+                                    "error": "Некорректный email",
+                                    "sent_at": None
+                                })
+                    # Параллельная рассылка с ограничением скорости и отображением прогресса
+                    progress_bar = st.progress(0.0, text="Отправка заявки перевозчикам...")
+                    def update_progress(done, total, entry):
+                        progress_bar.progress(done / total, text=f"Отправлено {done} из {total}: {entry['email']}")
+                    delivery_report.extend(send_bulk(messages, on_progress=update_progress))
+                    for entry in delivery_report:
+                        if entry["status"] == "sent":
+                            success_count += 1
+                        elif entry["status"] == "failed":
+                            st.error(f"Ошибка отправки для {entry['carrier']} ({entry['email']}): {entry['error']}")
+                    # Сохраняем отчет о доставке вместе с заявкой
+                    store.update_bid(bid_id, {"delivery_report": delivery_report})
                     # Отображение результата
                     if success_count > 0:
                         st.success(f"Заявка {bid_id} создана! Уведомления отправлены {success_count} перевозчикам")
-                        time.sleep(3) # Задержка для отображения сообщения
                     else:
                         st.warning("Заявка создана, но не удалось отправить уведомления перевозчикам")
-                        time.sleep(3) # Задержка для отображения сообщения
                 except Exception as e:
                     st.error(f"Ошибка при сохранении заявки: {str(e)}")
-                    time.sleep(3) # Задержка для отображения сообщения
+# --- Экспорт таблиц ---
+def export_widget(key, build_frame, sheet_name, file_stem, signature=None):
+    """Экспорт по запросу: файл строится только по кнопке "Подготовить файл" и кэшируется
+    на диске по хэшу содержимого. signature - параметры данных (например, фильтры):
+    при их изменении подготовленный файл перестает предлагаться к скачиванию."""
+    formats = available_formats()
+    export_format = st.selectbox("Формат", list(formats), format_func=lambda f: formats[f]["label"],
+                                 key=f"{key}_format")
+    if st.button("Подготовить файл", key=f"{key}_prepare"):
+        try:
+            frame = build_frame()
+            st.session_state[f"{key}_export"] = {
+                "path": export_frame(frame, export_format, sheet_name),
+                "format": export_format,
+                "rows": len(frame),
+                "signature": signature,
+                "prepared_at": datetime.now().strftime('%Y%m%d_%H%M'),
+            }
+        except Exception as e:
+            st.error(f"Ошибка при подготовке экспорта: {str(e)}")
+    prepared = st.session_state.get(f"{key}_export")
+    if prepared and prepared["signature"] == signature and os.path.exists(prepared["path"]):
+        file_format = formats.get(prepared["format"], {})
+        with open(prepared["path"], 'rb') as f:
+            st.download_button(
+                label=f"📥 Скачать {file_format['label']} ({prepared['rows']} строк)",
+                data=f,
+                file_name=f"{file_stem}_{prepared['prepared_at']}.{file_format['ext']}",
+                mime=file_format["mime"],
+                key=f"{key}_download"
+            )
 # --- Просмотр предложений ---
 def view_offers():
     """Отображает и управляет предложениями от перевозчиков"""
@@ -646,76 +616,70 @@ def view_offers():
         if st.button("🔄 Обновить список предложений"):
             new_offers = parse_offers_from_outlook()
             if new_offers:
-                st.success(f"Найдено {len(new_offers)} новых предложений")
-                time.sleep(3) # Задержка для отображения сообщения
+                flash(f"Найдено {len(new_offers)} новых предложений")
             else:
-                st.info("Новых предложений не найдено")
-                time.sleep(3) # Задержка для отображения сообщения
+                flash("Новых предложений не найдено", "info")
             st.rerun()
-    offers = load_json_file(OFFERS_FILE)
+    # --- Фильтры, сортировка и страница ---
+    # Отбор и разбиение на страницы выполняет хранилище, таблица строится только для текущей страницы
+    with st.expander("🔎 Фильтры и сортировка"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            bid_prefix = st.text_input("ID заявки (начало)")
+            carrier_filter = st.text_input("Перевозчик (часть названия)")
+        with col2:
+            status_filter = st.multiselect("Статус", OFFER_STATUSES)
+            delivery_filter = st.multiselect("Способ доставки", DELIVERY_METHODS)
+        with col3:
+            date_range = st.date_input("Период получения", value=(), format="DD.MM.YYYY")
+            sort_label = st.selectbox("Сортировка", list(OFFER_SORT_OPTIONS))
+            descending = st.checkbox("По убыванию", value=True)
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else date_from
+    page_size = st.session_state.get("offers_page_size", OFFERS_PAGE_SIZES[0])
+    filters = (bid_prefix, carrier_filter, tuple(status_filter), tuple(delivery_filter),
+               str(date_from), str(date_to), sort_label, descending, page_size)
+    # При смене фильтров возвращаемся на первую страницу
+    if st.session_state.get("offers_filters") != filters:
+        st.session_state.offers_filters = filters
+        st.session_state.offers_page = 1
+    query = OfferQuery(
+        bid_prefix=bid_prefix, carrier=carrier_filter, statuses=status_filter,
+        date_from=date_from, date_to=date_to, delivery_methods=delivery_filter,
+        sort_by=OFFER_SORT_OPTIONS[sort_label], descending=descending,
+        page=st.session_state.get("offers_page", 1), page_size=page_size
+    )
+    with span("offers_query"):
+        offers, total_offers = store.query_offers(query)
+        page_count = max(1, -(-total_offers // page_size))
+        if query.page > page_count:
+            query.page = page_count
+            offers, total_offers = store.query_offers(query)
+    st.session_state.offers_page = query.page
     if offers:
+        col1, col2, col3 = st.columns([1, 1, 4])
+        with col1:
+            st.number_input("Страница", min_value=1, max_value=page_count, step=1, key="offers_page")
+        with col2:
+            st.selectbox("Строк на странице", OFFERS_PAGE_SIZES, key="offers_page_size")
+        with col3:
+            st.caption(f"Найдено предложений: {total_offers}, страница {query.page} из {page_count}")
+        # Все предложения по заявкам страницы - для выбора лучшего предложения заявки
+        peer_offers = store.offers_for_bids({offer["bid_id"] for offer in offers})
         # Получаем текущие курсы валют
         rates = get_currency_rates()
-        # Подготовка данных для сравнения
-        comparison_data = []
-        for offer in offers:
-            total_rub = 0.0
-            costs_dict = {}
-            for cost in offer.get('costs', []):
-                if cost.get('ITEM'):
-                    cost_value = cost.get('COST', 0)
-                    currency = cost.get('CURRENCY', '')
-                    if currency == "USD":
-                        converted = cost_value * rates["USD"]
-                    elif currency == "EUR":
-                        converted = cost_value * rates["EUR"]
-                    else:
-                        converted = cost_value
-                    total_rub += converted
-                    costs_dict[cost['ITEM']] = {
-                        'COST': cost_value,
-                        'CURRENCY': currency,
-                        'COST_RUB': converted
-                    }
-            comparison_data.append({
-                "Дата получения": offer["email_date"],
-                "Перевозчик": offer["sender"],
-                "ID заявки": offer["bid_id"],
-                "Номер заказа": offer.get("order_number", "—"),
-                "Pre-carriage": f"{costs_dict.get('Pre-carriage', {}).get('COST', 0):.2f} {costs_dict.get('Pre-carriage', {}).get('CURRENCY', '')}",
-                "OTHC": f"{costs_dict.get('OTHC (Origin Terminal Handling Charges)', {}).get('COST', 0):.2f} {costs_dict.get('OTHC (Origin Terminal Handling Charges)', {}).get('CURRENCY', '')}",
-                "Sea freight": f"{costs_dict.get('Sea freight', {}).get('COST', 0):.2f} {costs_dict.get('Sea freight', {}).get('CURRENCY', '')}",
-                "ЖД перевозка": f"{costs_dict.get('ЖД перевозка', {}).get('COST', 0):.2f} {costs_dict.get('ЖД перевозка', {}).get('CURRENCY', '')}",
-                "Прямое ЖД": f"{costs_dict.get('Прямое ЖД', {}).get('COST', 0):.2f} {costs_dict.get('Прямое ЖД', {}).get('CURRENCY', '')}",
-                "Станционные затраты": f"{costs_dict.get('Станционные затраты', {}).get('COST', 0):.2f} {costs_dict.get('Станционные затраты', {}).get('CURRENCY', '')}",
-                "Доставка со станции": f"{costs_dict.get('Доставка со станции', {}).get('COST', 0):.2f} {costs_dict.get('Доставка со станции', {}).get('CURRENCY', '')}",
-                "Итого (RUB)": f"{total_rub:.2f} ₽",
-                "Статус": offer.get("status", "Новое")
-            })
-        df_comparison = pd.DataFrame(comparison_data)
-        # Фильтрация по ID заявки
-        bid_id_filter = st.text_input("Фильтр по ID заявки")
-        if bid_id_filter:
-            df_comparison = df_comparison[df_comparison['ID заявки'].str.contains(bid_id_filter, case=False)]
-        # Вычисляем минимальную сумму для каждой группы ID заявки
-        df_comparison['min_total_rub'] = df_comparison.groupby('ID заявки')['Итого (RUB)'].transform('min')
-        # Создаем копию для отображения с звездочками
-        df_display = df_comparison.copy()
-                    # Ограничиваем длину строк в столбцах "Перевозчик" и "Дата получения" для отображения
-                    # Используем .apply() с лямбда-функцией для безопасной обрезки
-        df_display["Перевозчик"] = df_display["Перевозчик"].apply(
-            lambda x: x[:20] if isinstance(x, str) else x
-        )
-        df_display["Дата получения"] = df_display["Дата получения"].apply(
-            lambda x: x[:10] if isinstance(x, str) else x
-        )
-        # Добавляем звездочки к минимальным значениям в колонке "Итого (RUB)"
-        for bid_id in df_display['ID заявки'].unique():
-            min_value = df_display[df_display['ID заявки'] == bid_id]['Итого (RUB)'].min()
-            df_display.loc[(df_display['ID заявки'] == bid_id) & (df_display['Итого (RUB)'] == min_value), 'Итого (RUB)'] = \
-                df_display.loc[(df_display['ID заявки'] == bid_id) & (df_display['Итого (RUB)'] == min_value), 'Итого (RUB)'].apply(
-                    lambda x: f"⭐ {x}"
-                )
+        rate_mode = st.radio("Курс пересчета в рубли", ["Текущий", "На дату предложения"], horizontal=True)
+        rate_history = None
+        if rate_mode == "На дату предложения":
+            rate_service = get_rate_service()
+            # Недостающие даты догружаются из архива ЦБ в фоне и учитываются при следующем обновлении
+            rate_service.request_dates(offer.get("email_date", "")[:10] for offer in peer_offers)
+            rate_history = rate_history_frame(rate_service.history())
+        # Числовая таблица сравнения (итоги и лучшие предложения считаются до форматирования)
+        with span("offers_table"):
+            comparison = build_comparison(offers, rates, rate_history, peer_offers)
+            # Таблица для отображения: строки с форматированием и ⭐ у самого дешевого предложения заявки
+            df_display = format_comparison(comparison)
         # Отображение таблицы с возможностью выбора строк
         edited_df = st.data_editor(
             df_display,
@@ -727,7 +691,7 @@ def view_offers():
             column_config={
                 "Статус": st.column_config.SelectboxColumn(
                     "Статус",
-                    options=["Новое", "В работе", "Отклонено", "Принято"],
+                    options=OFFER_STATUSES,
                     required=True
                 )
             }
@@ -744,54 +708,37 @@ def view_offers():
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("🖨️ Сгенерировать договор"):
-                selected_row = edited_df.iloc[selected_offer_idx]
-                offers = load_json_file(OFFERS_FILE)
-                selected_offer = next(
-                    (o for o in offers 
-                     if o["bid_id"] == selected_row["ID заявки"] 
-                     and o["sender"] == selected_row["Перевозчик"]),
-                    None
-                )
+                # Полные значения берем из числовой таблицы (в отображении имя перевозчика обрезано)
+                selected_row = comparison.loc[edited_df.index[selected_offer_idx]]
+                selected_offer = store.find_offer(selected_row["bid_id"], selected_row["sender"])
                 if selected_offer:
-                    bids = load_json_file(BIDS_FILE)
-                    selected_bid = next((b for b in bids if b["id"] == selected_offer["bid_id"]), None)
+                    selected_bid = store.get_bid(selected_offer["bid_id"])
                     if selected_bid:
-                        contract_path = generate_contract(selected_bid, selected_offer)
+                        contract_path, contract_data = generate_contract(selected_bid, selected_offer)
                         if contract_path:
                             st.success("Договор успешно сгенерирован!")
-                            time.sleep(3) # Задержка для отображения сообщения
                             # Кнопка скачивания
-                            with open(contract_path, "rb") as f:
-                                st.download_button(
-                                    label="📥 Скачать договор",
-                                    data=f,
-                                    file_name=f"Договор_{selected_bid['id']}_{selected_offer['sender']}.docx",
-                                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                                )
+                            st.download_button(
+                                label="📥 Скачать договор",
+                                data=contract_data,
+                                file_name=f"Договор_{selected_bid['id']}_{selected_offer['sender']}.docx",
+                                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+                            )
                         else:
                             st.error("Ошибка при генерации договора")
-                            time.sleep(3) # Задержка для отображения сообщения
                     else:
                         st.error("Не найдена соответствующая заявка")
-                        time.sleep(3) # Задержка для отображения сообщения
                 else:
                     st.error("Не найдено соответствующее предложение")
-                    time.sleep(3) # Задержка для отображения сообщения
         with col2:
             if st.button("📤 Отправить поставщику"):
-                selected_row = edited_df.iloc[selected_offer_idx]
-                offers = load_json_file(OFFERS_FILE)
-                selected_offer = next(
-                    (o for o in offers 
-                     if o["bid_id"] == selected_row["ID заявки"] 
-                     and o["sender"] == selected_row["Перевозчик"]),
-                    None
-                )
+                # Полные значения берем из числовой таблицы (в отображении имя перевозчика обрезано)
+                selected_row = comparison.loc[edited_df.index[selected_offer_idx]]
+                selected_offer = store.find_offer(selected_row["bid_id"], selected_row["sender"])
                 if selected_offer:
-                    bids = load_json_file(BIDS_FILE)
-                    selected_bid = next((b for b in bids if b["id"] == selected_offer["bid_id"]), None)
+                    selected_bid = store.get_bid(selected_offer["bid_id"])
                     if selected_bid:
-                        contract_path = generate_contract(selected_bid, selected_offer)
+                        contract_path, _ = generate_contract(selected_bid, selected_offer)
                         if contract_path:
                             subject = f"Договор по заявке {selected_bid['id']}"
                             body = f"""
@@ -803,130 +750,186 @@ def view_offers():
                             """
                             if send_email(selected_offer['sender_email'], subject, body, attachments=[contract_path]):
                                 st.success("Договор успешно отправлен!")
-                                time.sleep(3) # Задержка для отображения сообщения
                             else:
                                 st.error("Ошибка при отправке договора")
-                                time.sleep(3) # Задержка для отображения сообщения
                         else:
                             st.error("Ошибка при генерации договора")
-                            time.sleep(3) # Задержка для отображения сообщения
                     else:
                         st.error("Не найдена соответствующая заявка")
-                        time.sleep(3) # Задержка для отображения сообщения
                 else:
                     st.error("Не найдено соответствующее предложение")
-                    time.sleep(3) # Задержка для отображения сообщения
         with col3:
             if st.button("💾 Сохранить изменения статусов"):
                 try:
-                    # Загружаем актуальные данные перед сохранением
-                    offers = load_json_file(OFFERS_FILE)
-                    updated_offers = []
-                    sent_notifications = set()  # Для отслеживания отправленных уведомлений
-                    success_count = 0
-                    now = datetime.now()
-                    # Создаем словарь для быстрого поиска новых статусов
-                    new_statuses = {}
-                    for idx, row in edited_df.iterrows():
-                        key = (row["ID заявки"], row["Перевозчик"])
-                        new_statuses[key] = row["Статус"]
-                    # Обновляем статусы в списке всех предложений
-                    for offer in offers:
-                        key = (offer["bid_id"], offer["sender"])
-                        if key in new_statuses:
-                            old_status = offer.get("status", "Новое")
-                            new_status = new_statuses[key]
-                            offer["status"] = new_status
-                            # Проверка: изменился ли статус на "Отклонено" или "Принято"
-                            if new_status in ["Отклонено", "Принято"] and old_status != new_status:
-                                # Защита от повторной отправки: минимум 1 минута между уведомлениями для одного перевозчика
-                                last_change = offer.get("last_status_change")
-                                should_send = True
-                                if last_change:
-                                    try:
-                                        time_diff = (now - datetime.fromisoformat(last_change)).total_seconds()
-                                        if time_diff < 60:  # Не чаще 1 раза в минуту
-                                            st.warning(f"⚠️ Слишком частое обновление для {offer['sender']}")
-                                            should_send = False
-                                    except Exception:
-                                        # Если ошибка в парсинге времени, отправляем
-                                        pass
-                                # Проверяем, было ли уже отправлено уведомление для этого перевозчика в этой сессии
-                                if offer['sender'] in sent_notifications:
-                                    should_send = False
-                                if should_send:
-                                    # Формирование сообщения
-                                    subject = f"Обновление статуса заявки {offer['bid_id']}"
-                                    body = f"""Здравствуйте, {offer['sender']}!
-Статус вашей заявки с ID {offer['bid_id']} изменён на "{new_status}".
-Подробности:
-- Перевозчик: {offer['sender']}
-- ID заявки: {offer['bid_id']}
-- Статус: {new_status}
-С уважением,
-Логистическая система
-"""
-                                    # Попытка отправки
-                                    if send_email(offer['sender_email'], subject, body):
-                                        st.success(f"✅ Уведомление отправлено {offer['sender']} (статус: {new_status})")
-                                        success_count += 1
-                                        offer["last_status_change"] = now.isoformat()  # Сохраняем время
-                                        sent_notifications.add(offer['sender'])  # Добавляем в список отправленных
-                                    else:
-                                        st.warning(f"⚠️ Не удалось отправить уведомление для {offer['sender']}")
-                        updated_offers.append(offer)
-                    # Сохраняем обновленные данные
-                    save_json_file(OFFERS_FILE, updated_offers)
-                    st.success(f"✅ Статусы предложений обновлены! Уведомления отправлены {success_count} перевозчикам")
-                    time.sleep(2)
+                    status_changes = {}  # Изменения для записи в хранилище: ключ -> поля
+                    notify_offers = []  # Предложения, перевозчиков которых нужно уведомить
+                    edited_keys = zip(comparison.loc[edited_df.index, "bid_id"], comparison.loc[edited_df.index, "sender"])
+                    for key, new_status in zip(edited_keys, edited_df["Статус"]):
+                        # Актуальное состояние читаем только для строк текущей страницы
+                        offer = store.find_offer(*key)
+                        if offer is None:
+                            continue
+                        old_status = offer.get("status", "Новое")
+                        if old_status != new_status:
+                            status_changes.setdefault(key, {})["status"] = new_status
+                            # Уведомляем при переходе в "Отклонено" или "Принято"
+                            if new_status in NOTIFY_STATUSES:
+                                notify_offers.append((offer, new_status))
+                    # Сначала сохраняем статусы, затем ставим уведомления в очередь:
+                    # письма отправляет фоновый обработчик (повторы, не чаще раза в минуту на перевозчика)
+                    if status_changes:
+                        store.update_offers(status_changes)
+                    notification_worker = get_notification_worker(store)
+                    queued_count = sum(
+                        notification_worker.outbox.enqueue(offer, new_status) for offer, new_status in notify_offers
+                    )
+                    if queued_count:
+                        notification_worker.wake()
+                    flash(f"Статусы предложений обновлены! Уведомлений в очереди на отправку: {queued_count}")
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Ошибка при обновлении статусов: {str(e)}")
-                    time.sleep(3)
+        # --- Уведомления о смене статусов ---
+        notification_worker = get_notification_worker(store)
+        outbox_counts = notification_worker.outbox.summary()
+        with st.expander(f"📬 Уведомления перевозчикам (в очереди: {outbox_counts['pending'] + outbox_counts['sending']}, "
+                         f"ошибок: {outbox_counts['failed']})"):
+            col1, col2, col3 = st.columns(3)
+            col1.metric("В очереди", outbox_counts["pending"] + outbox_counts["sending"])
+            col2.metric("Отправлено", outbox_counts["sent"])
+            col3.metric("Ошибки", outbox_counts["failed"])
+            outbox_records = notification_worker.outbox.load()[-50:]
+            if outbox_records:
+                state_names = {"pending": "В очереди", "sending": "Отправляется", "sent": "Отправлено", "failed": "Ошибка"}
+                st.dataframe(
+                    pd.DataFrame([{
+                        "Перевозчик": record["carrier"],
+                        "ID заявки": record["offer_key"][0],
+                        "Статус предложения": record["offer_status"],
+                        "Доставка": state_names.get(record["state"], record["state"]),
+                        "Попыток": record["attempts"],
+                        "Отправлено": (record["sent_at"] or "")[:19],
+                        "Ошибка": record["error"],
+                    } for record in reversed(outbox_records)]),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            if outbox_counts["failed"] and st.button("🔁 Повторить неотправленные"):
+                flash(f"Уведомлений возвращено в очередь: {notification_worker.outbox.retry_failed()}", "info")
+                notification_worker.wake()
+                st.rerun()
+        # --- Пакетная генерация договоров ---
+        with st.expander("📦 Пакетная генерация договоров"):
+            batch_selection = st.multiselect(
+                "Предложения для договоров (по умолчанию - все принятые)",
+                options=list(edited_df.index),
+                default=list(edited_df.index[edited_df["Статус"] == "Принято"]),
+                format_func=lambda idx: f"{edited_df.at[idx, 'Перевозчик']} - {edited_df.at[idx, 'ID заявки']}"
+            )
+            if st.button("📦 Сгенерировать договоры (ZIP)", disabled=not batch_selection):
+                with st.spinner("Генерация договоров..."):
+                    zip_data, generated_count, batch_errors = generate_contracts_batch(comparison.loc[batch_selection])
+                for error in batch_errors:
+                    st.error(f"Ошибка при генерации договора: {error}")
+                if generated_count:
+                    st.success(f"Сгенерировано договоров: {generated_count}")
+                    st.download_button(
+                        label="📥 Скачать архив договоров",
+                        data=zip_data,
+                        file_name=f"contracts_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                        mime="application/zip"
+                    )
         # --- Удаление отклоненных предложений ---
         if st.button("🗑️ Удалить отклоненные"):
             try:
-                # Создаем множество (set) для быстрого поиска отклоненных предложений
-                rejected_keys = {
-                    (row["ID заявки"], row["Перевозчик"]) 
-                    for _, row in edited_df.iterrows() 
-                    if row["Статус"] == "Отклонено"
-                }
-                # Фильтруем список предложений, исключая отклоненные
-                filtered_offers = [
-                    offer for offer in offers 
-                    if (offer["bid_id"], offer["sender"]) not in rejected_keys
-                ]
-                save_json_file(OFFERS_FILE, filtered_offers)
-                st.success("✅ Отклоненные предложения удалены!")
-                time.sleep(3) # Задержка для отображения сообщения
+                # Отклоненные на текущей странице (с учетом несохраненных правок) и на остальных страницах выборки
+                rejected_index = edited_df.index[edited_df["Статус"] == "Отклонено"]
+                rejected_keys = set(zip(comparison.loc[rejected_index, "bid_id"], comparison.loc[rejected_index, "sender"]))
+                page_keys = set(zip(comparison["bid_id"], comparison["sender"]))
+                if not query.statuses or "Отклонено" in query.statuses:
+                    rejected_query = copy.copy(query)
+                    rejected_query.statuses, rejected_query.page_size = ["Отклонено"], None
+                    rejected_offers, _ = store.query_offers(rejected_query)
+                    rejected_keys.update(
+                        key for key in ((offer["bid_id"], offer["sender"]) for offer in rejected_offers)
+                        if key not in page_keys
+                    )
+                # Удаляем отклоненные предложения из хранилища
+                store.delete_offers(rejected_keys)
+                flash("Отклоненные предложения удалены!")
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ Ошибка при удалении предложений: {str(e)}")
-                time.sleep(3) # Задержка для отображения сообщения
-        # --- Экспорт в Excel ---
-        def to_excel(df):
-            output = BytesIO()
-            writer = pd.ExcelWriter(output, engine='xlsxwriter')
-            df.to_excel(writer, index=False, sheet_name='Предложения')
-            writer.close()
-            processed_data = output.getvalue()
-            return processed_data
-        excel_data = to_excel(edited_df)
-        st.download_button(
-            label="📊 Экспорт в Excel",
-            data=excel_data,
-            file_name=f"offers_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        # --- Экспорт ---
+        with st.expander("📊 Экспорт"):
+            export_scope = st.radio("Данные", [f"Вся выборка ({total_offers})", "Текущая страница"],
+                                    horizontal=True, key="offers_export_scope")
+            whole_selection = export_scope != "Текущая страница"
+
+            def build_export_frame():
+                if not whole_selection:
+                    return edited_df
+                # Все предложения выборки без разбивки на страницы, с теми же курсами пересчета
+                export_query = copy.copy(query)
+                export_query.page_size = None
+                export_offers, _ = store.query_offers(export_query)
+                export_peers = store.offers_for_bids({offer["bid_id"] for offer in export_offers})
+                return format_comparison(build_comparison(export_offers, rates, rate_history, export_peers))
+            export_widget(
+                "offers", build_export_frame, "Предложения", "offers",
+                signature=(st.session_state.offers_filters, rate_mode, whole_selection or query.page)
+            )
     else:
         st.info("ℹ️ Нет данных о предложениях")
+    # --- Архив ---
+    # Партиции архива читаются только для выбранных месяцев
+    with st.expander("🗄️ Архив предложений"):
+        st.caption(f"Заявки старше {ARCHIVE_AFTER_DAYS} дней без новых предложений переносятся в архив автоматически")
+        if st.button("🗄️ Архивировать сейчас"):
+            try:
+                result = archive_closed_bids(store)
+                flash(f"В архив перенесено заявок: {result['bids']}, предложений: {result['offers']}, "
+                      f"предложений без заявки: {result['orphan_offers']}, договоров: {result['contracts']}", "info")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Ошибка при архивировании: {str(e)}")
+        archive_months = list_partitions()
+        if archive_months:
+            selected_months = st.multiselect("Месяцы архива", archive_months[::-1])
+            if selected_months:
+                archive_offers = archived_offers(selected_months)
+                if archive_offers:
+                    archive_table = format_comparison(build_comparison(archive_offers, get_currency_rates()))
+                    st.dataframe(archive_table, use_container_width=True, hide_index=True)
+                    # Для больших выгрузок истории удобнее CSV или Parquet
+                    export_widget("archive", lambda: archive_table, "Архив", "offers_archive",
+                                  signature=tuple(selected_months))
+                else:
+                    st.info("ℹ️ В выбранных месяцах нет предложений")
+        else:
+            st.info("ℹ️ Архив пуст")
 # --- Управление перевозчиками ---
+def carrier_import_report(summary):
+    """Результат последнего импорта: изменения и строки с ошибками"""
+    if not summary:
+        return
+    if summary["duplicates"]:
+        st.caption(f"Повторы в файле (учтена последняя строка): {summary['duplicates']}")
+    if summary["diff"]:
+        st.dataframe(pd.DataFrame(summary["diff"]).rename(columns={
+            "action": "Действие", "name": "Название", "email": "Email", "fields": "Измененные поля",
+            "emails_added": "Добавленные адреса"}),
+            use_container_width=True, hide_index=True)
+    if summary["invalid"]:
+        st.warning("Строки файла, которые не импортированы:")
+        st.dataframe(pd.DataFrame(summary["invalid"]).rename(columns={
+            "row": "Строка", "name": "Название", "email": "Email", "error": "Ошибка"}),
+            use_container_width=True, hide_index=True)
 def manage_carriers():
     """Управление списком перевозчиков"""
     st.subheader("Управление перевозчиками")
     try:
-        carriers = load_json_file(CARRIERS_FILE)
+        carriers = store.load_carriers()
         df = pd.DataFrame(carriers if carriers else [{"name": "", "email": "","notes": ""}])
         with st.expander("📋 Текущий список перевозчиков"):
             edited_df = st.data_editor(
@@ -947,81 +950,39 @@ def manage_carriers():
                 }
             )
             if st.button("Сохранить изменения"):
-                # Проверка данных
-                invalid_rows = []
-                for idx, row in edited_df.iterrows():
-                    if not row['name'] or not row['email'] or '@' not in row['email']:
-                        invalid_rows.append(idx + 1)
+                # Проверка данных по колонкам (записи сохраняются как введены)
+                records, invalid_rows = validate_carriers(edited_df)
                 if not invalid_rows:
-                    save_json_file(CARRIERS_FILE, edited_df.to_dict('records'))
-                    st.success("Список перевозчиков обновлен!")
-                    time.sleep(3) # Задержка для отображения сообщения
+                    store.replace_carriers(records)
+                    flash("Список перевозчиков обновлен!")
                     st.rerun()
                 else:
-                    st.error(f"Проверьте данные в строках {', '.join(map(str, invalid_rows))}: все поля должны быть заполнены, email должен быть корректным")
-                    time.sleep(3) # Задержка для отображения сообщения
+                    st.error(f"Проверьте данные в строках {', '.join(str(row['row']) for row in invalid_rows)}: все поля должны быть заполнены, email должен быть корректным")
         with st.expander("📩 Импорт/экспорт"):
             col1, col2 = st.columns(2)
             with col1:
-                # Импорт из CSV
-                uploaded_file = st.file_uploader("Импорт из CSV", type=["csv"])
-                if uploaded_file:
+                # Импорт из CSV или Excel: новые перевозчики добавляются, существующие
+                # (по email или названию) обновляются, остальные поля записей сохраняются
+                uploaded_file = st.file_uploader("Импорт из CSV или Excel", type=["csv", "xlsx"])
+                # Загрузчик хранит файл между перезапусками - каждый файл импортируется один раз
+                if uploaded_file and st.session_state.get("imported_file_id") != uploaded_file.file_id:
+                    st.session_state.imported_file_id = uploaded_file.file_id
                     try:
-                        import_df = pd.read_csv(uploaded_file)
-                        if set(import_df.columns) >= {"name", "email"}:
-                            save_json_file(CARRIERS_FILE, import_df.to_dict('records'))
-                            st.success("Данные успешно импортированы!")
-                            time.sleep(3) # Задержка для отображения сообщения
-                            st.rerun()
-                        else:
-                            st.error("CSV должен содержать колонки 'name' и 'email'")
-                            time.sleep(3) # Задержка для отображения сообщения
+                        with span("carrier_import"):
+                            merged, summary = merge_carriers(store.load_carriers(), read_carrier_file(uploaded_file))
+                        store.replace_carriers(merged)
+                        st.session_state.carrier_import_summary = summary
+                        flash(f"Импорт завершен: добавлено {summary['added']}, обновлено {summary['updated']}, "
+                              f"без изменений {summary['unchanged']}, с ошибками {len(summary['invalid'])}")
+                        st.rerun()
                     except Exception as e:
                         st.error(f"Ошибка импорта: {str(e)}")
-                        time.sleep(3) # Задержка для отображения сообщения
-                # Импорт из Excel
-                uploaded_excel = st.file_uploader("Импорт из Excel", type=["xlsx"])
-                if uploaded_excel:
-                    try:
-                        import_df = pd.read_excel(uploaded_excel)
-                        if set(import_df.columns) >= {"name", "email","notes"}:
-                            save_json_file(CARRIERS_FILE, import_df.to_dict('records'))
-                            st.success("Данные успешно импортированы из Excel!")
-                            time.sleep(3) # Задержка для отображения сообщения
-                            st.rerun()
-                        else:
-                            st.error("Excel должен содержать колонки 'name', 'email', 'notes'")
-                            time.sleep(3) # Задержка для отображения сообщения
-                    except Exception as e:
-                        st.error(f"Ошибка импорта из Excel: {str(e)}")
-                        time.sleep(3) # Задержка для отображения сообщения
+                carrier_import_report(st.session_state.get("carrier_import_summary"))
             with col2:
-                # Экспорт в CSV
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="Экспорт в CSV",
-                    data=csv,
-                    file_name="carriers.csv",
-                    mime="text/csv"
-                )
-                # Экспорт в Excel
-                def to_excel_carriers(df):
-                    output = BytesIO()
-                    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-                    df.to_excel(writer, index=False, sheet_name='Перевозчики')
-                    writer.close()
-                    processed_data = output.getvalue()
-                    return processed_data
-                excel_data_carriers = to_excel_carriers(df)
-                st.download_button(
-                    label="Экспорт в Excel",
-                    data=excel_data_carriers,
-                    file_name="carriers.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+                # Экспорт по запросу (CSV, Excel, Parquet)
+                export_widget("carriers", lambda: df, "Перевозчики", "carriers")
     except Exception as e:
         st.error(f"Ошибка при работе с перевозчиками: {str(e)}")
-        time.sleep(3) # Задержка для отображения сообщения
 # --- README ---
 def show_readme():
     """Отображает инструкцию по использованию системы"""
@@ -1039,14 +1000,15 @@ def show_readme():
            - корректировать и сохранять данные в колонках : "Название компании","Email", "Примечания"
 
        **Как управлять списком перевозчиков:**
-        1. Нажмите кнопку "Импорт из Excel", выберете файл с заполненными данными перевозчиков "name", "email", "notes", 
-           данные загрузятся автоматически и отобразятся в основном окне.
-        2. ВАЖНО: когда появится сообщение "Данные успешно импортированы из Excel!", 
-           Удалите подгруженный файл в окне "Импорт из Excel" нажав на "х" напротив названия загруженного файла
+        1. Нажмите кнопку "Импорт из CSV или Excel", выберете файл с колонками "name", "email" (колонка "notes" и другие - по желанию).
+           Перевозчики с тем же email или названием обновятся (пустые ячейки файла не затирают данные,
+           адреса из файла добавляются к уже сохраненным), новые - добавятся.
+           Под загрузчиком появится список изменений и строк с ошибками (например, некорректный email)
+        2. После сообщения "Импорт завершен" можно удалить подгруженный файл, нажав на "х" напротив его названия
         3. При необходимости отредактируйте данные (добавьте/удалите перевозчиков(+), добавьте/измените комментарии/название компании )
         4. Нажмите кнопку "Сохранить изменения", дождитесь сообщения "Список перевозчиков обновлен!" и данные будут сохранены и в последующем
            отображаться для отправки сообщений
-        5. Можно дополнительно сохранить список: нажмите кнопку "Экспорт в CSV" или "Экспорт в Excel"
+        5. Можно дополнительно сохранить список: в блоке "Импорт/экспорт" выберите формат (CSV, Excel или Parquet), нажмите "Подготовить файл", затем "Скачать"
         """)
 
     with st.expander("2. Создание заявки"):
@@ -1076,7 +1038,7 @@ def show_readme():
         4. Для выбранного предложения можно сгенерировать договор
         5. Сохраните изменения кнопкой "Сохранить изменения статусов"
         6. Для удаления всех отклоненных предложений используйте кнопку "Удалить отклоненные"
-        7. Для экспорта данных в Excel используйте кнопку "Экспорт в Excel"
+        7. Для экспорта откройте блок "📊 Экспорт": выберите всю выборку или текущую страницу и формат (Excel, CSV, Parquet), нажмите "Подготовить файл", затем "Скачать"
         """)
 
 # --- Главный интерфейс ---
@@ -1099,10 +1061,14 @@ def main():
     # --- ОСНОВНОЙ ИНТЕРФЕЙС ---
     # Этот блок выполняется всегда, если пользователь "авторизован" (у нас это всегда "admin")
     if st.session_state.user == "admin":
+        # Сообщения, поставленные в очередь до перезапуска страницы
+        show_flash_messages()
         # Логотип в сайдбаре
         st.sidebar.image("Soudal.PNG", use_container_width=False, width=150)
         # Виджет курсов валют в сайдбаре
         currency_rates_widget()
+        data_cache_widget()
+        performance_widget()
         st.sidebar.title(f"👤 {st.session_state.user}")
         menu = st.sidebar.radio(
             "Меню",
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Архив закрытых заявок: помесячные сжатые файлы archive/ГГГГ-ММ.jsonl.gz.
+
+Заявка, созданная раньше TT_ARCHIVE_AFTER_DAYS дней назад и без новых предложений
+за это время, переносится в архив вместе с предложениями и записями о договорах.
+Одна строка файла - одна заявка: {"bid": ..., "offers": [...], "contracts": [...]}.
+Предложения старше того же срока, заявки которых нет в рабочем хранилище (заявка
+удалена или уже в архиве), тоже переносятся: к архивной записи заявки, если она
+есть, иначе - в запись {"bid": {"id": ..., "orphaned": true}, ...}.
+Архив читается только по запросу (исторические просмотры и отчеты).
+
+    python archive.py [--days 180] [--storage json|sqlite] [--dry-run]
+"""
+import os
+import sys
+import gzip
+import json
+import argparse
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from storage import OfferQuery, offer_key, open_store
+from attachments import get_attachment_store
+# --- Конфигурация ---
+ARCHIVE_DIR = os.environ.get("TT_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("TT_ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL = int(os.environ.get("TT_ARCHIVE_INTERVAL", str(24 * 3600)))  # секунды, 0 - без фонового запуска
+PARTITION_SUFFIX = ".jsonl.gz"
+# --- Партиции ---
+def partition_path(month, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{month}{PARTITION_SUFFIX}")
+def list_partitions(archive_dir=ARCHIVE_DIR):
+    """Месяцы (ГГГГ-ММ), за которые есть архив, по возрастанию"""
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(name[:-len(PARTITION_SUFFIX)] for name in os.listdir(archive_dir) if name.endswith(PARTITION_SUFFIX))
+# Разобранные партиции: путь -> ((mtime_ns, размер), записи)
+_partition_cache = {}
+_partition_cache_lock = threading.Lock()
+def read_partition(month, archive_dir=ARCHIVE_DIR):
+    """Записи заявок за месяц; файл разбирается заново только после изменения"""
+    path = partition_path(month, archive_dir)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return []
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _partition_cache_lock:
+        cached = _partition_cache.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    with _partition_cache_lock:
+        _partition_cache[path] = (stamp, records)
+    return records
+def write_partition(month, records, archive_dir=ARCHIVE_DIR):
+    """Перезаписывает партицию атомарно (временный файл и замена)"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = partition_path(month, archive_dir)
+    tmp_file = path + ".tmp"
+    with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    os.replace(tmp_file, path)
+def load_archive(months=None, archive_dir=ARCHIVE_DIR):
+    """Архивные записи за выбранные месяцы (по умолчанию - за все)"""
+    records = []
+    for month in months if months is not None else list_partitions(archive_dir):
+        records.extend(read_partition(month, archive_dir))
+    return records
+def archived_offers(months=None, archive_dir=ARCHIVE_DIR):
+    """Предложения из архива за выбранные месяцы"""
+    return [offer for record in load_archive(months, archive_dir) for offer in record["offers"]]
+def find_archived_bid(bid_id, archive_dir=ARCHIVE_DIR):
+    """Запись архива по ID заявки или None (просматривает партиции с последней)"""
+    return _locate_archived_bid(bid_id, archive_dir)[1]
+def _locate_archived_bid(bid_id, archive_dir=ARCHIVE_DIR):
+    """(месяц партиции, запись) по ID заявки или (None, None)"""
+    for month in reversed(list_partitions(archive_dir)):
+        for record in read_partition(month, archive_dir):
+            if record["bid"]["id"] == bid_id:
+                return month, record
+    return None, None
+# --- Перенос в архив ---
+def bid_month(bid, offers):
+    """Месяц партиции: по дате создания заявки, без нее - по первому предложению"""
+    created = bid.get("date_created") or min((o.get("email_date") or "" for o in offers), default="")
+    return created[:7] if len(created) >= 7 else "unknown"
+def select_closed_bids(bids, offers_by_bid, cutoff):
+    """Заявки, созданные до cutoff, по которым с cutoff не было предложений"""
+    cutoff = cutoff.isoformat()
+    closed = []
+    for bid in bids:
+        created = bid.get("date_created") or ""
+        if not created or created >= cutoff:
+            continue
+        if any((offer.get("email_date") or "") >= cutoff for offer in offers_by_bid.get(bid["id"], [])):
+            continue
+        closed.append(bid)
+    return closed
+def select_orphan_offers(store, bid_ids, cutoff):
+    """Предложения, полученные до начала дня cutoff, заявок которых нет среди bid_ids"""
+    old_offers, _ = store.query_offers(OfferQuery(date_to=(cutoff - timedelta(days=1)).date(), page_size=None))
+    return [offer for offer in old_offers if offer.get("email_date") and offer.get("bid_id") not in bid_ids]
+def _orphan_records(orphans, archive_dir):
+    """Записи архива для осиротевших предложений: {месяц: [записи]}.
+    Если заявка уже в архиве, предложения добавляются к ее записи в той же партиции"""
+    by_bid = {}
+    for offer in orphans:
+        by_bid.setdefault(offer.get("bid_id"), []).append(offer)
+    by_month = {}
+    for bid_id, offers in by_bid.items():
+        month, record = _locate_archived_bid(bid_id, archive_dir)
+        if record is None:
+            record = {"bid": {"id": bid_id, "orphaned": True}, "offers": [], "contracts": []}
+            month = bid_month(record["bid"], offers)
+        known = {(offer.get("sender"), offer.get("email_date")) for offer in record["offers"]}
+        new_offers = [offer for offer in offers if (offer.get("sender"), offer.get("email_date")) not in known]
+        by_month.setdefault(month, []).append(
+            dict(record, offers=record["offers"] + new_offers, archived_at=datetime.now().isoformat())
+        )
+    return by_month
+def _archived_orphan_keys(store, orphans, cutoff):
+    """Ключи (ID заявки, перевозчик), все предложения которых попали в архив.
+
+    Удаление в хранилище идет по ключу, а под одним ключом бывает несколько предложений:
+    ключ пропускается, если у перевозчика есть предложение не старше cutoff или пришедшее
+    после выборки. Уже архивированные предложения такого ключа остаются в работе до
+    следующего запуска, повторная запись в архив их не дублирует."""
+    archived = Counter(offer_key(offer) for offer in orphans)
+    bids = {bid["id"] for bid in store.load_bids()}
+    still_orphaned = Counter(offer_key(offer) for offer in select_orphan_offers(store, bids, cutoff))
+    current = Counter(offer_key(offer) for offer in store.offers_for_bids({key[0] for key in archived}))
+    return {key for key, count in archived.items() if current[key] == still_orphaned[key] == count}
+def archive_closed_bids(store, days=None, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """Переносит закрытые заявки с предложениями и договорами в архив.
+
+    Сначала записываются партиции, потом данные удаляются из рабочего хранилища:
+    после сбоя между этими шагами заявка окажется в обоих местах, а повторный запуск
+    просто перезапишет ее запись в партиции.
+    Возвращает {"bids", "offers", "orphan_offers", "contracts", "months", "skipped",
+    "attachments_removed"}."""
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = datetime.now() - timedelta(days=days)
+    bids = store.load_bids()
+    offers_by_bid = {}
+    for offer in store.offers_for_bids([bid["id"] for bid in bids]):
+        offers_by_bid.setdefault(offer.get("bid_id"), []).append(offer)
+    closed = select_closed_bids(bids, offers_by_bid, cutoff)
+    orphans = select_orphan_offers(store, {bid["id"] for bid in bids}, cutoff)
+    stats = {"bids": len(closed), "offers": 0, "orphan_offers": len(orphans), "contracts": 0, "months": [],
+             "skipped": 0, "attachments_removed": 0}
+    if not closed and not orphans:
+        return stats
+    contracts_by_bid = {}
+    closed_ids = {bid["id"] for bid in closed}
+    for contract in store.load_contracts():
+        if contract.get("bid_id") in closed_ids:
+            contracts_by_bid.setdefault(contract["bid_id"], []).append(contract)
+    by_month = {}
+    for bid in closed:
+        offers = offers_by_bid.get(bid["id"], [])
+        contracts = contracts_by_bid.get(bid["id"], [])
+        stats["offers"] += len(offers)
+        stats["contracts"] += len(contracts)
+        by_month.setdefault(bid_month(bid, offers), []).append(
+            {"bid": bid, "offers": offers, "contracts": contracts, "archived_at": datetime.now().isoformat()}
+        )
+    for month, records in _orphan_records(orphans, archive_dir).items():
+        by_month.setdefault(month, []).extend(records)
+    stats["months"] = sorted(by_month)
+    if dry_run:
+        return stats
+    for month, records in by_month.items():
+        _merge_partition(month, records, set(), archive_dir)
+    # Проверка и удаление - под блокировкой хранилища: запись заявки, предложения или
+    # договора из другой сессии не может вклиниться между ними и потеряться
+    with store.locked():
+        # Осиротевшие предложения записаны в архив - убираем их из рабочего хранилища
+        if orphans:
+            store.delete_offers(_archived_orphan_keys(store, orphans, cutoff))
+        moved = set()
+        if closed:
+            # Предложение могло прийти, пока писался архив - такие заявки остаются в работе
+            current = {}
+            for offer in store.offers_for_bids(closed_ids):
+                current.setdefault(offer.get("bid_id"), []).append(offer)
+            moved = {bid_id for bid_id in closed_ids
+                     if len(current.get(bid_id, [])) == len(offers_by_bid.get(bid_id, []))}
+            skipped = closed_ids - moved
+            if skipped:
+                for month, records in by_month.items():
+                    if any(record["bid"]["id"] in skipped for record in records):
+                        _merge_partition(month, [], skipped, archive_dir)
+                stats["skipped"] = len(skipped)
+                stats["bids"] = len(moved)
+                stats["offers"] -= sum(len(offers_by_bid.get(bid_id, [])) for bid_id in skipped)
+                stats["contracts"] -= sum(len(contracts_by_bid.get(bid_id, [])) for bid_id in skipped)
+            store.delete_offers({(offer["bid_id"], offer["sender"])
+                                 for bid_id in moved for offer in current.get(bid_id, [])})
+            store.delete_contracts(moved)
+            store.delete_bids(moved)
+        store.compact()
+    # Запись архива хранит ссылки на вложения, сами файлы нужны только заявкам в работе
+    if moved:
+        stats["attachments_removed"] = get_attachment_store().release(moved)
+    return stats
+def _merge_partition(month, records, drop_ids, archive_dir):
+    """Добавляет записи в партицию (запись с тем же ID заявки заменяется) и убирает заявки drop_ids"""
+    replace_ids = {record["bid"]["id"] for record in records} | set(drop_ids)
+    existing = [r for r in read_partition(month, archive_dir) if r["bid"]["id"] not in replace_ids]
+    write_partition(month, existing + records, archive_dir)
+# --- Фоновый запуск ---
+_archivers = {}
+_archivers_lock = threading.Lock()
+def start_archiver(store, interval=ARCHIVE_INTERVAL):
+    """Запускает (один раз на процесс и хранилище) поток, который архивирует заявки раз в interval секунд"""
+    if not interval:
+        return
+    with _archivers_lock:
+        if id(store) in _archivers:
+            return
+
+        def run():
+            while True:
+                try:
+                    archive_closed_bids(store)
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="archiver", daemon=True)
+        thread.start()
+        _archivers[id(store)] = thread
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Перенос закрытых заявок в архив")
+    arg_parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="возраст заявки в днях")
+    arg_parser.add_argument("--storage", default=None, help="хранилище: json или sqlite (по умолчанию TT_STORAGE)")
+    arg_parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="каталог архива")
+    arg_parser.add_argument("--dry-run", action="store_true", help="только показать, что будет перенесено")
+    args = arg_parser.parse_args()
+    result = archive_closed_bids(open_store(args.storage), args.days, args.archive_dir, args.dry_run)
+    print(f"{'Будет перенесено' if args.dry_run else 'Перенесено'} заявок: {result['bids']}, "
+          f"предложений: {result['offers']}, предложений без заявки: {result['orphan_offers']}, "
+          f"договоров: {result['contracts']}, "
+          f"месяцы: {', '.join(result['months']) or '-'}")
+    if result.get("skipped"):
+        print(f"Оставлено в работе (пришли новые предложения): {result['skipped']}", file=sys.stderr)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Хранилище вложений заявок по хэшу содержимого.
+
+Файл хранится один раз: attachments/<sha256>/<имя файла>. Если тот же файл приходит
+под другим именем, рядом создается жесткая ссылка (или копия, если ссылки не
+поддерживаются). Заявки ссылаются на вложения записями {"sha256", "name", "size"};
+index.json хранит, какие заявки используют файл. Файл удаляется, когда на него
+не остается ссылок."""
+import os
+import re
+import shutil
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from storage import read_json, write_json
+# --- Конфигурация ---
+ATTACHMENTS_DIR = os.environ.get("TT_ATTACHMENTS_DIR", "attachments")
+# Файлы, загруженные, но так и не привязанные к заявке (сбой между загрузкой и сохранением),
+# удаляются через столько часов
+ORPHAN_GRACE_HOURS = int(os.environ.get("TT_ATTACHMENTS_GRACE_HOURS", "24"))
+def safe_file_name(name):
+    """Имя файла без пути и символов, недопустимых в именах файлов"""
+    name = re.sub(r'[\\/:*?"<>|]+', "_", os.path.basename(name or "")).strip(" .")
+    return name or "attachment"
+class AttachmentStore:
+    """Вложения по хэшу содержимого со счетчиками ссылок (index.json)"""
+
+    def __init__(self, root=ATTACHMENTS_DIR):
+        self.root = root
+        self.index_file = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+
+    def _load_index(self):
+        index = read_json(self.index_file)
+        # Копии записей: данные из кэша файлов не меняем на месте
+        return {digest: dict(entry) for digest, entry in index.items()} if isinstance(index, dict) else {}
+
+    def _save_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        write_json(self.index_file, index)
+
+    def _object_dir(self, digest):
+        return os.path.join(self.root, digest)
+
+    def put(self, data, name):
+        """Сохраняет содержимое (bytes или memoryview, без лишних копий) и возвращает
+        ссылку {"sha256", "name", "size"}. Одинаковое содержимое пишется на диск один раз."""
+        digest = hashlib.sha256(data).hexdigest()
+        name = safe_file_name(name)
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(digest)
+            if entry is None:
+                os.makedirs(self._object_dir(digest), exist_ok=True)
+                path = os.path.join(self._object_dir(digest), name)
+                tmp_file = path + ".tmp"
+                with open(tmp_file, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_file, path)
+                entry = {"names": [name], "size": len(data), "refs": [], "created_at": datetime.now().isoformat()}
+            elif name not in entry["names"]:
+                self._link_name(digest, entry["names"][0], name)
+                entry["names"] = entry["names"] + [name]
+            index[digest] = entry
+            self._save_index(index)
+        return {"sha256": digest, "name": name, "size": entry["size"]}
+
+    def _link_name(self, digest, existing_name, name):
+        source = os.path.join(self._object_dir(digest), existing_name)
+        target = os.path.join(self._object_dir(digest), name)
+        if os.path.exists(target):
+            return
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def path(self, link):
+        """Путь к файлу вложения с исходным именем (для отправки письмом)"""
+        path = os.path.join(self._object_dir(link["sha256"]), link["name"])
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Вложение {link['name']} не найдено в хранилище")
+        return path
+
+    def acquire(self, owner, links):
+        """Отмечает, что заявка owner использует вложения links"""
+        with self._lock:
+            index = self._load_index()
+            for link in links:
+                entry = index.get(link["sha256"])
+                if entry is not None and owner not in entry["refs"]:
+                    entry["refs"] = entry["refs"] + [owner]
+                    # Файл, который уже был привязан, удаляется сразу после снятия последней ссылки
+                    entry["linked"] = True
+            self._save_index(index)
+
+    def release(self, owners):
+        """Снимает ссылки заявок owners и удаляет файлы, на которые больше никто не ссылается.
+        Возвращает число удаленных файлов"""
+        owners = set(owners)
+        with self._lock:
+            index = self._load_index()
+            for entry in index.values():
+                if owners.intersection(entry["refs"]):
+                    entry["refs"] = [ref for ref in entry["refs"] if ref not in owners]
+            removed = self._collect(index)
+            self._save_index(index)
+        return removed
+
+    def _collect(self, index):
+        """Удаляет из индекса и с диска файлы без ссылок (недавно загруженные не трогает)"""
+        grace_limit = (datetime.now() - timedelta(hours=ORPHAN_GRACE_HOURS)).isoformat()
+        unused = [digest for digest, entry in index.items()
+                  if not entry["refs"] and (entry.get("linked") or entry.get("created_at", "") < grace_limit)]
+        for digest in unused:
+            shutil.rmtree(self._object_dir(digest), ignore_errors=True)
+            del index[digest]
+        return len(unused)
+
+    def list(self):
+        """Вложения, на которые ссылаются заявки: [{"sha256", "name", "size", "refs"}], новые первыми"""
+        index = self._load_index()
+        items = [
+            {"sha256": digest, "name": entry["names"][0], "size": entry["size"], "refs": list(entry["refs"])}
+            for digest, entry in sorted(index.items(), key=lambda item: item[1].get("created_at", ""), reverse=True)
+            if entry["refs"]
+        ]
+        return items
+
+    def stats(self):
+        """Число файлов, их общий размер и число ссылок"""
+        index = self._load_index()
+        return {
+            "files": len(index),
+            "bytes": sum(entry["size"] for entry in index.values()),
+            "refs": sum(len(entry["refs"]) for entry in index.values()),
+        }
+# --- Общий экземпляр на процесс ---
+_attachment_stores = {}
+_attachment_stores_lock = threading.Lock()
+def get_attachment_store(root=ATTACHMENTS_DIR):
+    """Возвращает хранилище вложений (один экземпляр на каталог в процессе)"""
+    with _attachment_stores_lock:
+        if root not in _attachment_stores:
+            _attachment_stores[root] = AttachmentStore(root)
+        return _attachment_stores[root]
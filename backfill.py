@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Массовый разбор архива ответов перевозчиков (.eml/.msg/.txt/mbox/maildir) на всех ядрах.
+
+    python backfill.py <файл или каталог> [...] [--workers N] [--chunk-size 500]
+                       [--update] [--offers offers.json] [--storage json|sqlite]
+
+Результат сливается в хранилище предложений за одну транзакцию, дубликаты пропускаются
+(с --update у найденных дубликатов обновляются разобранные поля, статус сохраняется).
+"""
+import os
+import sys
+import mailbox
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from mailbox_reader import normalize_message_id, parse_email_bytes, read_message_file
+from offer_parser import parser, build_offer
+from storage import open_store
+# --- Конфигурация ---
+OFFERS_FILE = "offers.json"
+CHUNK_SIZE = 500
+# Поля, которые перезаписываются при повторном разборе (--update)
+PARSED_FIELDS = ["bid_id", "order_number", "rate", "currency", "conditions", "costs", "parse_confidence", "message_id"]
+# --- Источники ---
+def iter_work_items(paths):
+    """Перечисляет письма для разбора: пути к файлам или байты писем из mbox/maildir"""
+    for path in paths:
+        if os.path.isdir(os.path.join(path, "cur")):
+            box = mailbox.Maildir(path, factory=None, create=False)
+            for key in box.iterkeys():
+                yield ("bytes", key, box.get_bytes(key))
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    file = os.path.join(root, name)
+                    if os.path.splitext(name)[1].lower() in (".eml", ".txt", ".msg"):
+                        yield ("file", file, None)
+                    elif name.endswith(".mbox"):
+                        yield from _iter_mbox(file)
+        elif os.path.splitext(path)[1].lower() in (".eml", ".txt", ".msg"):
+            yield ("file", path, None)
+        else:
+            yield from _iter_mbox(path)
+def _iter_mbox(path):
+    box = mailbox.mbox(path, factory=None, create=False)
+    for key in box.iterkeys():
+        yield ("bytes", f"{path}#{key}", box.get_bytes(key))
+def iter_chunks(items, size):
+    """Разбивает поток писем на пачки для отправки в рабочие процессы"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+def read_msg_file(file):
+    """Читает письмо Outlook .msg (нужен пакет extract-msg)"""
+    import extract_msg
+    msg = extract_msg.Message(file)
+    try:
+        received = msg.date
+        if isinstance(received, str) or received is None:
+            received = datetime.fromtimestamp(os.path.getmtime(file))
+        elif received.tzinfo is not None:
+            received = received.astimezone().replace(tzinfo=None)
+        sender = msg.sender or ""
+        sender_email = sender.split("<")[-1].rstrip(">").strip() if "<" in sender else sender
+        return {
+            "entry_id": msg.messageId or os.path.abspath(file),
+            "message_id": normalize_message_id(msg.messageId),
+            "sender": sender.split("<")[0].strip() or sender_email,
+            "sender_email": sender_email,
+            "received": received.replace(microsecond=0),
+            "subject": msg.subject or "",
+            "body": msg.body or "",
+        }
+    finally:
+        msg.close()
+# --- Рабочий процесс ---
+def parse_chunk(chunk):
+    """Разбирает пачку писем в рабочем процессе. Возвращает (предложения, пропущено, ошибки)"""
+    offers = []
+    skipped = 0
+    errors = []
+    for kind, entry_id, data in chunk:
+        try:
+            if kind == "bytes":
+                message = parse_email_bytes(data, entry_id)
+            elif entry_id.lower().endswith(".msg"):
+                message = read_msg_file(entry_id)
+            else:
+                message = read_message_file(entry_id)
+            if message is None:
+                skipped += 1
+                continue
+            result = parser.parse(message["body"])
+            if not result.is_offer:
+                skipped += 1
+                continue
+            offer_data = build_offer(message, result)
+            offer_data["parse_confidence"] = round(result.confidence, 2)
+            offers.append(offer_data)
+        except Exception as e:
+            errors.append(f"{entry_id}: {e}")
+    return offers, skipped, errors
+# --- Слияние ---
+def dedup_key(offer):
+    """Запасной ключ дедупликации для писем без Message-ID: заявка, адрес отправителя
+    и время письма (у Outlook - время получения, у .eml/mbox - дата отправки)"""
+    return (offer.get("bid_id", ""), (offer.get("sender_email") or "").lower(), offer.get("email_date", ""))
+def merge_offers(existing_offers, parsed_offers, update=False):
+    """Отбирает новые предложения, пропуская дубликаты; с update обновляет поля найденных.
+    Дубликат ищется по Message-ID, а если его нет у одного из предложений - по dedup_key.
+    Возвращает (новые предложения, число обновленных)"""
+    by_message_id = {}
+    by_key = {}
+
+    def remember(offer):
+        if offer.get("message_id"):
+            by_message_id[offer["message_id"]] = offer
+        else:
+            by_key[dedup_key(offer)] = offer
+
+    for offer in existing_offers:
+        remember(offer)
+    added = []
+    updated = 0
+    for offer in parsed_offers:
+        current = by_message_id.get(offer.get("message_id")) if offer.get("message_id") else None
+        if current is None:
+            # Записи без Message-ID (загружены до его сохранения) сравниваем по времени письма
+            current = by_key.get(dedup_key(offer))
+        if current is None:
+            remember(offer)
+            added.append(offer)
+        elif update:
+            for field in PARSED_FIELDS:
+                if field in offer:
+                    current[field] = offer[field]
+            updated += 1
+    return added, updated
+# --- Запуск ---
+def backfill(paths, offers_file=OFFERS_FILE, workers=None, chunk_size=CHUNK_SIZE, update=False,
+             progress=None, backend=None):
+    """Разбирает архив писем пулом процессов и сливает результат в хранилище предложений"""
+    workers = workers or os.cpu_count() or 1
+    parsed_offers = []
+    stats = {"messages": 0, "offers": 0, "skipped": 0, "errors": [], "added": 0, "updated": 0}
+    chunks = iter_chunks(iter_work_items(paths), chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Держим в очереди не больше двух пачек на процесс, чтобы не читать весь архив в память
+        pending = {}
+        for chunk in chunks:
+            pending[executor.submit(parse_chunk, chunk)] = len(chunk)
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _collect(future, pending.pop(future), parsed_offers, stats, progress)
+        for future in list(pending):
+            _collect(future, pending.pop(future), parsed_offers, stats, progress)
+    store = open_store(backend, offers_file=offers_file)
+    existing_offers = store.load_offers()
+    added, stats["updated"] = merge_offers(existing_offers, parsed_offers, update)
+    stats["added"] = len(added)
+    if stats["updated"]:
+        # Обновленные поля у существующих записей - переписываем предложения одной транзакцией
+        store.replace_offers(existing_offers + added)
+    elif added:
+        store.add_offers(added)
+    return stats
+def _collect(future, size, parsed_offers, stats, progress):
+    offers, skipped, errors = future.result()
+    parsed_offers.extend(offers)
+    stats["messages"] += size
+    stats["offers"] += len(offers)
+    stats["skipped"] += skipped
+    stats["errors"].extend(errors)
+    if progress:
+        progress(stats)
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Массовый разбор архива ответов перевозчиков")
+    arg_parser.add_argument("paths", nargs="+", help="файлы .eml/.msg/.txt/mbox, каталоги или maildir")
+    arg_parser.add_argument("--offers", default=OFFERS_FILE, help="файл предложений")
+    arg_parser.add_argument("--storage", default=None, help="хранилище: json или sqlite (по умолчанию TT_STORAGE)")
+    arg_parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию - все ядра)")
+    arg_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="писем в одной пачке")
+    arg_parser.add_argument("--update", action="store_true", help="обновить разобранные поля у уже загруженных предложений")
+    args = arg_parser.parse_args()
+    result = backfill(
+        args.paths, args.offers, args.workers, args.chunk_size, args.update,
+        progress=lambda s: print(f"\rОбработано писем: {s['messages']}, предложений: {s['offers']}", end="", file=sys.stderr),
+        backend=args.storage
+    )
+    print(file=sys.stderr)
+    for error in result["errors"]:
+        print(f"Ошибка: {error}", file=sys.stderr)
+    print(f"Добавлено: {result['added']}, обновлено: {result['updated']}, "
+          f"пропущено писем: {result['skipped']}, ошибок: {len(result['errors'])}")
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Подставной pythoncom для запуска без Windows: инициализация COM ничего не делает"""
+def CoInitialize():
+    pass
+def CoUninitialize():
+    pass
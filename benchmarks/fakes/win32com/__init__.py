@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Подставной win32com для запуска без Windows (см. win32com.client)"""
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Подставной Outlook в памяти: та часть объектной модели, которой пользуются
+mailbox_reader.OutlookReader и mail_transport.OutlookTransport.
+
+Письма для папки "Входящие/<папка>" задаются через load_folder(); отправленные
+письма складываются в SENT."""
+import re
+from datetime import datetime, timezone
+# Папка -> список FakeMailItem; отправленные письма
+FOLDERS = {}
+SENT = []
+def load_folder(name, messages):
+    """Заполняет папку письмами: [{"sender", "sender_email", "received", "subject", "body"}]"""
+    FOLDERS[name] = [
+        FakeMailItem(
+            EntryID=f"{name}-{i:08d}",
+            SenderName=m["sender"],
+            SenderEmailAddress=m["sender_email"],
+            ReceivedTime=m["received"],
+            Subject=m["subject"],
+            Body=m["body"],
+            UnRead=True,
+            PropertyAccessor=FakePropertyAccessor(m.get("message_id", f"{name}-{i:08d}@example.com")),
+        )
+        for i, m in enumerate(messages)
+    ]
+    return FOLDERS[name]
+class FakeMailItem:
+    def __init__(self, **fields):
+        self.To = ""
+        self.Subject = ""
+        self.Body = ""
+        self.Sender = None
+        self.Attachments = FakeAttachments()
+        self.__dict__.update(fields)
+
+    def Send(self):
+        SENT.append(self)
+class FakePropertyAccessor:
+    """Только заголовок Message-ID (PR_INTERNET_MESSAGE_ID)"""
+
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+    def GetProperty(self, name):
+        if name.endswith("0x1035001F"):
+            return f"<{self.message_id}>"
+        raise ValueError(f"Неподдерживаемое свойство: {name}")
+class FakeAttachments:
+    def __init__(self):
+        self.files = []
+
+    def Add(self, path, *args):
+        self.files.append(path)
+class FakeItems:
+    """Коллекция писем с Restrict/Sort; поддерживаются фильтры, которые строит OutlookReader.
+
+    Как и в Outlook, результат Restrict - "живое" представление: письма, которые
+    перестали подходить под фильтр (например, отмечены прочитанными), выпадают из
+    него прямо во время обхода, а обход идет по номеру позиции."""
+
+    def __init__(self, items, condition=None):
+        self._items = items
+        self._condition = condition
+        self._sort_key = None
+
+    def _current(self):
+        items = [item for item in self._items if self._condition is None or self._condition(item)]
+        if self._sort_key is not None:
+            items.sort(key=self._sort_key)
+        return items
+
+    def Restrict(self, restriction):
+        if restriction == "[UnRead] = True":
+            return FakeItems(self._items, lambda item: item.UnRead)
+        match = re.fullmatch(r"@SQL=\"urn:schemas:httpmail:datereceived\" >= '(.+)'", restriction)
+        if not match:
+            raise ValueError(f"Неподдерживаемый фильтр: {restriction}")
+        # Дата фильтра DASL - в UTC, ReceivedTime писем - местное время
+        since = (datetime.strptime(match.group(1), "%Y-%m-%d %H:%M")
+                 .replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None))
+        return FakeItems(self._items, lambda item: item.ReceivedTime >= since)
+
+    def Sort(self, field):
+        self._sort_key = lambda item: item.ReceivedTime
+
+    def __iter__(self):
+        index = 0
+        while True:
+            items = self._current()
+            if index >= len(items):
+                return
+            yield items[index]
+            index += 1
+
+    def __len__(self):
+        return len(self._current())
+class FakeFolders:
+    def __init__(self, folders):
+        self._folders = folders
+
+    @property
+    def Count(self):
+        return len(self._folders)
+
+    def Item(self, index):
+        return self._folders[index - 1]
+class FakeFolder:
+    def __init__(self, name, items, subfolders=()):
+        self.Name = name
+        self._items = items
+        self.Folders = FakeFolders(list(subfolders))
+
+    @property
+    def Items(self):
+        return FakeItems(self._items)
+class FakeNamespace:
+    def GetDefaultFolder(self, folder_type):
+        subfolders = [FakeFolder(name, items) for name, items in FOLDERS.items() if name != "Входящие"]
+        return FakeFolder("Входящие", FOLDERS.get("Входящие", []), subfolders)
+class FakeOutlook:
+    def GetNamespace(self, name):
+        return FakeNamespace()
+
+    def CreateItem(self, item_type):
+        return FakeMailItem()
+def Dispatch(prog_id):
+    if prog_id != "Outlook.Application":
+        raise ValueError(f"Подставной win32com поддерживает только Outlook.Application, а не {prog_id}")
+    return FakeOutlook()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Локальные наборы для замеров: курсы ЦБ в формате cbr-xml-daily.ru и шаблон договора"""
+import os
+import json
+import random
+from datetime import date, datetime, time, timedelta
+# Валюта -> (рублей за Nominal единиц в начале периода, Nominal)
+FIXTURE_CURRENCIES = {
+    "USD": (90.0, 1),
+    "EUR": (100.0, 1),
+    "CNY": (12.5, 1),
+    "KZT": (18.0, 100),
+    "JPY": (60.0, 100),
+}
+def _payload(day, previous_day, values, previous_values):
+    return {
+        "Date": datetime.combine(day, time(11, 30)).isoformat() + "+03:00",
+        "PreviousDate": datetime.combine(previous_day, time(11, 30)).isoformat() + "+03:00",
+        "Valute": {
+            code: {"CharCode": code, "Nominal": FIXTURE_CURRENCIES[code][1],
+                   "Value": round(values[code], 4), "Previous": round(previous_values[code], 4)}
+            for code in values
+        },
+    }
+def _write(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+def build_rate_fixture(target_dir, days=400, end=None, seed=1):
+    """Каталог для currency_rates.FileRateSource: daily_json.js и archive/ГГГГ/ММ/ДД/daily_json.js
+    за days дней до end (курсы - случайное блуждание). Возвращает список дат"""
+    rng = random.Random(seed)
+    end = end or date.today()
+    values = {code: start for code, (start, _) in FIXTURE_CURRENCIES.items()}
+    previous_values = dict(values)
+    previous_day = end - timedelta(days=days)
+    dates = []
+    for offset in range(days - 1, -1, -1):
+        day = end - timedelta(days=offset)
+        values = {code: value * (1 + rng.uniform(-0.01, 0.01)) for code, value in values.items()}
+        payload = _payload(day, previous_day, values, previous_values)
+        _write(os.path.join(target_dir, "archive", f"{day:%Y}", f"{day:%m}", f"{day:%d}", "daily_json.js"), payload)
+        previous_day, previous_values = day, values
+        dates.append(day.isoformat())
+    _write(os.path.join(target_dir, "daily_json.js"), payload)
+    return dates
+def fill_rate_history(service, dates):
+    """Загружает в историю сервиса курсы на все даты набора (без фоновых потоков)"""
+    service.refresh()
+    for day in dates:
+        service.fetch_date(day)
+    return service.history()
+# --- Шаблон договора ---
+CONTRACT_FIELDS = [
+    ("Договор-заявка", "{{ id }} от {{ date_created }}"),
+    ("Перевозчик", "{{ carrier_name }} ({{ carrier_email }})"),
+    ("Юридическое лицо", "{{ legal_name }}, ИНН {{ inn }}, КПП {{ kpp }}, ОГРН {{ ogrn }}"),
+    ("Адрес", "{{ address }}"),
+    ("Банк", "{{ bank_name }}, БИК {{ bik }}, р/с {{ rs }}, к/с {{ ks }}"),
+    ("Договор", "№ {{ contract_number }} от {{ contract_date }}"),
+    ("Маршрут", "{{ country_from }}, {{ loading_address }}"),
+    ("Груз", "{{ cargo_type }}, {{ container_type }}, ТНВЭД {{ hs_code }}"),
+    ("Описание груза", "{{ cargo_description }}"),
+    ("Условия", "{{ incoterm }}, готовность {{ ready_date }}, оплата: {{ payment_terms }}"),
+    ("Pre-carriage", "{{ pre_carriage_cost }} {{ pre_carriage_currency }}"),
+    ("OTHC", "{{ othc_cost }} {{ othc_currency }}"),
+    ("Sea freight", "{{ sea_freight_cost }} {{ sea_freight_currency }}"),
+    ("Примечания", "{{ notes }}"),
+]
+def build_contract_template(path, filler_paragraphs=40):
+    """Шаблон .docx с теми же полями, что и templates/template.docx, и типовым текстом договора"""
+    from docx import Document
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    document = Document()
+    document.add_heading("Договор-заявка на перевозку груза № {{ id }}", level=1)
+    table = document.add_table(rows=0, cols=2)
+    for label, value in CONTRACT_FIELDS:
+        row = table.add_row().cells
+        row[0].text = label
+        row[1].text = value
+    for i in range(filler_paragraphs):
+        document.add_paragraph(
+            f"{i + 1}. Перевозчик обязуется доставить груз по заявке {{{{ id }}}} в согласованный срок "
+            "и несет ответственность за его сохранность с момента принятия до момента выдачи грузополучателю."
+        )
+    document.add_paragraph("Перевозчик: {{ legal_name }} ____________  Заказчик: ____________")
+    document.save(path)
+    return path
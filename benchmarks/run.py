@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""Замеры производительности на синтетических данных тендера.
+
+Запускается на обычной Linux машине: Outlook и pythoncom подменяются модулями из
+benchmarks/fakes, курсы ЦБ берутся из локального набора (fixtures.build_rate_fixture),
+шаблон договора создается заново. Все файлы пишутся во временный рабочий каталог.
+
+    python benchmarks/run.py [--scales 1000 10000] [--only offer_parse,json_load]
+                             [--repeat 3] [--output benchmarks/results] [--compare старый.json]
+                             [--check-budget]
+
+Масштаб - число предложений (ответов перевозчиков). 100000 и 1000000 требуют
+нескольких гигабайт памяти и минут на прогон, поэтому по умолчанию не запускаются.
+Результаты сохраняются в JSON (benchmarks/results/ГГГГММДД-ЧЧММСС.json), --compare
+печатает отношение ко времени из прошлого прогона. Для запуска приложения и перерисовки
+страниц заданы бюджеты (BUDGETS), --check-budget делает их превышение ошибкой."""
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# Подставные win32com/pythoncom важнее настоящих: замеры не должны трогать Outlook
+sys.path[:0] = [os.path.join(BENCH_DIR, "fakes"), REPO_DIR, BENCH_DIR]
+# --- Конфигурация ---
+DEFAULT_SCALES = [1000, 10000]
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results")
+EXCEL_MAX_ROWS = 1_048_575  # строк данных на листе Excel
+CONTRACT_LIMIT = 100  # договоров на масштаб: рендеринг не зависит от числа предложений
+PAGE_SIZE = 50  # строк на странице "Просмотр предложений"
+# Бюджет времени запуска и перерисовки, секунды (--check-budget завершает прогон с ошибкой при превышении)
+BUDGETS = {
+    "app_import_cold": 3.0,     # python -c "import app" в новом процессе
+    "app_session_start": 1.5,   # первая отрисовка новой сессии
+    "app_rerun": 0.3,           # повторная отрисовка страницы README
+}
+class Case:
+    """Замер: run() выполняется repeat раз, setup() - перед каждым повтором вне замера"""
+
+    def __init__(self, benchmark, items, run, setup=None, note="", budget=None):
+        self.benchmark = benchmark
+        self.items = items
+        self.run = run
+        self.setup = setup
+        self.note = note
+        self.budget = budget
+# --- Окружение ---
+def prepare_workdir(workdir):
+    """Рабочий каталог и переменные окружения до импорта модулей приложения"""
+    from fixtures import build_rate_fixture, build_contract_template
+    os.chdir(workdir)
+    rates_dir = os.path.join(workdir, "cbr")
+    dates = build_rate_fixture(rates_dir)
+    os.environ.update({
+        "TT_RATES_SOURCE": rates_dir,
+        "TT_ARCHIVE_INTERVAL": "0",
+        "TT_MAIL_TRANSPORT": "outlook",
+        "TT_STORAGE": "json",
+        "TT_METRICS_FILE": "",
+    })
+    build_contract_template(os.path.join("templates", "template.docx"))
+    # Картинки сайдбара - для отрисовки страниц в замерах запуска
+    for image in ("Soudal.PNG", "Shi_Py.png"):
+        shutil.copy(os.path.join(REPO_DIR, image), image)
+    return dates
+class Context:
+    """Общие для всех замеров модули и данные одного масштаба"""
+
+    def __init__(self, rate_dates):
+        import app
+        from currency_rates import RateService, make_source
+        from fixtures import fill_rate_history
+        self.app = app
+        service = RateService(make_source(os.environ["TT_RATES_SOURCE"]))
+        self.rate_history = fill_rate_history(service, rate_dates)
+        self.rates = service.current()
+        self.scale = None
+
+    def load(self, scale):
+        from synthetic import make_dataset
+        self.scale = scale
+        self.carriers, self.bids, self.offers = make_dataset(scale)
+        self._replies = None
+
+    @property
+    def replies(self):
+        if self._replies is None:
+            from synthetic import make_replies
+            self._replies = make_replies(self.bids, self.carriers, self.scale, self.app.format_bid_email)
+        return self._replies
+# --- Замеры ---
+def bench_offer_parse(ctx):
+    from offer_parser import parser, build_offer
+    replies = ctx.replies
+
+    def run():
+        for message in replies:
+            result = parser.parse(message["body"])
+            if result.is_offer:
+                build_offer(message, result)
+    return [Case("offer_parse", len(replies), run)]
+def bench_outlook_ingest(ctx):
+    """parse_offers_from_outlook целиком: подставная папка Outlook, курсор, сохранение в offers.json"""
+    from win32com import client
+    replies = ctx.replies
+    state = {"round": 0}
+
+    def setup():
+        state["round"] += 1
+        # Новая папка - новый курсор: каждый повтор разбирает все письма заново
+        state["folder"] = f"Предложения-{state['round']}"
+        client.FOLDERS.clear()
+        client.load_folder(state["folder"], replies)
+        ctx.app.store.replace_offers([])
+
+    def run():
+        new_offers = ctx.app.parse_offers_from_outlook(folder_name=state["folder"], source="") or []
+        # Первый запуск берет непрочитанные письма: все предложения должны быть разобраны,
+        # даже если отметка "прочитано" убирает письмо из результата Restrict
+        if "expected" not in state:
+            from offer_parser import parser
+            state["expected"] = sum(parser.parse(reply["body"]).is_offer for reply in replies)
+        if len(new_offers) != state["expected"]:
+            raise RuntimeError(f"outlook_ingest: разобрано {len(new_offers)} предложений из {state['expected']}")
+    return [Case("outlook_ingest", len(replies), run, setup)]
+def bench_comparison(ctx):
+    from offers_table import build_comparison, format_comparison, rate_history_frame
+    offers, rates = ctx.offers, ctx.rates
+    history = rate_history_frame(ctx.rate_history)
+
+    def run_current():
+        format_comparison(build_comparison(offers, rates, None, offers))
+
+    def run_dated():
+        format_comparison(build_comparison(offers, rates, history, offers))
+    return [Case("comparison_build", len(offers), run_current),
+            Case("comparison_build_dated", len(offers), run_dated)]
+def bench_offers_page(ctx):
+    """Отрисовка страницы "Просмотр предложений": выборка страницы, предложения по ее заявкам, таблица"""
+    from storage import OfferQuery
+    from offers_table import build_comparison, format_comparison
+    store = ctx.app.store
+    store.replace_offers(ctx.offers)
+    query = OfferQuery(sort_by="email_date", descending=True, page=1, page_size=PAGE_SIZE)
+
+    def run():
+        offers, _ = store.query_offers(query)
+        peers = store.offers_for_bids({offer["bid_id"] for offer in offers})
+        format_comparison(build_comparison(offers, ctx.rates, None, peers))
+    return [Case("offers_page", len(ctx.offers), run, note=f"страница {PAGE_SIZE} строк")]
+def bench_json(ctx):
+    from storage import read_json, write_json, clear_cache
+    offers = ctx.offers
+    path = "bench_offers.json"
+
+    def run_save():
+        write_json(path, offers)
+
+    def setup_load():
+        if not os.path.exists(path):
+            write_json(path, offers)
+        clear_cache()
+
+    def run_load():
+        read_json(path)
+    return [Case("json_save", len(offers), run_save),
+            Case("json_load", len(offers), run_load, setup_load)]
+def bench_carrier_import(ctx):
+    """Импорт списка перевозчиков (carrier_import.merge_carriers) размером с масштаб:
+    половина строк обновляет существующих перевозчиков, половина - новые"""
+    import pandas as pd
+    from carrier_import import merge_carriers
+    from synthetic import make_carriers
+    existing = make_carriers(ctx.scale)
+    # Справочник после прежнего импорта: числа из CSV, у части перевозчиков по два адреса
+    for i, carrier in enumerate(existing):
+        carrier.update(rating=i % 5, discount=i % 7 / 2)
+        if i % 2:
+            carrier["email"] = f"{carrier['email'].upper()}; sales{i:04d}@example.com"
+    incoming = pd.DataFrame(make_carriers(ctx.scale * 3 // 2)[ctx.scale // 2:])
+    incoming["email"] = incoming["email"].str.upper() + "; " + incoming["email"]
+    incoming["notes"] = "импорт"
+    incoming["rating"] = "5"
+    incoming["discount"] = [str(i % 7 / 2) for i in range(ctx.scale // 2, ctx.scale * 3 // 2)]
+    matched = ctx.scale - ctx.scale // 2
+
+    def run():
+        merged, summary = merge_carriers(existing, incoming)
+        # Проверка результата: обновлены все найденные, числовое поле без изменений не считается
+        # изменением, дополнительные адреса справочника не теряются
+        lost = [i for i, carrier in enumerate(merged[:ctx.scale]) if i % 2 and f"sales{i:04d}@" not in carrier["email"]]
+        if summary["updated"] != matched or summary["added"] != len(incoming) - matched or lost:
+            raise RuntimeError(f"carrier_import: неверный результат {summary['added']}/{summary['updated']}, "
+                               f"потеряно адресов: {len(lost)}")
+        if any("discount" in row["fields"] for row in summary["diff"]):
+            raise RuntimeError("carrier_import: равные числа посчитаны изменением")
+    return [Case("carrier_import", len(incoming), run, note=f"в справочнике {len(existing)}")]
+def bench_exports(ctx):
+    """Выгрузки таблицы предложений (exports.export_frame): построение файла и повторный запрос из кэша"""
+    from offers_table import build_comparison, format_comparison
+    from exports import available_formats, export_frame
+    table = format_comparison(build_comparison(ctx.offers, ctx.rates, None, ctx.offers))
+    exports_dir = "bench_exports"
+    cases = []
+    for export_format in available_formats():
+        if export_format == "xlsx" and len(table) > EXCEL_MAX_ROWS:
+            cases.append(Case("export_xlsx", len(table), None, note=f"пропущено: больше {EXCEL_MAX_ROWS} строк"))
+            continue
+
+        def setup(export_format=export_format):
+            shutil.rmtree(exports_dir, ignore_errors=True)
+
+        def run(export_format=export_format):
+            export_frame(table, export_format, "Предложения", exports_dir)
+        cases.append(Case(f"export_{export_format}", len(table), run, setup))
+    # Повторный запрос тех же данных: только хэш таблицы, файл берется из кэша
+    export_frame(table, "csv", "Предложения", exports_dir)
+    cases.append(Case("export_cached", len(table), lambda: export_frame(table, "csv", "Предложения", exports_dir)))
+    return cases
+def bench_contracts(ctx):
+    from contracts import build_contract_context, contract_file_name, render_contract, render_contracts_batch
+    carriers = {carrier["name"]: carrier for carrier in ctx.carriers}
+    bids = {bid["id"]: bid for bid in ctx.bids}
+    jobs = []
+    for offer in ctx.offers[:CONTRACT_LIMIT]:
+        context = build_contract_context(bids[offer["bid_id"]], offer, carriers[offer["sender"]])
+        jobs.append((contract_file_name(offer["bid_id"], offer["sender"]), context))
+
+    def run_single():
+        for _, context in jobs:
+            render_contract(context)
+
+    def run_batch():
+        errors = [error for _, _, error in render_contracts_batch(jobs) if error]
+        if errors:
+            raise RuntimeError(errors[0])
+    return [Case("contract_render", len(jobs), run_single),
+            Case("contract_render_batch", len(jobs), run_batch)]
+def bench_startup(ctx):
+    """Запуск приложения: импорт в новом процессе, первая отрисовка сессии и перерисовки
+    (Streamlit выполняет скрипт заново при каждом действии пользователя)"""
+    from streamlit.testing.v1 import AppTest
+    app_file = os.path.join(REPO_DIR, "app.py")
+    import_code = f"import sys; sys.path[:0] = {[os.path.join(BENCH_DIR, 'fakes'), REPO_DIR]!r}; import app"
+    sessions = {}
+
+    def checked_run(session):
+        session.run()
+        if session.exception:
+            raise RuntimeError(session.exception[0].value)
+        return session
+
+    def run_import():
+        subprocess.run([sys.executable, "-c", import_code], check=True, capture_output=True)
+
+    def setup_session():
+        sessions["new"] = AppTest.from_file(app_file, default_timeout=600)
+
+    def setup_rerun():
+        if "readme" not in sessions:
+            sessions["readme"] = checked_run(AppTest.from_file(app_file, default_timeout=600))
+
+    def setup_offers():
+        if "offers" not in sessions:
+            ctx.app.store.replace_offers(ctx.offers)
+            session = checked_run(AppTest.from_file(app_file, default_timeout=600))
+            session.sidebar.radio[0].set_value("Просмотр предложений")
+            sessions["offers"] = checked_run(session)
+    return [
+        Case("app_import_cold", 1, run_import, budget=BUDGETS["app_import_cold"]),
+        Case("app_session_start", 1, lambda: checked_run(sessions["new"]), setup_session,
+             budget=BUDGETS["app_session_start"]),
+        Case("app_rerun", 1, lambda: checked_run(sessions["readme"]), setup_rerun, budget=BUDGETS["app_rerun"]),
+        Case("app_rerun_offers", len(ctx.offers), lambda: checked_run(sessions["offers"]), setup_offers,
+             note=f"страница {PAGE_SIZE} строк"),
+    ]
+BENCHMARKS = {
+    "startup": bench_startup,
+    "offer_parse": bench_offer_parse,
+    "outlook_ingest": bench_outlook_ingest,
+    "comparison": bench_comparison,
+    "offers_page": bench_offers_page,
+    "json": bench_json,
+    "carrier_import": bench_carrier_import,
+    "exports": bench_exports,
+    "contracts": bench_contracts,
+}
+# --- Запуск ---
+def measure(case, repeat):
+    """Время повторов в секундах (сборка мусора на время замера отключается)"""
+    times = []
+    for _ in range(repeat):
+        if case.setup:
+            case.setup()
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            case.run()
+            times.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return times
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+def run_benchmarks(scales, names, repeat=None):
+    workdir = tempfile.mkdtemp(prefix="tt-bench-")
+    cwd = os.getcwd()
+    results = []
+    try:
+        ctx = Context(prepare_workdir(workdir))
+        for scale in scales:
+            ctx.load(scale)
+            scale_repeat = repeat or (3 if scale < 100_000 else 1)
+            for name in names:
+                for case in BENCHMARKS[name](ctx):
+                    record = {"benchmark": case.benchmark, "scale": scale, "items": case.items,
+                              "repeat": 0, "best_s": None, "median_s": None, "per_item_us": None, "note": case.note,
+                              "budget_s": case.budget, "within_budget": None}
+                    if case.run is not None:
+                        times = measure(case, scale_repeat)
+                        record.update(repeat=len(times), best_s=round(min(times), 6),
+                                      median_s=round(statistics.median(times), 6),
+                                      per_item_us=round(min(times) / max(case.items, 1) * 1e6, 3))
+                        if case.budget is not None:
+                            # Бюджет сравнивается с медианой: единичный удачный повтор не должен его скрывать
+                            record["within_budget"] = record["median_s"] <= case.budget
+                    results.append(record)
+                    print_result(record)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+def print_result(record, baseline=None):
+    if record["best_s"] is None:
+        print(f"{record['benchmark']:<24} {record['scale']:>9}  {record['note']}")
+        return
+    line = (f"{record['benchmark']:<24} {record['scale']:>9}  {record['best_s']:>10.4f} с"
+            f"  {record['per_item_us']:>10.2f} мкс/шт")
+    if baseline and baseline.get("best_s"):
+        line += f"  x{record['best_s'] / baseline['best_s']:.2f} к прошлому"
+    if record.get("within_budget") is False:
+        line += f"  ПРЕВЫШЕН БЮДЖЕТ {record['budget_s']} с"
+    print(line, flush=True)
+def save_results(report, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+def compare(results, baseline_file):
+    """Печатает результаты рядом с прошлым прогоном (по замеру и масштабу)"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {(r["benchmark"], r["scale"]): r for r in json.load(f)["results"]}
+    print(f"\nСравнение с {baseline_file}:")
+    for record in results:
+        print_result(record, baseline.get((record["benchmark"], record["scale"])))
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Замеры производительности на синтетических данных")
+    arg_parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                            help="число предложений, например 1000 10000 100000 1000000")
+    arg_parser.add_argument("--only", default="", help=f"замеры через запятую: {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument("--repeat", type=int, default=None,
+                            help="повторов каждого замера (по умолчанию 3, от 100000 предложений - 1)")
+    arg_parser.add_argument("--output", default=DEFAULT_OUTPUT, help="каталог для JSON с результатами")
+    arg_parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    arg_parser.add_argument("--check-budget", action="store_true",
+                            help="код возврата 1, если время запуска или перерисовки вышло за бюджет")
+    args = arg_parser.parse_args()
+    names = [name.strip() for name in args.only.split(",") if name.strip()] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        arg_parser.error(f"неизвестные замеры: {', '.join(unknown)}")
+    started_at = datetime.now().isoformat()
+    results = run_benchmarks(args.scales, names, args.repeat)
+    report = {
+        "started_at": started_at,
+        "finished_at": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scales": args.scales,
+        "results": results,
+    }
+    print(f"\nРезультаты: {save_results(report, args.output)}")
+    if args.compare:
+        compare(results, args.compare)
+    over_budget = [r["benchmark"] for r in results if r.get("within_budget") is False]
+    if over_budget:
+        print(f"Превышен бюджет: {', '.join(sorted(set(over_budget)))}", file=sys.stderr)
+        if args.check_budget:
+            sys.exit(1)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Синтетические данные тендера: перевозчики, заявки, ответы перевозчиков и предложения.
+Все генераторы детерминированы (seed), чтобы прогоны можно было сравнивать."""
+import random
+from datetime import datetime, timedelta
+COST_ITEMS = [
+    "Pre-carriage",
+    "OTHC (Origin Terminal Handling Charges)",
+    "Sea freight",
+    "ЖД перевозка",
+    "Прямое ЖД",
+    "Станционные затраты",
+    "Доставка со станции"
+]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "RUB", "RUB", "CNY"]
+COUNTRIES = ["Китай", "Тайвань", "Вьетнам", "Индия", "Турция"]
+PORTS = ["Shanghai", "Ningbo", "Qingdao", "Kaohsiung", "Ho Chi Minh", "Nhava Sheva", "Mersin"]
+CONTAINERS = ["20 фут", "40 фут", "40 фут HQ", "Авто 20тн", "Сборный груз"]
+DELIVERY_METHODS = ["Море+ЖД", "Прямое ЖД", "Авто", "Авиа"]
+INCOTERMS = ["FOB", "CIF", "EXW", "DAP", "DDP", "CFR", "FCA", "CPT"]
+STATUSES = ["Новое", "Новое", "Новое", "В работе", "Отклонено", "Принято"]
+def make_carriers(count, seed=1):
+    """Перевозчики для carriers.json и реквизиты для справочника carriers_info"""
+    rng = random.Random(seed)
+    carriers = []
+    for i in range(count):
+        carriers.append({
+            "name": f"Перевозчик {i:04d}",
+            "email": f"carrier{i:04d}@example.com",
+            "legal_name": f"ООО \"Перевозчик {i:04d}\"",
+            "inn": f"77{rng.randrange(10 ** 8):08d}",
+            "kpp": f"77{rng.randrange(10 ** 7):07d}",
+            "ogrn": f"1{rng.randrange(10 ** 12):012d}",
+            "address": f"г. Москва, ул. Складская, д. {i + 1}",
+            "bank_name": "ПАО Банк",
+            "bik": f"04{rng.randrange(10 ** 7):07d}",
+            "rs": f"40702810{rng.randrange(10 ** 12):012d}",
+            "ks": f"30101810{rng.randrange(10 ** 12):012d}",
+            "contract_number": f"ТЭ-{i:04d}",
+            "contract_date": "01.01.2025",
+        })
+    return carriers
+def make_bids(count, seed=1, now=None, span_days=365):
+    """Заявки в формате bids.json, созданные за последние span_days дней"""
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    bids = []
+    for i in range(count):
+        created = now - timedelta(days=span_days * (count - i) / max(count, 1), minutes=rng.randrange(600))
+        bids.append({
+            "id": f"BENCH-{i:07d}",
+            "order_number": f"IN{created:%y}-{i % 1000:03d}",
+            "date_created": created.isoformat(),
+            "status": "Новая",
+            "details": {
+                "country_from": rng.choice(COUNTRIES),
+                "incoterm": rng.choice(INCOTERMS),
+                "port_from": rng.choice(PORTS),
+                "ready_date": (created + timedelta(days=rng.randrange(7, 45))).date().isoformat(),
+                "container_type": rng.choice(CONTAINERS),
+                "cargo_type": "не опасный",
+                "cargo_description": "- наименование груза : герметики\n- вес (нетто/брутто): 18000/19500\n"
+                                     f"- объём, количество грузовых мест: {rng.randrange(10, 40)} паллет",
+                "delivery_method": rng.choice(DELIVERY_METHODS),
+                "hs_code": f"3214{rng.randrange(10 ** 6):06d}",
+                "loading_address": f"No.{rng.randrange(1, 999)}, Industrial Rd., {rng.choice(PORTS)}",
+                "payment_terms": "50% TT in advance / 50% 14 days after delivery",
+                "notes": "Простой на выгрузке оплачивается отдельно",
+            },
+            "costs": [{"ITEM": item, "COST": 0.0, "CURRENCY": "USD"} for item in COST_ITEMS],
+        })
+    return bids
+def _bid_and_carrier(index, bids, carriers):
+    """Заявка и перевозчик i-го ответа: по одной заявке перевозчики не повторяются
+    (ключ предложения в хранилище - ID заявки и перевозчик)"""
+    bid_index, round_index = index % len(bids), index // len(bids)
+    return bids[bid_index], carriers[(bid_index * 7 + round_index) % len(carriers)]
+def random_costs(rng):
+    """Расчет стоимости перевозчика: часть пунктов заполнена, валюты смешаны"""
+    costs = []
+    for item in COST_ITEMS:
+        if rng.random() < 0.55:
+            currency = rng.choice(CURRENCIES)
+            base = rng.uniform(50_000, 400_000) if currency == "RUB" else rng.uniform(100, 4_000)
+            costs.append({"ITEM": item, "COST": round(base, 2), "CURRENCY": currency})
+    return costs or [{"ITEM": "Sea freight", "COST": round(rng.uniform(500, 4_000), 2), "CURRENCY": "USD"}]
+def make_replies(bids, carriers, count, format_email, seed=1):
+    """Ответы перевозчиков в формате MailboxReader: тело - письмо заявки (format_email)
+    с заполненным расчетом стоимости, ставкой и условиями"""
+    rng = random.Random(seed)
+    replies = []
+    for i in range(count):
+        bid, carrier = _bid_and_carrier(i, bids, carriers)
+        costs = random_costs(rng)
+        body = format_email(dict(bid, costs=costs))
+        body += (f"\n\nСтавка: {sum(c['COST'] for c in costs if c['CURRENCY'] == 'USD'):.2f} USD"
+                 f"\nУсловия: свободное время {rng.choice([7, 10, 14, 21])} дней\n")
+        received = datetime.fromisoformat(bid["date_created"]) + timedelta(hours=rng.randrange(1, 72), seconds=i % 60)
+        replies.append({
+            "sender": carrier["name"],
+            "sender_email": carrier["email"],
+            "received": received.replace(microsecond=0),
+            "subject": f"RE: Новая заявка {bid['id']}",
+            "body": body,
+        })
+    return replies
+def make_offers(count, bids, carriers, seed=1):
+    """Предложения в формате offers.json (как после разбора писем), по заявкам bids"""
+    rng = random.Random(seed)
+    offers = []
+    for i in range(count):
+        bid, carrier = _bid_and_carrier(i, bids, carriers)
+        costs = random_costs(rng)
+        received = datetime.fromisoformat(bid["date_created"]) + timedelta(hours=rng.randrange(1, 72))
+        offers.append({
+            "sender": carrier["name"],
+            "sender_email": carrier["email"],
+            "email_date": received.strftime("%Y-%m-%d %H:%M:%S"),
+            "subject": f"RE: Новая заявка {bid['id']}",
+            "status": rng.choice(STATUSES),
+            "bid_id": bid["id"],
+            "order_number": bid["order_number"],
+            "rate": f"{rng.uniform(500, 5_000):.2f}",
+            "currency": "USD",
+            "conditions": "свободное время 14 дней",
+            "costs": costs,
+            "parse_confidence": 1.0,
+        })
+    return offers
+def make_dataset(offer_count, offers_per_bid=5, carrier_count=200, seed=1):
+    """Согласованный набор: (перевозчики, заявки, предложения) на offer_count предложений"""
+    carriers = make_carriers(min(carrier_count, max(offer_count, 1)), seed)
+    bids = make_bids(max(1, offer_count // offers_per_bid), seed)
+    return carriers, bids, make_offers(offer_count, bids, carriers, seed)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Импорт списка перевозчиков (CSV/Excel) с обновлением существующих записей.
+
+Нормализация и проверка email выполняются операциями над колонками pandas.
+Строка файла сопоставляется с перевозчиком сначала по первому email, затем по
+названию (без учета регистра). У найденного перевозчика обновляются только поля,
+заполненные в файле, остальные (например, примечания) сохраняются, а адреса из
+файла добавляются к уже известным адресам перевозчика. Новые
+перевозчики добавляются в конец списка."""
+import numpy as np
+import pandas as pd
+# --- Конфигурация ---
+EMAIL_PATTERN = r"[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}"
+EMAIL_SEPARATOR = ", "
+REQUIRED_COLUMNS = {"name", "email"}
+# Служебные колонки нормализованной таблицы
+ROW, EMAIL_KEY, NAME_KEY, ERROR = "_row", "_email_key", "_name_key", "_error"
+HELPER_COLUMNS = [ROW, EMAIL_KEY, NAME_KEY, ERROR]
+def normalize_carriers(frame, row_offset=2):
+    """Нормализует таблицу перевозчиков: пробелы в названии, email в нижнем регистре
+    через ", " без повторов. Добавляет номер строки (row_offset - номер первой строки
+    данных, для файла с заголовком - 2), ключи сопоставления и причину ошибки."""
+    frame = frame.copy()
+    frame.columns = [str(column).strip() for column in frame.columns]
+    frame = frame.reset_index(drop=True)
+    frame["name"] = frame["name"].fillna("").astype(str).str.strip().str.replace(r"\s+", " ", regex=True)
+    addresses = _split_addresses(frame["email"])
+    valid = addresses.str.fullmatch(EMAIL_PATTERN)
+    all_valid = valid.groupby(level=0).all().reindex(frame.index, fill_value=True)
+    frame["email"] = _join_addresses(addresses, frame.index)
+    frame[ROW] = frame.index + row_offset
+    frame[EMAIL_KEY] = addresses.groupby(level=0).first().reindex(frame.index, fill_value="")
+    frame[NAME_KEY] = frame["name"].str.casefold()
+    frame[ERROR] = np.select(
+        [frame["name"] == "", frame["email"] == "", ~all_valid],
+        ["не указано название", "не указан email", "некорректный email"],
+        default=""
+    )
+    return frame
+def _split_addresses(emails):
+    """Адреса по строкам: Series, индекс - строка таблицы, значения - адреса в нижнем
+    регистре в исходном порядке, без повторов внутри строки"""
+    # Разделители адресов - запятая, точка с запятой, двоеточие или пробел
+    raw_emails = (emails.fillna("").astype(str).str.lower()
+                  .str.replace(r"[;:,\s]+", ",", regex=True).str.strip(","))
+    addresses = raw_emails.str.split(",").explode()
+    addresses = addresses[addresses.notna() & (addresses != "")]
+    pairs = addresses.rename("address").rename_axis("row").reset_index().drop_duplicates()
+    return pd.Series(pairs["address"].to_numpy(), index=pairs["row"].to_numpy(), dtype=object)
+def _join_addresses(addresses, index):
+    """Склеивает адреса каждой строки через EMAIL_SEPARATOR: адреса раскладываются
+    по колонкам (i-й адрес строки - в колонку i) и соединяются str.cat"""
+    if addresses.empty:
+        return pd.Series("", index=index)
+    wide = (addresses.to_frame("address")
+            .set_index(addresses.groupby(level=0).cumcount(), append=True)["address"]
+            .unstack(fill_value=""))
+    columns = [wide[column] for column in wide.columns]
+    joined = columns[0].str.cat(columns[1:], sep=",") if len(columns) > 1 else columns[0]
+    joined = joined.str.strip(",").str.replace(r",+", EMAIL_SEPARATOR, regex=True)
+    return joined.reindex(index, fill_value="")
+def _records(frame):
+    """Записи без служебных колонок; пустые значения (NaN) - пустые строки"""
+    data = frame.drop(columns=[c for c in HELPER_COLUMNS if c in frame.columns]).astype(object)
+    return data.where(data.notna(), "").to_dict('records')
+def _invalid(frame):
+    bad = frame[frame[ERROR] != ""]
+    return bad[[ROW, "name", "email", ERROR]].rename(columns={ROW: "row", ERROR: "error"}).to_dict('records')
+def validate_carriers(frame, row_offset=1):
+    """Проверяет весь список (редактор на экране): возвращает (записи, ошибки).
+
+    Нормализация используется только для проверки: записи сохраняются в том виде,
+    в каком их ввел пользователь"""
+    frame = frame.reset_index(drop=True)
+    normalized = normalize_carriers(frame, row_offset)
+    # Пустые строки, добавленные в редакторе и не заполненные, не считаются ошибкой
+    blank = (normalized["name"] == "") & (normalized["email"] == "")
+    return _records(frame[~blank]), _invalid(normalized[~blank])
+def _match_rows(rows, current_keys):
+    """Позиции перевозчиков справочника для строк файла (NaN - новый перевозчик).
+    Сопоставление: сначала по первому email, затем по названию (первая запись с ключом).
+    Возвращает (строки, позиции, число отброшенных строк): если две строки файла нашли
+    одного перевозчика, остается последняя"""
+    by_email = current_keys[current_keys[EMAIL_KEY] != ""].drop_duplicates(EMAIL_KEY)
+    by_name = current_keys[current_keys[NAME_KEY] != ""].drop_duplicates(NAME_KEY)
+    position = rows[EMAIL_KEY].map(pd.Series(by_email.index, index=by_email[EMAIL_KEY]))
+    position = position.fillna(rows[NAME_KEY].map(pd.Series(by_name.index, index=by_name[NAME_KEY])))
+    taken_twice = position.notna() & position.duplicated(keep="last")
+    return rows[~taken_twice], position[~taken_twice], int(taken_twice.sum())
+def _merge_addresses(old_emails, new_emails):
+    """Дополняет адреса перевозчиков адресами из файла (без повторов, в нижнем регистре).
+    Возвращает (все адреса, добавленные адреса) - строки через EMAIL_SEPARATOR"""
+    old_addresses = _split_addresses(old_emails)
+    new_addresses = _split_addresses(new_emails)
+    known = pd.MultiIndex.from_arrays([old_addresses.index, old_addresses.to_numpy()])
+    fresh = new_addresses[~pd.MultiIndex.from_arrays([new_addresses.index, new_addresses.to_numpy()]).isin(known)]
+    return (_join_addresses(pd.concat([old_addresses, fresh]), new_emails.index),
+            _join_addresses(fresh, new_emails.index))
+def _changed_cells(updates, before, current_keys):
+    """Ячейки, которые строки файла действительно меняют: заполненные в файле и
+    отличающиеся от справочника. Название, отличающееся только регистром или пробелами,
+    email с теми же адресами в другой записи и равные числа ("5" и 5.0) изменением не считаются"""
+    filled = updates.notna() & (updates.astype(str) != "")
+    filled["name"] &= updates["name"].str.casefold() != current_keys[NAME_KEY]
+    compared = before.astype(object).where(before.notna(), "").astype(str)
+    compared["email"] = current_keys["email"]
+    same_number = (updates.apply(pd.to_numeric, errors="coerce")
+                   .eq(before.apply(pd.to_numeric, errors="coerce")))
+    return updates.astype(str).ne(compared) & ~same_number & filled
+def merge_carriers(existing, incoming, row_offset=2):
+    """Обновляет список перевозчиков existing (список словарей) строками таблицы incoming.
+
+    Возвращает (новый список, сводка). Сводка: {"added", "updated", "unchanged",
+    "duplicates", "invalid": [{"row", "name", "email", "error"}],
+    "diff": [{"action", "name", "email", "fields", "emails_added"}]}
+
+    Email найденного перевозчика не заменяется, а дополняется адресами из файла
+    (emails_added в сводке)."""
+    missing = REQUIRED_COLUMNS - set(str(column).strip() for column in incoming.columns)
+    if missing:
+        raise ValueError(f"В файле нет колонок: {', '.join(sorted(missing))}")
+    rows = normalize_carriers(incoming, row_offset)
+    invalid = _invalid(rows)
+    rows = rows[rows[ERROR] == ""]
+    # Повторы внутри файла: побеждает последняя строка
+    duplicated = rows.duplicated(EMAIL_KEY, keep="last") | rows.duplicated(NAME_KEY, keep="last")
+    rows = rows[~duplicated]
+    current = pd.DataFrame(existing) if existing else pd.DataFrame(columns=["name", "email"])
+    current_keys = normalize_carriers(current[["name", "email"]], 0)
+    rows, position, taken_twice = _match_rows(rows, current_keys)
+    fields = [column for column in rows.columns if column not in HELPER_COLUMNS]
+    # Колонки справочника могут хранить числа (прежний импорт сохранял их из CSV как есть):
+    # работаем со значениями как с объектами, чтобы строки из файла можно было записать
+    current = current.astype(object)
+    for column in fields:
+        if column not in current.columns:
+            current[column] = ""
+    matched = position.notna()
+    updates = rows.loc[matched, fields].astype(object).set_index(position[matched].astype(int))
+    before = current.loc[updates.index, fields]
+    updates["email"], emails_added = _merge_addresses(current_keys.loc[updates.index, "email"], updates["email"])
+    changed_cells = _changed_cells(updates, before, current_keys.loc[updates.index])
+    after = updates.where(changed_cells, before)
+    changed_rows = changed_cells.any(axis=1)
+    current.loc[after.index, fields] = after
+    added = rows.loc[~matched, fields]
+    result = pd.concat([current, added], ignore_index=True)
+    diff = pd.concat([
+        pd.DataFrame({"action": "added", "name": added["name"], "email": added["email"], "fields": "",
+                      "emails_added": ""}),
+        pd.DataFrame({
+            "action": "updated",
+            "name": after.loc[changed_rows, "name"],
+            "email": after.loc[changed_rows, "email"],
+            # Список измененных полей: флаги ячеек, умноженные на названия колонок
+            "fields": changed_cells[changed_rows].astype(object).dot(pd.Index(fields) + ", ").str.rstrip(", "),
+            "emails_added": emails_added[changed_rows],
+        }),
+    ], ignore_index=True)
+    summary = {
+        "added": len(added),
+        "updated": int(changed_rows.sum()),
+        "unchanged": int((~changed_rows).sum()),
+        "duplicates": int(duplicated.sum()) + taken_twice,
+        "invalid": invalid,
+        "diff": diff.to_dict('records'),
+    }
+    return _records(result), summary
+def read_carrier_file(uploaded_file):
+    """Читает загруженный файл CSV или Excel в таблицу (все значения - строки)"""
+    if uploaded_file.name.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(uploaded_file, dtype=str)
+    return pd.read_csv(uploaded_file, dtype=str)
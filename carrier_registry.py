@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Справочник реквизитов перевозчиков (carriers_info.xlsx) с индексами по имени, ИНН и email"""
+import os
+import json
+import datetime
+import threading
+import pandas as pd
+# --- Конфигурация ---
+# Копия справочника в JSON рядом с xlsx: загружается в разы быстрее, чем разбор Excel.
+# Только JSON (не pickle): файл в общей папке не должен иметь возможности выполнить код
+CARRIER_SIDECAR_CACHE = os.environ.get("TT_CARRIER_CACHE", "1") == "1"
+SIDECAR_SUFFIX = ".cache.json"
+SIDECAR_VERSION = 2
+def _file_stamp(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+def normalize_name(value):
+    return str(value).strip() if value is not None else ""
+def normalize_inn(value):
+    """ИНН из Excel может прийти числом (7701234567.0) - приводим к строке цифр"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+def _sidecar_default(value):
+    """Значения из Excel, которых нет в JSON: даты (Timestamp) и числа numpy"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Значение {value!r} нельзя записать в копию справочника")
+def _sidecar_object(value):
+    if set(value) == {"__datetime__"}:
+        return pd.Timestamp(value["__datetime__"])
+    return value
+def split_emails(value):
+    """Разбивает поле email по запятым, точкам с запятой и двоеточиям"""
+    if not isinstance(value, str):
+        return []
+    normalized = value.replace(';', ',').replace(':', ',')
+    return [e.strip().lower() for e in normalized.split(',') if e.strip()]
+class CarrierRegistry:
+    """Справочник перевозчиков: файл читается один раз и перечитывается при изменении"""
+
+    def __init__(self, path, use_sidecar=None):
+        self.path = path
+        self.use_sidecar = CARRIER_SIDECAR_CACHE if use_sidecar is None else use_sidecar
+        self.sidecar_path = path + SIDECAR_SUFFIX
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._by_name = {}
+        self._by_inn = {}
+        self._by_email = {}
+
+    def _read_records(self, stamp):
+        """Читает записи из копии в JSON, если она соответствует xlsx, иначе из Excel"""
+        if self.use_sidecar:
+            try:
+                with open(self.sidecar_path, 'r', encoding='utf-8') as f:
+                    sidecar = json.load(f, object_hook=_sidecar_object)
+                if sidecar["version"] == SIDECAR_VERSION and tuple(sidecar["stamp"]) == stamp:
+                    return sidecar["records"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        records = pd.read_excel(self.path).to_dict('records')
+        if self.use_sidecar:
+            try:
+                tmp_file = self.sidecar_path + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    # NaN пустых ячеек записывается как есть (json допускает NaN при чтении)
+                    json.dump({"version": SIDECAR_VERSION, "stamp": list(stamp), "records": records}, f,
+                              ensure_ascii=False, default=_sidecar_default)
+                os.replace(tmp_file, self.sidecar_path)
+            except (OSError, TypeError, ValueError):
+                pass
+        return records
+
+    def _refresh(self):
+        stamp = _file_stamp(self.path)
+        if stamp == self._stamp:
+            return
+        records = self._read_records(stamp) if stamp else []
+        by_name, by_inn, by_email = {}, {}, {}
+        for record in records:
+            # При повторах побеждает первая строка (как при поиске по df['name'] == ...)
+            by_name.setdefault(normalize_name(record.get('name')), record)
+            inn = normalize_inn(record.get('inn'))
+            if inn:
+                by_inn.setdefault(inn, record)
+            for email in split_emails(record.get('email')):
+                by_email.setdefault(email, record)
+        self._by_name, self._by_inn, self._by_email = by_name, by_inn, by_email
+        self._stamp = stamp
+
+    def _lookup(self, index_name, key):
+        with self._lock:
+            self._refresh()
+            record = getattr(self, index_name).get(key)
+        return dict(record) if record else {}
+
+    def get(self, name):
+        """Реквизиты по точному названию перевозчика (пустой словарь, если не найден)"""
+        return self._lookup("_by_name", normalize_name(name))
+
+    def by_inn(self, inn):
+        return self._lookup("_by_inn", normalize_inn(inn))
+
+    def by_email(self, email):
+        return self._lookup("_by_email", (email or "").strip().lower())
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._by_name)
+# --- Общий экземпляр на процесс ---
+_registries = {}
+_registries_lock = threading.Lock()
+def get_registry(path):
+    """Возвращает справочник для файла (один экземпляр на процесс)"""
+    with _registries_lock:
+        if path not in _registries:
+            _registries[path] = CarrierRegistry(path)
+        return _registries[path]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Подготовка данных и рендеринг договоров по шаблону templates/template.docx"""
+import os
+import re
+import zipfile
+import threading
+from io import BytesIO
+from functools import lru_cache
+from datetime import datetime
+# --- Конфигурация ---
+TEMPLATE_PATH = os.path.join("templates", "template.docx")
+CONTRACTS_DIR = "contracts"
+# Сколько договоров должно приходиться на рабочий процесс, чтобы окупить его запуск
+# (на Windows каждый процесс заново импортирует docxtpl и разбирает шаблон - около секунды,
+# рендеринг одного договора - десятки миллисекунд). Меньше - рендерим в текущем процессе
+PARALLEL_JOBS_PER_WORKER = int(os.environ.get("TT_CONTRACT_JOBS_PER_WORKER", "30"))
+# --- Данные для шаблона ---
+def contract_file_name(bid_id, sender):
+    """Имя файла договора; символы, недопустимые в именах файлов, заменяются на _"""
+    return re.sub(r'[\\/:*?"<>|]+', "_", f"contract_{bid_id}_{sender}.docx")
+def build_contract_context(bid_data, offer_data, carrier_info):
+    """Собирает контекст шаблона из заявки, предложения и реквизитов перевозчика"""
+    # Используем email из carriers_info, если он там есть, иначе - из предложения
+    carrier_email_for_template = carrier_info.get('email', offer_data.get('sender_email', ''))
+    context = {
+        'id': bid_data['id'],
+        'date_created': datetime.now().strftime('%d.%m.%Y'),
+        'carrier_name': offer_data['sender'],
+        'carrier_email': carrier_email_for_template,
+        'country_from': bid_data['details']['country_from'],
+        'loading_address': bid_data['details']['loading_address'],
+        'cargo_type': bid_data['details']['cargo_type'],
+        'cargo_description': bid_data['details'].get('cargo_description', ''),
+        'container_type': bid_data['details']['container_type'],
+        'hs_code': bid_data['details']['hs_code'],
+        'incoterm': bid_data['details']['incoterm'],
+        'ready_date': bid_data['details']['ready_date'],
+        'payment_terms': bid_data['details']['payment_terms'],
+        'notes': bid_data['details']['notes'],
+        # Инициализация всех полей стоимости
+        'pre_carriage_cost': 0,
+        'pre_carriage_currency': '',
+        'othc_cost': 0,
+        'othc_currency': '',
+        'sea_freight_cost': 0,
+        'sea_freight_currency': '',
+        # Информация о перевозчике
+        'name': carrier_info.get('name', ''),
+        'email': carrier_info.get('email', ''),
+        'legal_name': carrier_info.get('legal_name', ''),
+        'inn': carrier_info.get('inn', ''),
+        'kpp': carrier_info.get('kpp', ''),
+        'ogrn': carrier_info.get('ogrn', ''),
+        'address': carrier_info.get('address', ''),
+        'bank_name': carrier_info.get('bank_name', ''),
+        'bik': carrier_info.get('bik', ''),
+        'rs': carrier_info.get('rs', ''),
+        'ks': carrier_info.get('ks', ''),
+        'contract_number': carrier_info.get('contract_number', ''),
+        'contract_date': carrier_info.get('contract_date', ''),
+    }
+    # Заполняем данные о стоимости из предложения
+    for cost in offer_data.get('costs', []):
+        item_name = cost.get('ITEM', '')
+        if 'Pre-carriage' in item_name:
+            context['pre_carriage_cost'] = cost.get('COST', 0)
+            context['pre_carriage_currency'] = cost.get('CURRENCY', 'USD')
+        elif 'OTHC' in item_name:
+            context['othc_cost'] = cost.get('COST', 0)
+            context['othc_currency'] = cost.get('CURRENCY', 'USD')
+        elif 'Sea freight' in item_name:
+            context['sea_freight_cost'] = cost.get('COST', 0)
+            context['sea_freight_currency'] = cost.get('CURRENCY', 'USD')
+    return context
+def contract_record(bid_data, offer_data, file_path):
+    """Запись о договоре для хранилища"""
+    return {
+        "bid_id": bid_data['id'],
+        "offer_id": offer_data.get('bid_id', ''),
+        "carrier": offer_data['sender'],
+        "date": datetime.now().isoformat(),
+        "file_path": file_path,
+        "status": "generated"
+    }
+# --- Кэш шаблона ---
+# путь -> {"stamp", "data" (байты .docx), "body_xml" (подготовленный XML тела), "env" (jinja)}
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+def _file_stamp(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+def _caching_environment():
+    """jinja-окружение, которое компилирует каждый исходный текст шаблона один раз"""
+    from jinja2 import Environment
+
+    class CachingEnvironment(Environment):
+        def __init__(self):
+            super().__init__()
+            self._compiled = {}
+
+        def from_string(self, source, globals=None, template_class=None):
+            if globals or template_class:
+                return super().from_string(source, globals, template_class)
+            template = self._compiled.get(source)
+            if template is None:
+                template = self._compiled[source] = super().from_string(source)
+            return template
+
+    return CachingEnvironment()
+def get_template_entry(template_path=TEMPLATE_PATH):
+    """Возвращает закэшированный шаблон; перечитывается при изменении файла"""
+    stamp = _file_stamp(template_path)
+    with _template_cache_lock:
+        entry = _template_cache.get(template_path)
+        if entry is None or entry["stamp"] != stamp:
+            with open(template_path, 'rb') as f:
+                data = f.read()
+            entry = {"stamp": stamp, "data": data, "body_xml": None, "env": _caching_environment()}
+            _template_cache[template_path] = entry
+        return entry
+# --- Рендеринг ---
+@lru_cache(maxsize=1)
+def _cached_template_class():
+    from docxtpl import DocxTemplate
+
+    class CachedDocxTemplate(DocxTemplate):
+        """Документ открывается из байтов в памяти, подготовленный XML тела берется из кэша"""
+
+        def __init__(self, entry):
+            super().__init__(BytesIO(entry["data"]))
+            self.cache_entry = entry
+
+        def build_xml(self, context, jinja_env=None):
+            if self.cache_entry["body_xml"] is None:
+                self.cache_entry["body_xml"] = self.patch_xml(self.get_xml())
+            return self.render_xml_part(self.cache_entry["body_xml"], self.docx._part, context, jinja_env)
+
+    return CachedDocxTemplate
+def render_contract(context, template_path=TEMPLATE_PATH):
+    """Рендерит договор и возвращает содержимое .docx (без временных файлов)"""
+    entry = get_template_entry(template_path)
+    doc = _cached_template_class()(entry)
+    doc.render(context, jinja_env=entry["env"])
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+def _render_job(job):
+    """Задача для рабочего процесса: (имя файла, контекст, шаблон) -> (имя файла, docx, ошибка)"""
+    file_name, context, template_path = job
+    try:
+        return file_name, render_contract(context, template_path), None
+    except Exception as e:
+        return file_name, None, str(e)
+def render_contracts_batch(jobs, template_path=TEMPLATE_PATH, workers=None):
+    """Рендерит пачку договоров, при большом объеме - в нескольких процессах.
+
+    jobs - список (имя файла, контекст). Возвращает список (имя файла, docx, ошибка)
+    в том же порядке."""
+    if not os.path.exists(template_path):
+        raise FileNotFoundError("Шаблон договора не найден")
+    tasks = [(file_name, context, template_path) for file_name, context in jobs]
+    workers = min(workers or os.cpu_count() or 1, len(tasks) // max(1, PARALLEL_JOBS_PER_WORKER))
+    if workers <= 1:
+        return [_render_job(task) for task in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+    # Задачи уходят в процессы пачками: по несколько пачек на процесс для выравнивания нагрузки
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_job, tasks, chunksize=chunksize))
+def build_zip(files):
+    """Упаковывает [(имя файла, содержимое)] в ZIP и возвращает его байты.
+    .docx уже сжат, поэтому файлы кладутся без повторного сжатия."""
+    output = BytesIO()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for file_name, data in files:
+            archive.writestr(file_name, data)
+    return output.getvalue()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Курсы валют ЦБ РФ: кэш с временем жизни, история курсов по датам на диске
+и фоновое обновление, чтобы отрисовка страниц не ждала сеть"""
+import os
+import json
+import threading
+import time
+from datetime import date, datetime
+from storage import _file_stamp, read_json, write_json
+# --- Конфигурация ---
+# Источник: адрес cbr-xml-daily.ru или локальный каталог с той же структурой файлов
+# (daily_json.js и archive/ГГГГ/ММ/ДД/daily_json.js) - например, подставной набор для тестов
+RATES_SOURCE = os.environ.get("TT_RATES_SOURCE", "https://www.cbr-xml-daily.ru")
+RATES_HISTORY_FILE = os.environ.get("TT_RATES_HISTORY", "currency_rates.json")
+RATES_TTL = int(os.environ.get("TT_RATES_TTL", "3600"))  # секунды
+RATES_RETRY = int(os.environ.get("TT_RATES_RETRY", "60"))  # пауза после неудачного запроса, секунды
+RATES_TIMEOUT = float(os.environ.get("TT_RATES_TIMEOUT", "5"))
+# Сколько прошедших дат загружать из архива ЦБ за один фоновый запуск
+RATES_ARCHIVE_BATCH = int(os.environ.get("TT_RATES_ARCHIVE_BATCH", "30"))
+FALLBACK_RATES = {"USD": 90.0, "EUR": 100.0}
+# --- Источники ---
+class RateSource:
+    """Источник ответов ЦБ в формате daily_json.js"""
+
+    def __init__(self, base):
+        self.base = base.rstrip("/\\")
+
+    def _path(self, on_date=None):
+        if on_date is None:
+            return "daily_json.js"
+        return f"archive/{on_date:%Y/%m/%d}/daily_json.js"
+
+    def fetch(self, on_date=None):
+        """Курсы на дату (по умолчанию - последние опубликованные)"""
+        raise NotImplementedError
+class HttpRateSource(RateSource):
+    def fetch(self, on_date=None):
+        import requests
+        response = requests.get(f"{self.base}/{self._path(on_date)}", timeout=RATES_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+class FileRateSource(RateSource):
+    """Локальный каталог с файлами в формате cbr-xml-daily.ru"""
+
+    def fetch(self, on_date=None):
+        with open(os.path.join(self.base, *self._path(on_date).split("/")), 'r', encoding='utf-8') as f:
+            return json.load(f)
+def make_source(base=None):
+    """Источник по адресу: http(s):// - сайт, иначе локальный каталог"""
+    base = base or RATES_SOURCE
+    if base.startswith(("http://", "https://")):
+        return HttpRateSource(base)
+    if base.startswith("file://"):
+        base = base[len("file://"):]
+    return FileRateSource(base)
+def parse_payload(payload):
+    """Ответ ЦБ -> (дата курсов, таблица Valute, предыдущая дата, таблица на предыдущую дату).
+    Таблица - все валюты ответа: {код: {"Value": рублей за Nominal единиц, "Nominal": ...}}"""
+    valute = payload["Valute"]
+    rates = {code: {"Value": item["Value"], "Nominal": item.get("Nominal", 1)} for code, item in valute.items()}
+    previous = {code: {"Value": item["Previous"], "Nominal": item.get("Nominal", 1)}
+                for code, item in valute.items() if "Previous" in item}
+    previous_date = payload.get("PreviousDate", "")[:10]
+    return payload["Date"][:10], rates, previous_date, previous
+def unit_rates(valute):
+    """Таблица Valute -> {код: рублей за одну единицу валюты} (JPY, KZT и др. котируются
+    за 10/100 единиц). Числа без Nominal - записи истории в старом формате, за единицу"""
+    result = {}
+    for code, item in valute.items():
+        if isinstance(item, dict):
+            result[code] = item["Value"] / (item.get("Nominal") or 1)
+        else:
+            result[code] = item
+    return result
+# --- Сервис ---
+class RateService:
+    """Курсы в памяти с временем жизни; устаревшие курсы обновляются в фоне.
+    История хранится в файле {"rates": {"ГГГГ-ММ-ДД": таблица Valute}, "fetched_at": ...}"""
+
+    def __init__(self, source=None, history_file=RATES_HISTORY_FILE, ttl=RATES_TTL):
+        self.source = source or make_source()
+        self.history_file = history_file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._fetched_at = 0.0
+        self._failed_at = 0.0
+        self.last_error = None
+        self._thread = None
+        self._requested = set()
+        self._history_cache = None
+        history = read_json(history_file)
+        if isinstance(history, dict) and history.get("fetched_at"):
+            try:
+                self._fetched_at = datetime.fromisoformat(history["fetched_at"]).timestamp()
+            except ValueError:
+                pass
+
+    # --- История ---
+    def history(self):
+        """Курсы за единицу валюты по датам: {"ГГГГ-ММ-ДД": {валюта: курс}}.
+        Пересчитывается только после изменения файла истории"""
+        # Отметка (mtime, размер) берется до чтения: если файл сменится между ними,
+        # следующий вызов увидит новую отметку и пересчитает историю
+        stamp = _file_stamp(self.history_file)
+        cached = self._history_cache
+        if cached and cached[0] == stamp:
+            return cached[1]
+        data = read_json(self.history_file)
+        raw = data.get("rates", {}) if isinstance(data, dict) else {}
+        history = {day: unit_rates(valute) for day, valute in raw.items()}
+        self._history_cache = (stamp, history)
+        return history
+
+    def _save(self, day_rates, fetched):
+        with self._lock:
+            data = read_json(self.history_file)
+            rates = dict(data.get("rates", {})) if isinstance(data, dict) else {}
+            for day, values in day_rates.items():
+                if values:
+                    rates[day] = {**rates.get(day, {}), **values}
+            result = {"rates": dict(sorted(rates.items()))}
+            result["fetched_at"] = datetime.fromtimestamp(fetched).isoformat() if fetched else (
+                data.get("fetched_at") if isinstance(data, dict) else None)
+            write_json(self.history_file, result)
+
+    def rates_on(self, day):
+        """Курсы на дату (ГГГГ-ММ-ДД) из истории или None"""
+        values = self.history().get(str(day)[:10])
+        return dict(values, date=str(day)[:10]) if values else None
+
+    def previous(self, day):
+        """Последние курсы из истории строго до даты или None"""
+        earlier = [d for d in self.history() if d < str(day)[:10]]
+        return self.rates_on(max(earlier)) if earlier else None
+
+    # --- Обновление ---
+    def is_stale(self):
+        return time.time() - self._fetched_at >= self.ttl
+
+    def refresh(self):
+        """Синхронно запрашивает последние курсы и дописывает их в историю"""
+        with self._refreshing:
+            try:
+                day, rates, previous_date, previous = parse_payload(self.source.fetch())
+            except Exception as e:
+                self._failed_at = time.time()
+                self.last_error = str(e)
+                raise
+            fetched = time.time()
+            day_rates = {day: rates}
+            if previous_date and previous_date not in self.history():
+                day_rates[previous_date] = previous
+            self._save(day_rates, fetched)
+            self._fetched_at = fetched
+            self.last_error = None
+            return self.rates_on(day)
+
+    def fetch_date(self, day):
+        """Загружает в историю курсы на прошедшую дату из архива ЦБ"""
+        if isinstance(day, str):
+            day = date.fromisoformat(day[:10])
+        day_key, rates, _, _ = parse_payload(self.source.fetch(day))
+        self._save({day_key: rates}, None)
+        return self.rates_on(day_key)
+
+    def request_dates(self, days):
+        """Загружает в фоне курсы на даты, которых нет в истории (каждая дата
+        запрашивается не больше одного раза за процесс: на выходные ЦБ курсы не публикует)"""
+        history = self.history()
+        today = date.today().isoformat()
+        with self._lock:
+            missing = sorted({str(day)[:10] for day in days if day} - set(history) - self._requested)
+            missing = [day for day in missing if day < today][:RATES_ARCHIVE_BATCH]
+            self._requested.update(missing)
+        if missing:
+            threading.Thread(target=self._fetch_dates_quietly, args=(missing,),
+                             name="rates-archive", daemon=True).start()
+        return missing
+
+    def _fetch_dates_quietly(self, days):
+        for day in days:
+            try:
+                self.fetch_date(day)
+            except Exception:
+                pass
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+
+    def refresh_async(self):
+        """Запускает обновление в фоне, если оно еще не идет"""
+        if self._refreshing.locked() or time.time() - self._failed_at < RATES_RETRY:
+            return
+        threading.Thread(target=self._refresh_quietly, name="rates-refresh", daemon=True).start()
+
+    def start(self):
+        """Фоновый поток, который обновляет курсы по истечении времени жизни"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="rates-refresher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            if self.is_stale():
+                self._refresh_quietly()
+            delay = self.ttl - (time.time() - self._fetched_at)
+            if self.last_error:
+                delay = RATES_RETRY
+            time.sleep(max(1.0, min(delay, self.ttl)))
+
+    # --- Чтение ---
+    def current(self):
+        """Последние известные курсы без ожидания сети: {код валюты: курс за единицу, "date"}.
+        Если курсы устарели, обновление запускается в фоне; пока истории нет -
+        возвращаются резервные значения с датой "N/A"."""
+        if self.is_stale():
+            self.refresh_async()
+        history = self.history()
+        if not history:
+            return dict(FALLBACK_RATES, date="N/A")
+        latest = max(history)
+        return dict(FALLBACK_RATES, **history[latest], date=latest)
+# --- Общий экземпляр на процесс ---
+_services = {}
+_services_lock = threading.Lock()
+def get_rate_service(source=None, history_file=RATES_HISTORY_FILE):
+    """Возвращает сервис курсов (один экземпляр на процесс) с запущенным фоновым обновлением"""
+    key = (source or RATES_SOURCE, history_file)
+    with _services_lock:
+        if key not in _services:
+            service = RateService(make_source(source), history_file)
+            service.start()
+            _services[key] = service
+        return _services[key]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка таблиц в Excel, CSV и Parquet по запросу.
+
+Файл строится только когда пользователь его запросил и хранится в exports/ под
+хэшем содержимого таблицы: повторный запрос тех же данных отдает готовый файл.
+Excel пишется построчно, большие таблицы - в режиме constant_memory xlsxwriter
+(в памяти держится одна строка). Parquet доступен, если установлен pyarrow."""
+import os
+import hashlib
+import importlib.util
+import pandas as pd
+from metrics import span
+# --- Конфигурация ---
+EXPORTS_DIR = os.environ.get("TT_EXPORTS_DIR", "exports")
+# С какого числа строк Excel пишется в режиме constant_memory
+EXPORT_CONSTANT_MEMORY_ROWS = int(os.environ.get("TT_EXPORT_CONSTANT_MEMORY_ROWS", "20000"))
+EXPORT_KEEP_FILES = int(os.environ.get("TT_EXPORT_KEEP_FILES", "20"))  # готовых файлов в кэше
+EXPORT_CHUNK_ROWS = 10000  # строк, которые переводятся в значения Python за раз
+EXPORT_FORMATS = {
+    "xlsx": {"label": "Excel", "ext": "xlsx",
+             "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "csv": {"label": "CSV", "ext": "csv", "mime": "text/csv"},
+    "parquet": {"label": "Parquet", "ext": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+def available_formats():
+    """Форматы, которые можно выгрузить в этой установке (Parquet - только с pyarrow)"""
+    formats = dict(EXPORT_FORMATS)
+    if importlib.util.find_spec("pyarrow") is None:
+        formats.pop("parquet")
+    return formats
+def frame_digest(frame, *parts):
+    """Хэш содержимого таблицы (колонки, типы, значения) и дополнительных параметров"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8") + b"\0")
+    digest.update(repr([str(column) for column in frame.columns]).encode("utf-8"))
+    digest.update(repr([str(dtype) for dtype in frame.dtypes]).encode("utf-8"))
+    try:
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    except TypeError:
+        # Нехэшируемые значения (списки, словари) - хэшируем текстовое представление
+        digest.update(frame.to_json(orient="split", index=False, default_handler=str).encode("utf-8"))
+    return digest.hexdigest()
+# --- Запись файлов ---
+def _python_rows(frame):
+    """Строки таблицы значениями Python, частями по EXPORT_CHUNK_ROWS; NaN/NaT - None"""
+    for start in range(0, len(frame), EXPORT_CHUNK_ROWS):
+        chunk = frame.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+        yield from chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+def write_xlsx(frame, path, sheet_name="Лист1"):
+    """Пишет таблицу построчно; от EXPORT_CONSTANT_MEMORY_ROWS строк - в режиме constant_memory.
+    (pandas.to_excel пишет ячейки по колонкам, а constant_memory требует записи по строкам)"""
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": len(frame) >= EXPORT_CONSTANT_MEMORY_ROWS,
+        "nan_inf_to_errors": True,
+        "remove_timezone": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+    })
+    try:
+        worksheet = workbook.add_worksheet(sheet_name[:31])
+        worksheet.write_row(0, 0, [str(column) for column in frame.columns], workbook.add_format({"bold": True}))
+        for row_index, row in enumerate(_python_rows(frame), start=1):
+            worksheet.write_row(row_index, 0, row)
+    finally:
+        workbook.close()
+def write_csv(frame, path):
+    # utf-8-sig: Excel открывает файл с кириллицей без выбора кодировки
+    frame.to_csv(path, index=False, encoding="utf-8-sig", chunksize=EXPORT_CHUNK_ROWS)
+def write_parquet(frame, path):
+    # Колонки со смешанными значениями (числа и строки) pyarrow не принимает - пишем их строками
+    object_columns = {column: "string" for column in frame.columns if frame[column].dtype == object}
+    frame.astype(object_columns).to_parquet(path, index=False)
+# --- Кэш готовых файлов ---
+def export_frame(frame, export_format, sheet_name="Лист1", exports_dir=EXPORTS_DIR):
+    """Возвращает путь к файлу выгрузки; файл строится, только если таких данных
+    в этом формате еще не выгружали"""
+    if export_format not in available_formats():
+        raise ValueError(f"Формат {export_format} недоступен")
+    digest = frame_digest(frame, export_format, sheet_name)
+    path = os.path.join(exports_dir, f"{digest}.{EXPORT_FORMATS[export_format]['ext']}")
+    if os.path.exists(path):
+        # Отмечаем использование, чтобы файл не был удален при очистке кэша
+        os.utime(path)
+        return path
+    os.makedirs(exports_dir, exist_ok=True)
+    tmp_file = f"{path}.tmp.{EXPORT_FORMATS[export_format]['ext']}"
+    with span(f"export_{export_format}"):
+        try:
+            if export_format == "xlsx":
+                write_xlsx(frame, tmp_file, sheet_name)
+            elif export_format == "csv":
+                write_csv(frame, tmp_file)
+            else:
+                write_parquet(frame, tmp_file)
+            os.replace(tmp_file, path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    prune_exports(exports_dir)
+    return path
+def prune_exports(exports_dir=EXPORTS_DIR, keep=EXPORT_KEEP_FILES):
+    """Удаляет из кэша самые давно использованные файлы сверх keep"""
+    try:
+        files = [os.path.join(exports_dir, name) for name in os.listdir(exports_dir) if ".tmp." not in name]
+    except OSError:
+        return
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""Транспорты отправки почты с одной сессией на пакет писем"""
+import os
+import mailbox
+import mimetypes
+import smtplib
+import queue
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from metrics import span
+# --- Конфигурация ---
+# Транспорт по умолчанию: outlook | smtp | outbox
+MAIL_TRANSPORT = os.environ.get("TT_MAIL_TRANSPORT", "outlook")
+SMTP_HOST = os.environ.get("TT_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("TT_SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("TT_SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("TT_SMTP_PASSWORD", "")
+SMTP_FROM = os.environ.get("TT_SMTP_FROM", SMTP_USER or "tender@localhost")
+SMTP_SSL = os.environ.get("TT_SMTP_SSL", "0") == "1"
+SMTP_STARTTLS = os.environ.get("TT_SMTP_STARTTLS", "0") == "1"
+OUTBOX_DIR = os.environ.get("TT_OUTBOX_DIR", "outbox")
+# Параметры массовой рассылки
+FANOUT_WORKERS = int(os.environ.get("TT_FANOUT_WORKERS", "4"))
+FANOUT_RATE = float(os.environ.get("TT_FANOUT_RATE", "5"))  # писем в секунду, 0 - без ограничения
+FANOUT_RETRIES = int(os.environ.get("TT_FANOUT_RETRIES", "3"))
+FANOUT_BACKOFF = float(os.environ.get("TT_FANOUT_BACKOFF", "2"))  # секунды, удваивается с каждой попыткой
+# --- Сборка письма ---
+def build_message(sender, to, subject, body_text, attachments=None):
+    """Собирает MIME-письмо с вложениями (для SMTP и outbox)"""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid()
+    msg.set_content(body_text)
+    for file in attachments or []:
+        ctype, _ = mimetypes.guess_type(file)
+        maintype, subtype = (ctype or "application/octet-stream").split("/", 1)
+        with open(file, "rb") as f:
+            msg.add_attachment(f.read(), maintype=maintype, subtype=subtype,
+                               filename=os.path.basename(file))
+    return msg
+# --- Базовый транспорт ---
+class MailTransport:
+    """Базовый транспорт: соединение открывается при первой отправке и живет до close()"""
+    name = "base"
+
+    def __init__(self):
+        self._opened = False
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _send(self, to, subject, body_text, attachments):
+        raise NotImplementedError
+
+    def send(self, to, subject, body_text, attachments=None):
+        """Отправляет письмо в рамках текущей сессии, исключения пробрасываются вызывающему"""
+        with span(f"mail_send.{self.name}"):
+            if not self._opened:
+                self._open()
+                self._opened = True
+            self._send(to, subject, body_text, attachments or [])
+
+    def close(self):
+        """Закрывает сессию, если она была открыта"""
+        if self._opened:
+            self._opened = False
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+# --- Outlook (COM) ---
+class OutlookTransport(MailTransport):
+    """Отправка через Outlook: один CoInitialize/Dispatch на всю сессию"""
+    name = "outlook"
+
+    def __init__(self):
+        super().__init__()
+        self._outlook = None
+
+    def _open(self):
+        try:
+            import pythoncom
+            import win32com.client as win32
+        except ImportError as e:
+            raise RuntimeError("Outlook недоступен: не установлен pywin32. "
+                               "Задайте TT_MAIL_TRANSPORT=smtp или outbox") from e
+        pythoncom.CoInitialize()
+        try:
+            self._outlook = win32.Dispatch("Outlook.Application")
+        except Exception:
+            pythoncom.CoUninitialize()
+            raise
+
+    def _close(self):
+        import pythoncom
+        self._outlook = None
+        pythoncom.CoUninitialize()
+
+    def _send(self, to, subject, body_text, attachments):
+        mail = self._outlook.CreateItem(0)
+        mail.To = to
+        mail.Subject = subject
+        mail.Body = body_text
+        for file in attachments:
+            mail.Attachments.Add(os.path.abspath(file))
+        mail.Send()
+# --- SMTP ---
+class SmtpTransport(MailTransport):
+    """Отправка через SMTP с повторным использованием одного соединения"""
+    name = "smtp"
+
+    def __init__(self, host=None, port=None, user=None, password=None, sender=None,
+                 use_ssl=None, starttls=None, timeout=30):
+        super().__init__()
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.user = SMTP_USER if user is None else user
+        self.password = SMTP_PASSWORD if password is None else password
+        self.sender = sender or SMTP_FROM
+        self.use_ssl = SMTP_SSL if use_ssl is None else use_ssl
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.timeout = timeout
+        self._smtp = None
+
+    def _open(self):
+        if self.use_ssl:
+            self._smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            self._smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                self._smtp.starttls()
+        if self.user:
+            self._smtp.login(self.user, self.password)
+
+    def _close(self):
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def _send(self, to, subject, body_text, attachments):
+        msg = build_message(self.sender, to, subject, body_text, attachments)
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Сервер закрыл соединение по таймауту — переподключаемся один раз
+            self._close()
+            self._open()
+            self._smtp.send_message(msg)
+# --- Локальный outbox (maildir) ---
+class OutboxTransport(MailTransport):
+    """Складывает письма в локальный maildir вместо отправки (для тестов и Linux)"""
+    name = "outbox"
+
+    def __init__(self, path=None, sender=None):
+        super().__init__()
+        self.path = path or OUTBOX_DIR
+        self.sender = sender or SMTP_FROM
+        self._box = None
+
+    def _open(self):
+        self._box = mailbox.Maildir(self.path, create=True)
+
+    def _close(self):
+        self._box = None
+
+    def _send(self, to, subject, body_text, attachments):
+        self._box.add(build_message(self.sender, to, subject, body_text, attachments))
+# --- Фабрика ---
+TRANSPORTS = {
+    "outlook": OutlookTransport,
+    "smtp": SmtpTransport,
+    "outbox": OutboxTransport,
+}
+def open_transport(name=None):
+    """Создает транспорт по имени (по умолчанию из TT_MAIL_TRANSPORT)"""
+    name = (name or MAIL_TRANSPORT).lower()
+    if name not in TRANSPORTS:
+        raise ValueError(f"Неизвестный почтовый транспорт: {name}")
+    return TRANSPORTS[name]()
+# --- Массовая рассылка ---
+class RateLimiter:
+    """Общий для всех потоков ограничитель: не больше per_second отправок в секунду"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second and per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+def is_transient_error(exc):
+    """Определяет, имеет ли смысл повторять отправку после ошибки"""
+    if isinstance(exc, smtplib.SMTPResponseException):
+        # 4xx - временные ошибки сервера, 5xx - постоянные
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                        ConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return False
+    # Ошибки COM (Outlook занят, RPC недоступен) как правило временные
+    return type(exc).__name__ == "com_error"
+def send_bulk(messages, transport_name=None, workers=None, rate_per_second=None,
+              max_retries=None, backoff=None, on_progress=None):
+    """Рассылает письма пулом потоков с ограничением скорости и повторами.
+
+    messages - список словарей с ключами to, subject, body и необязательными
+    attachments и carrier. Каждый поток открывает собственную сессию транспорта
+    (COM требует инициализации в своем потоке). on_progress(done, total, entry)
+    вызывается в вызывающем потоке после каждого письма.
+    Возвращает отчет о доставке: по одной записи на получателя."""
+    workers = FANOUT_WORKERS if workers is None else workers
+    rate_per_second = FANOUT_RATE if rate_per_second is None else rate_per_second
+    max_retries = FANOUT_RETRIES if max_retries is None else max_retries
+    backoff = FANOUT_BACKOFF if backoff is None else backoff
+    total = len(messages)
+    if not total:
+        return []
+    tasks = queue.Queue()
+    for index, message in enumerate(messages):
+        tasks.put((index, message))
+    results = queue.Queue()
+    limiter = RateLimiter(rate_per_second)
+
+    def deliver(transport, message, entry):
+        """Отправка одного письма с повторами при временных ошибках; результат - в entry"""
+        for attempt in range(1, max_retries + 2):
+            entry["attempts"] = attempt
+            limiter.wait()
+            try:
+                transport.send(message["to"], message["subject"], message["body"],
+                               message.get("attachments"))
+                entry["status"] = "sent"
+                entry["error"] = ""
+                entry["sent_at"] = datetime.now().isoformat()
+                return
+            except Exception as e:
+                entry["error"] = str(e)
+                if not is_transient_error(e) or attempt > max_retries:
+                    return
+                # Сбрасываем сессию, чтобы следующая попытка открыла новое соединение
+                transport.close()
+                time.sleep(backoff * (2 ** (attempt - 1)))
+
+    def worker():
+        transport = None
+        try:
+            transport = open_transport(transport_name)
+        except Exception as e:
+            # Транспорт не создан - все оставшиеся письма этого потока помечаем как ошибку
+            open_error = e
+        while True:
+            try:
+                index, message = tasks.get_nowait()
+            except queue.Empty:
+                break
+            entry = {
+                "carrier": "",
+                "email": "",
+                "status": "failed",
+                "attempts": 0,
+                "error": "",
+                "sent_at": None,
+            }
+            # Любая ошибка в обработке письма (нет поля "to", сбой ограничителя и т.п.)
+            # попадает в отчет: вызывающий поток ждет ровно total результатов
+            try:
+                entry["carrier"] = message.get("carrier", "")
+                entry["email"] = message["to"]
+                if transport is None:
+                    entry["error"] = str(open_error)
+                else:
+                    deliver(transport, message, entry)
+            except Exception as e:
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+            results.put((index, entry))
+        if transport is not None:
+            transport.close()
+
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(max(1, min(workers, total)))]
+    for thread in threads:
+        thread.start()
+    report = [None] * total
+    for done in range(1, total + 1):
+        index, entry = results.get()
+        report[index] = entry
+        if on_progress:
+            on_progress(done, total, entry)
+    for thread in threads:
+        thread.join()
+    return report
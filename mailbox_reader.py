@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""Чтение писем с предложениями: Outlook или локальный mbox/maildir/каталог .eml"""
+import os
+import json
+import glob
+import mailbox
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+# --- Конфигурация ---
+INGEST_STATE_FILE = "ingest_state.json"
+# Фильтр Items.Restrict по дате получения. Синтаксис DASL (@SQL=) принимает дату в UTC
+# в формате ISO и не зависит от региональных настроек Windows, в отличие от
+# "[ReceivedTime] >= '...'", где в русской локали день и месяц меняются местами
+OUTLOOK_RECEIVED_FILTER = '@SQL="urn:schemas:httpmail:datereceived" >= \'{since}\''
+OUTLOOK_FILTER_DATE_FORMAT = "%Y-%m-%d %H:%M"  # точность - минуты
+# Заголовок Message-ID письма в Outlook (PR_INTERNET_MESSAGE_ID)
+PR_INTERNET_MESSAGE_ID = "http://schemas.microsoft.com/mapi/proptag/0x1035001F"
+# --- Курсор (отметка последнего обработанного письма) ---
+def load_cursor(source_id, state_file=INGEST_STATE_FILE):
+    """Возвращает курсор источника: время последнего письма и EntryID писем с этим временем"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            cursor = json.load(f).get(source_id)
+    except (OSError, ValueError):
+        return None
+    if not cursor or not cursor.get("last_received"):
+        return None
+    return {
+        "last_received": datetime.fromisoformat(cursor["last_received"]),
+        "entry_ids": set(cursor.get("entry_ids", [])),
+    }
+def save_cursor(source_id, cursor, state_file=INGEST_STATE_FILE):
+    """Сохраняет курсор источника в файл состояния"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state[source_id] = {
+        "last_received": cursor["last_received"].isoformat(),
+        "entry_ids": sorted(cursor["entry_ids"]),
+    }
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, state_file)
+def is_after_cursor(message, cursor):
+    """Проверяет, что письмо новее курсора"""
+    if cursor is None:
+        return True
+    if message["received"] > cursor["last_received"]:
+        return True
+    return message["received"] == cursor["last_received"] and message["entry_id"] not in cursor["entry_ids"]
+def advance_cursor(cursor, messages):
+    """Сдвигает курсор на самое позднее из обработанных писем"""
+    for message in messages:
+        if cursor is None or message["received"] > cursor["last_received"]:
+            cursor = {"last_received": message["received"], "entry_ids": {message["entry_id"]}}
+        elif message["received"] == cursor["last_received"]:
+            cursor["entry_ids"].add(message["entry_id"])
+    return cursor
+# --- Базовый интерфейс ---
+class MailboxReader:
+    """Источник писем. iter_new(cursor) отдает письма новее курсора в порядке получения.
+
+    Каждое письмо - словарь: entry_id, message_id (заголовок Message-ID, "" если его нет),
+    sender, sender_email, received (datetime), subject, body."""
+    source_id = ""
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_new(self, cursor=None):
+        raise NotImplementedError
+
+    def mark_read(self, message):
+        """Помечает письмо прочитанным в источнике (если источник это поддерживает)"""
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+# --- Outlook ---
+def _com_datetime(value):
+    """Приводит дату COM (pywintypes) к обычному datetime без часового пояса"""
+    return datetime(value.year, value.month, value.day, value.hour, value.minute, value.second)
+def _outlook_sender_email(msg):
+    """Получает SMTP адрес отправителя, даже если SenderEmailAddress - адрес Exchange"""
+    sender_email = msg.SenderEmailAddress
+    if not (sender_email and "@" in sender_email and "." in sender_email.split("@")[-1]):
+        try:
+            sender_obj = msg.Sender
+            if sender_obj:
+                # Попробуем получить SMTP адрес через свойство PropertyAccessor
+                # Это может не сработать для всех типов отправителей
+                smtp_address = sender_obj.PropertyAccessor.GetProperty("http://schemas.microsoft.com/mapi/proptag/0x39FE001E")
+                if smtp_address and "@" in smtp_address:
+                    sender_email = smtp_address
+        except Exception:
+            # Если не удалось получить SMTP адрес, оставляем оригинальный SenderEmailAddress
+            pass
+    return sender_email
+def normalize_message_id(value):
+    """Message-ID без пробелов и угловых скобок ("" если заголовка нет)"""
+    return str(value or "").strip().strip("<>").strip()
+def _outlook_message_id(msg):
+    """Message-ID письма Outlook; у писем без заголовка (внутренние Exchange) - пусто"""
+    try:
+        return normalize_message_id(msg.PropertyAccessor.GetProperty(PR_INTERNET_MESSAGE_ID))
+    except Exception:
+        return ""
+class OutlookReader(MailboxReader):
+    """Чтение папки Outlook с фильтрацией на стороне сервера через Items.Restrict"""
+
+    def __init__(self, folder_name="Предложения"):
+        self.folder_name = folder_name
+        self.source_id = f"outlook:{folder_name}"
+        self._folder = None
+
+    def open(self):
+        try:
+            import pythoncom
+            import win32com.client as win32
+        except ImportError as e:
+            raise RuntimeError("Outlook недоступен: не установлен pywin32. "
+                               "Задайте TT_MAILBOX_SOURCE (mbox, maildir или каталог .eml)") from e
+        pythoncom.CoInitialize()
+        try:
+            outlook = win32.Dispatch("Outlook.Application")
+            namespace = outlook.GetNamespace("MAPI")
+            inbox = namespace.GetDefaultFolder(6)  # Inbox
+            self._folder = inbox
+            if self.folder_name != "Входящие":
+                for i in range(1, inbox.Folders.Count + 1):
+                    if inbox.Folders.Item(i).Name == self.folder_name:
+                        self._folder = inbox.Folders.Item(i)
+                        break
+        except Exception:
+            pythoncom.CoUninitialize()
+            raise
+
+    def close(self):
+        import pythoncom
+        self._folder = None
+        pythoncom.CoUninitialize()
+
+    def _restricted_items(self, cursor):
+        items = self._folder.Items
+        if cursor is None:
+            # Первый запуск: как и раньше, берем только непрочитанные
+            restriction = "[UnRead] = True"
+        else:
+            # Restrict работает с точностью до минуты, поэтому берем с запасом (>=),
+            # а точную границу проверяем по курсору. Курсор хранит местное время - переводим в UTC
+            since = cursor["last_received"].astimezone(timezone.utc)
+            restriction = OUTLOOK_RECEIVED_FILTER.format(since=since.strftime(OUTLOOK_FILTER_DATE_FORMAT))
+        try:
+            items = items.Restrict(restriction)
+        except Exception:
+            # Фильтр не поддерживается хранилищем Outlook - фильтруем на клиенте
+            return self._folder.Items, True
+        items.Sort("[ReceivedTime]")
+        return items, False
+
+    def iter_new(self, cursor=None):
+        items, client_filter = self._restricted_items(cursor)
+        # Результат Restrict - "живая" коллекция: письмо, отмеченное прочитанным
+        # (mark_read во время обхода), выпадает из нее, и следующее письмо было бы
+        # пропущено. Поэтому сначала забираем все письма, затем отдаем по одному
+        for msg in list(items):
+            if client_filter and cursor is None and not msg.UnRead:
+                continue
+            message = {
+                "entry_id": msg.EntryID,
+                "message_id": _outlook_message_id(msg),
+                "sender": msg.SenderName,
+                "sender_email": _outlook_sender_email(msg),
+                "received": _com_datetime(msg.ReceivedTime),
+                "subject": msg.Subject,
+                "body": msg.Body,
+                "_item": msg,
+            }
+            if is_after_cursor(message, cursor):
+                yield message
+
+    def mark_read(self, message):
+        message["_item"].UnRead = False
+# --- Локальные источники ---
+def parse_email_bytes(data, entry_id, fallback_date=None):
+    """Разбирает RFC 822 письмо в словарь формата MailboxReader"""
+    msg = BytesParser(policy=policy.default).parsebytes(data)
+    return message_to_dict(msg, entry_id, fallback_date)
+def message_to_dict(msg, entry_id, fallback_date=None):
+    """Преобразует email.message.Message в словарь формата MailboxReader"""
+    received = None
+    if msg["Date"]:
+        try:
+            received = parsedate_to_datetime(str(msg["Date"]))
+            if received.tzinfo is not None:
+                received = received.astimezone().replace(tzinfo=None)
+        except (TypeError, ValueError):
+            received = None
+    received = (received or fallback_date or datetime.now()).replace(microsecond=0)
+    body_part = msg.get_body(preferencelist=("plain", "html")) if hasattr(msg, "get_body") else None
+    if body_part is not None:
+        body = body_part.get_content()
+    else:
+        payload = msg.get_payload(decode=True) or b""
+        body = payload.decode(msg.get_content_charset() or "utf-8", errors="replace")
+    sender_name, sender_email = "", ""
+    if msg["From"]:
+        addresses = getattr(msg["From"], "addresses", ())
+        if addresses:
+            sender_name = addresses[0].display_name or addresses[0].addr_spec
+            sender_email = addresses[0].addr_spec
+        else:
+            sender_email = str(msg["From"])
+            sender_name = sender_email
+    return {
+        "entry_id": str(msg["Message-ID"] or entry_id).strip(),
+        "message_id": normalize_message_id(msg["Message-ID"]),
+        "sender": sender_name,
+        "sender_email": sender_email,
+        "received": received,
+        "subject": str(msg["Subject"] or ""),
+        "body": body,
+    }
+class LocalMailboxReader(MailboxReader):
+    """Чтение писем из mbox-файла, maildir или каталога с .eml/.txt файлами (без Outlook)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.source_id = f"local:{os.path.abspath(path)}"
+
+    def _iter_all(self):
+        if os.path.isfile(self.path):
+            for key, msg in mailbox.mbox(self.path, factory=None, create=False).iteritems():
+                yield parse_email_bytes(msg.as_bytes(), f"{self.path}#{key}")
+        elif os.path.isdir(os.path.join(self.path, "cur")):
+            box = mailbox.Maildir(self.path, factory=None, create=False)
+            for key in box.iterkeys():
+                yield parse_email_bytes(box.get_bytes(key), key)
+        else:
+            for file in sorted(glob.glob(os.path.join(self.path, "*"))):
+                yield read_message_file(file)
+
+    def iter_new(self, cursor=None):
+        messages = [m for m in self._iter_all() if m is not None and is_after_cursor(m, cursor)]
+        messages.sort(key=lambda m: m["received"])
+        return iter(messages)
+def read_message_file(file):
+    """Читает одно письмо из .eml файла или тело письма из .txt файла"""
+    extension = os.path.splitext(file)[1].lower()
+    mtime = datetime.fromtimestamp(os.path.getmtime(file)).replace(microsecond=0)
+    if extension == ".eml":
+        with open(file, 'rb') as f:
+            return parse_email_bytes(f.read(), os.path.abspath(file), mtime)
+    if extension == ".txt":
+        with open(file, 'r', encoding='utf-8', errors='replace') as f:
+            body = f.read()
+        return {
+            "entry_id": os.path.abspath(file),
+            "message_id": "",
+            "sender": os.path.splitext(os.path.basename(file))[0],
+            "sender_email": "",
+            "received": mtime,
+            "subject": "",
+            "body": body,
+        }
+    return None
+def open_reader(source=None, folder_name="Предложения"):
+    """Создает источник писем: локальный путь или папка Outlook"""
+    if source:
+        return LocalMailboxReader(source)
+    return OutlookReader(folder_name)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Замеры времени основных операций: отправка почты, разбор писем, чтение и запись
+JSON, генерация договоров, курсы валют, построение таблицы предложений.
+
+Для каждой операции хранятся последние TT_METRICS_WINDOW замеров (для p50/p95)
+и накопленные счетчики. Выгрузка - текст в формате Prometheus; если задан
+TT_METRICS_FILE, фоновый поток периодически записывает его в файл (например,
+для textfile collector у node_exporter)."""
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+# --- Конфигурация ---
+METRICS_WINDOW = int(os.environ.get("TT_METRICS_WINDOW", "500"))  # замеров на операцию
+METRICS_FILE = os.environ.get("TT_METRICS_FILE", "")  # пусто - файл не пишется
+METRICS_INTERVAL = int(os.environ.get("TT_METRICS_INTERVAL", "15"))  # секунды между записями файла
+METRIC_PREFIX = "tender_span"
+class SpanStats:
+    """Замеры одной операции: окно последних длительностей и счетчики с начала работы"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.last = 0.0
+class Timings:
+    """Замеры по именам операций (потокобезопасно)"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = SpanStats(self.window)
+            stats.recent.append(seconds)
+            stats.count += 1
+            stats.total += seconds
+            stats.last = seconds
+            if error:
+                stats.errors += 1
+
+    @contextmanager
+    def span(self, name):
+        """Замеряет время блока; исключение засчитывается как ошибка и пробрасывается дальше"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, error)
+
+    def snapshot(self):
+        """[{"span", "count", "errors", "p50", "p95", "max", "last", "sum"}] по имени операции, секунды.
+        Перцентили и максимум - по окну последних замеров"""
+        with self._lock:
+            items = [(name, sorted(stats.recent), stats.count, stats.errors, stats.last, stats.total)
+                     for name, stats in self._spans.items()]
+        return [
+            {"span": name, "count": count, "errors": errors,
+             "p50": percentile(recent, 50), "p95": percentile(recent, 95),
+             "max": recent[-1] if recent else 0.0, "last": last, "sum": total}
+            for name, recent, count, errors, last, total in sorted(items)
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+def percentile(sorted_values, q):
+    """Перцентиль по ближайшему рангу для отсортированного списка (0.0 для пустого)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+# --- Общий набор замеров процесса ---
+timings = Timings()
+def span(name):
+    """Контекстный менеджер: with span("json_load"): ..."""
+    return timings.span(name)
+def timed(name):
+    """Декоратор: замеряет каждый вызов функции под именем name"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timings.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+def snapshot():
+    return timings.snapshot()
+# --- Выгрузка в формате Prometheus ---
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+def prometheus_text(items=None):
+    """Замеры в текстовом формате Prometheus: summary с квантилями 0.5/0.95 и счетчик ошибок"""
+    items = snapshot() if items is None else items
+    lines = [
+        f"# HELP {METRIC_PREFIX}_seconds Длительность операции, квантили по последним {METRICS_WINDOW} замерам",
+        f"# TYPE {METRIC_PREFIX}_seconds summary",
+    ]
+    for item in items:
+        label = f'span="{_label(item["span"])}"'
+        lines.append(f'{METRIC_PREFIX}_seconds{{{label},quantile="0.5"}} {item["p50"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_seconds{{{label},quantile="0.95"}} {item["p95"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_seconds_sum{{{label}}} {item["sum"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_seconds_count{{{label}}} {item["count"]}')
+    lines.append(f"# HELP {METRIC_PREFIX}_errors_total Операции, завершившиеся исключением")
+    lines.append(f"# TYPE {METRIC_PREFIX}_errors_total counter")
+    for item in items:
+        lines.append(f'{METRIC_PREFIX}_errors_total{{span="{_label(item["span"])}"}} {item["errors"]}')
+    return "\n".join(lines) + "\n"
+def write_prometheus(path=METRICS_FILE):
+    """Записывает замеры в файл атомарно (временный файл и замена)"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_file, path)
+_exporter = None
+_exporter_lock = threading.Lock()
+def start_exporter(path=METRICS_FILE, interval=METRICS_INTERVAL):
+    """Запускает (один раз на процесс) поток, который пишет замеры в файл раз в interval секунд"""
+    global _exporter
+    if not path:
+        return
+    with _exporter_lock:
+        if _exporter is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    write_prometheus(path)
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+        _exporter.start()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Очередь уведомлений перевозчикам о смене статуса предложения.
+
+Уведомления сначала записываются в файл очереди, затем фоновый поток отправляет их
+с повторами. Для одного предложения в очереди держится одно неотправленное
+уведомление (последний статус), одному перевозчику пишем не чаще раза в минуту."""
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from mail_transport import open_transport, is_transient_error
+from storage import read_json, write_json
+from metrics import span
+logger = logging.getLogger(__name__)
+# --- Конфигурация ---
+NOTIFY_OUTBOX_FILE = os.environ.get("TT_NOTIFY_OUTBOX", "notifications.json")
+NOTIFY_RETRIES = int(os.environ.get("TT_NOTIFY_RETRIES", "5"))
+NOTIFY_BACKOFF = float(os.environ.get("TT_NOTIFY_BACKOFF", "30"))  # секунды, удваивается с каждой попыткой
+NOTIFY_THROTTLE = int(os.environ.get("TT_NOTIFY_THROTTLE", "60"))  # секунд между письмами одному перевозчику
+NOTIFY_KEEP = int(os.environ.get("TT_NOTIFY_KEEP", "1000"))  # сколько завершенных записей хранить
+# Статусы записи: pending - ждет отправки, sending - отправляется, sent, failed
+FINISHED_STATES = ("sent", "failed")
+# Статусы предложения, о которых уведомляем перевозчика
+NOTIFY_STATUSES = ["Отклонено", "Принято"]
+def status_message(offer, new_status):
+    """Тема и текст письма о смене статуса"""
+    subject = f"Обновление статуса заявки {offer['bid_id']}"
+    body = f"""Здравствуйте, {offer['sender']}!
+Статус вашей заявки с ID {offer['bid_id']} изменён на "{new_status}".
+Подробности:
+- Перевозчик: {offer['sender']}
+- ID заявки: {offer['bid_id']}
+- Статус: {new_status}
+С уважением,
+Логистическая система
+"""
+    return subject, body
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+class NotificationOutbox:
+    """Файл очереди уведомлений (список записей), изменения - под блокировкой"""
+
+    def __init__(self, path=NOTIFY_OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        return read_json(self.path)
+
+    def _save(self, records):
+        # Завершенные записи старше последних NOTIFY_KEEP отбрасываются
+        finished = [r for r in records if r["state"] in FINISHED_STATES]
+        if len(finished) > NOTIFY_KEEP:
+            drop = {r["id"] for r in finished[:len(finished) - NOTIFY_KEEP]}
+            records = [r for r in records if r["id"] not in drop]
+        write_json(self.path, records)
+
+    def enqueue(self, offer, new_status):
+        """Ставит уведомление в очередь. Неотправленное уведомление по тому же предложению
+        заменяется новым; если перевозчику уже отправлен этот же статус - ничего не делает.
+        Возвращает True, если в очереди появилось письмо."""
+        key = [offer["bid_id"], offer["sender"]]
+        subject, body = status_message(offer, new_status)
+        now = datetime.now().isoformat()
+        with self._lock:
+            records = self.load()
+            same_offer = [r for r in records if r["offer_key"] == key]
+            # Перевозчик получит только последний статус: неотправленное уведомление заменяется
+            records = [r for r in records if not (r["offer_key"] == key and r["state"] == "pending")]
+            delivered = [r for r in same_offer if r["state"] in ("sending", "sent")]
+            if delivered and delivered[-1]["offer_status"] == new_status:
+                self._save(records)
+                return False
+            records.append({
+                "id": uuid.uuid4().hex,
+                "offer_key": key,
+                "offer_status": new_status,
+                "carrier": offer["sender"],
+                "email": offer.get("sender_email", ""),
+                "subject": subject,
+                "body": body,
+                "state": "pending",
+                "attempts": 0,
+                "error": "",
+                "created_at": now,
+                "next_attempt": now,
+                "sent_at": None,
+            })
+            self._save(records)
+            return True
+
+    def claim_due(self, now=None):
+        """Отбирает записи, которые пора отправлять, и помечает их как sending.
+        Перевозчику, которому писали меньше NOTIFY_THROTTLE секунд назад, отправка откладывается."""
+        now = now or datetime.now()
+        with self._lock:
+            records = self.load()
+            last_by_carrier = {}
+            for record in records:
+                sent_at = _parse_time(record.get("sent_at"))
+                if sent_at and sent_at > last_by_carrier.get(record["carrier"], datetime.min):
+                    last_by_carrier[record["carrier"]] = sent_at
+            claimed = []
+            postponed = False
+            for record in records:
+                if record["state"] != "pending" or _parse_time(record["next_attempt"]) > now:
+                    continue
+                allowed_at = last_by_carrier.get(record["carrier"], datetime.min) + timedelta(seconds=NOTIFY_THROTTLE)
+                if allowed_at > now:
+                    record["next_attempt"] = allowed_at.isoformat()
+                    postponed = True
+                    continue
+                record["state"] = "sending"
+                # Следующее письмо тому же перевозчику - не раньше чем через NOTIFY_THROTTLE
+                last_by_carrier[record["carrier"]] = now
+                claimed.append(dict(record))
+            if claimed or postponed:
+                self._save(records)
+            return claimed
+
+    def finish(self, record_id, error=None, transient=False):
+        """Отмечает результат отправки: успех, повтор с задержкой или окончательная ошибка"""
+        now = datetime.now()
+        with self._lock:
+            records = self.load()
+            for record in records:
+                if record["id"] != record_id:
+                    continue
+                record["attempts"] += 1
+                if error is None:
+                    record.update(state="sent", error="", sent_at=now.isoformat())
+                elif transient and record["attempts"] <= NOTIFY_RETRIES:
+                    delay = NOTIFY_BACKOFF * (2 ** (record["attempts"] - 1))
+                    record.update(state="pending", error=str(error),
+                                  next_attempt=(now + timedelta(seconds=delay)).isoformat())
+                else:
+                    record.update(state="failed", error=str(error))
+            self._save(records)
+
+    def recover(self):
+        """После перезапуска возвращает в очередь записи, отправка которых не завершилась"""
+        with self._lock:
+            records = self.load()
+            interrupted = [r for r in records if r["state"] == "sending"]
+            for record in interrupted:
+                record["state"] = "pending"
+            if interrupted:
+                self._save(records)
+
+    def retry_failed(self):
+        """Возвращает в очередь все записи с окончательной ошибкой"""
+        with self._lock:
+            records = self.load()
+            now = datetime.now().isoformat()
+            count = 0
+            for record in records:
+                if record["state"] == "failed":
+                    record.update(state="pending", attempts=0, next_attempt=now)
+                    count += 1
+            if count:
+                self._save(records)
+            return count
+
+    def summary(self):
+        """Число записей в каждом статусе"""
+        counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0}
+        for record in read_json(self.path):
+            counts[record["state"]] = counts.get(record["state"], 0) + 1
+        return counts
+# --- Фоновая отправка ---
+class NotificationWorker:
+    """Поток, который отправляет уведомления из очереди и записывает время отправки в предложение"""
+
+    def __init__(self, outbox, store=None, transport_name=None, poll_interval=5.0):
+        self.outbox = outbox
+        self.store = store
+        self.transport_name = transport_name
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.outbox.recover()
+            self._thread = threading.Thread(target=self._run, name="notification-outbox", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Будит поток, чтобы новые записи ушли без ожидания очередного опроса"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            # Ошибка опроса (поврежденный файл очереди и т.п.) не останавливает поток,
+            # но пишется в лог и засчитывается в замер notify_drain
+            try:
+                with span("notify_drain"):
+                    self.drain()
+            except Exception:
+                logger.exception("Ошибка обработки очереди уведомлений %s", self.outbox.path)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def drain(self):
+        """Отправляет все записи, которые пора отправить, в одной почтовой сессии"""
+        claimed = self.outbox.claim_due()
+        if not claimed:
+            return 0
+        sent = 0
+        try:
+            transport = open_transport(self.transport_name)
+        except Exception as e:
+            for record in claimed:
+                self.outbox.finish(record["id"], e, transient=True)
+            return 0
+        with transport:
+            for record in claimed:
+                try:
+                    transport.send(record["email"], record["subject"], record["body"])
+                except Exception as e:
+                    self.outbox.finish(record["id"], e, transient=is_transient_error(e))
+                    # Сбрасываем сессию, чтобы следующее письмо открыло новое соединение
+                    transport.close()
+                    continue
+                self.outbox.finish(record["id"])
+                sent += 1
+                if self.store is not None:
+                    key = tuple(record["offer_key"])
+                    try:
+                        with span("notify_status_writeback"):
+                            self.store.update_offers({key: {"last_status_change": datetime.now().isoformat()}})
+                    except Exception:
+                        # Письмо уже отправлено - запись не повторяем, только сообщаем об ошибке
+                        logger.exception("Не удалось записать время уведомления в предложение %s", key)
+        return sent
+# --- Общий экземпляр на процесс ---
+_workers = {}
+_workers_lock = threading.Lock()
+def get_notification_worker(store=None, path=NOTIFY_OUTBOX_FILE):
+    """Возвращает запущенный обработчик очереди уведомлений (один на файл очереди в процессе)"""
+    with _workers_lock:
+        if path not in _workers:
+            worker = NotificationWorker(NotificationOutbox(path), store)
+            worker.start()
+            _workers[path] = worker
+        return _workers[path]
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Разбор ответов перевозчиков: поля заявки, ставка и расчет стоимости.
+
+Можно запускать отдельно для разбора сохраненных писем:
+    python offer_parser.py <файл .eml/.txt или каталог> [--diagnostics]
+"""
+import os
+import re
+import sys
+import json
+# --- Пункты расчета стоимости (в том же порядке, что и в письме заявки) ---
+COST_ITEMS = [
+    "Pre-carriage",
+    "OTHC (Origin Terminal Handling Charges)",
+    "Sea freight",
+    "ЖД перевозка",
+    "Прямое ЖД",
+    "Станционные затраты",
+    "Доставка со станции"
+]
+# --- Шаблоны полей ---
+# (имя группы, поле, шаблон, уверенность). Для каждого поля шаблоны идут по убыванию приоритета:
+# совпадение более приоритетного шаблона в любом месте письма важнее менее приоритетного.
+FIELD_PATTERNS = [
+    ("id_label", "bid_id", r"ID\s*заявки[^\w]*([A-Za-z0-9\-_]+)", 1.0),
+    ("id_bid", "bid_id", r"Заявка\s*№?[^\w]*([A-Za-z0-9\-_]+)", 0.8),
+    ("id_ship", "bid_id", r"(SHIP-\d{8}-\d{4})", 0.6),
+    ("order_code", "order_number", r"Номер\s*заказа[^\w]*([A-Z0-9]{2}\d{2}[-_]\d{3,})", 1.0),
+    ("order_label", "order_number", r"Номер\s*заказа[^\w]*([A-Za-z0-9\-_ \t/]+?)[ \t]*\r?$", 0.8),
+    ("order_label_en", "order_number", r"Order\s*Number[^\w]*([A-Za-z0-9\-_ \t/]+?)[ \t]*\r?$", 0.8),
+    ("rate", "rate", r"Ставка:\s*([\d,.]+)\s*([A-Z]{3})", 1.0),
+    ("conditions", "conditions", r"Условия:[ \t]*([^\r\n]*)", 1.0),
+    # Запасной вариант для номера заказа: любой код вида IN25-001 в тексте
+    ("order_guess", "order_number", r"([A-Z]{2,}\d+[-_]\d{2,})", 0.3),
+]
+FIELD_REGEX = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, _, pattern, _ in FIELD_PATTERNS),
+    re.IGNORECASE | re.MULTILINE
+)
+# Для каждого шаблона: номер группы со значением, поле, приоритет внутри поля и уверенность
+PATTERN_VALUE_GROUP = {}
+PATTERN_FIELD = {}
+PATTERN_PRIORITY = {}
+PATTERN_CONFIDENCE = {}
+_group_index = 1
+for _name, _field, _pattern, _confidence in FIELD_PATTERNS:
+    PATTERN_VALUE_GROUP[_name] = _group_index + 1
+    _group_index += 1 + re.compile(_pattern).groups
+    PATTERN_PRIORITY[_name] = sum(1 for name in PATTERN_FIELD if PATTERN_FIELD[name] == _field)
+    PATTERN_FIELD[_name] = _field
+    PATTERN_CONFIDENCE[_name] = _confidence
+# Одна регулярка для всех пунктов стоимости: пункт в начале строки, далее сумма и валюта
+COST_LINE_REGEX = re.compile(
+    r"^[ \t]*(?P<item>" + "|".join(re.escape(item) for item in sorted(COST_ITEMS, key=len, reverse=True)) + r")(?P<rest>[^\r\n]*)",
+    re.MULTILINE
+)
+COST_VALUE_REGEX = re.compile(r"([\d\s.,]+)\s+([A-Z]{3})")
+COST_SECTION_START = "Расчет стоимости"
+COST_SECTION_END = "Условия оплаты"
+# --- Результат разбора ---
+class ParseResult:
+    """Результат разбора письма: значения полей и диагностика по каждому полю"""
+
+    def __init__(self):
+        self.fields = {
+            "bid_id": "",
+            "order_number": "—",
+            "rate": "",
+            "currency": "",
+            "conditions": "",
+            "costs": []
+        }
+        # поле -> {"confidence": 0..1, "pattern": имя шаблона, "note": пояснение}
+        self.diagnostics = {
+            field: {"confidence": 0.0, "pattern": "", "note": "не найдено"}
+            for field in ["bid_id", "order_number", "rate", "conditions", "costs"]
+        }
+
+    @property
+    def is_offer(self):
+        """Письмо считается предложением, если в нем найден ID заявки"""
+        return bool(self.fields["bid_id"])
+
+    @property
+    def confidence(self):
+        """Итоговая уверенность: минимум по ключевым полям"""
+        return min(self.diagnostics["bid_id"]["confidence"], self.diagnostics["costs"]["confidence"])
+
+    def to_dict(self):
+        return {"fields": self.fields, "diagnostics": self.diagnostics, "confidence": self.confidence}
+# --- Парсер ---
+class OfferParser:
+    """Однопроходный разбор тела письма с предкомпилированными шаблонами"""
+
+    def parse(self, body):
+        """Разбирает текст письма и возвращает ParseResult"""
+        result = ParseResult()
+        body = body or ""
+        best = {}  # поле -> (приоритет, имя шаблона, match)
+        for match in FIELD_REGEX.finditer(body):
+            name = match.lastgroup
+            field = PATTERN_FIELD[name]
+            priority = PATTERN_PRIORITY[name]
+            if field not in best or priority < best[field][0]:
+                best[field] = (priority, name, match)
+        for field, (_, name, match) in best.items():
+            value_group = PATTERN_VALUE_GROUP[name]
+            value = match.group(value_group).strip()
+            if field == "rate":
+                result.fields["rate"] = value.replace(',', '.')
+                result.fields["currency"] = match.group(value_group + 1).strip()
+            else:
+                result.fields[field] = value
+            result.diagnostics[field] = {
+                "confidence": PATTERN_CONFIDENCE[name],
+                "pattern": name,
+                "note": "" if PATTERN_CONFIDENCE[name] >= 1.0 else "найдено резервным шаблоном"
+            }
+        self._parse_costs(body, result)
+        return result
+
+    def _parse_costs(self, body, result):
+        """Разбирает блок "Расчет стоимости" до "Условия оплаты" """
+        cost_start = body.find(COST_SECTION_START)
+        if cost_start == -1:
+            result.diagnostics["costs"]["note"] = "нет блока \"Расчет стоимости\""
+            return
+        cost_end = body.find(COST_SECTION_END, cost_start)
+        if cost_end == -1:
+            cost_end = len(body)
+        cost_section = body[cost_start:cost_end]
+        found = 0
+        failed_lines = []
+        for match in COST_LINE_REGEX.finditer(cost_section):
+            found += 1
+            cost_currency_match = COST_VALUE_REGEX.search(match.group("rest").strip())
+            if not cost_currency_match:
+                failed_lines.append(match.group(0).strip())
+                continue
+            try:
+                # Убираем пробелы и заменяем запятую на точку для корректного парсинга float
+                cost = float(cost_currency_match.group(1).replace(' ', '').replace(',', '.'))
+            except ValueError:
+                failed_lines.append(match.group(0).strip())
+                continue
+            result.fields["costs"].append({
+                "ITEM": match.group("item"),
+                "COST": cost,
+                "CURRENCY": cost_currency_match.group(2)
+            })
+        if found:
+            parsed = len(result.fields["costs"])
+            note = "" if not failed_lines else "не разобраны строки: " + "; ".join(failed_lines)
+            result.diagnostics["costs"] = {"confidence": parsed / found, "pattern": "cost_line", "note": note}
+        else:
+            result.diagnostics["costs"]["note"] = "в блоке стоимости нет известных пунктов"
+# Общий экземпляр (парсер не хранит состояния между письмами)
+parser = OfferParser()
+def parse_offer_text(body):
+    """Разбирает текст письма (без Outlook) и возвращает ParseResult"""
+    return parser.parse(body)
+def build_offer(message, result):
+    """Собирает запись предложения из письма (формат MailboxReader) и результата разбора"""
+    offer_data = {
+        "sender": message["sender"],
+        "sender_email": message["sender_email"],
+        "email_date": message["received"].strftime("%Y-%m-%d %H:%M:%S"),
+        "subject": message["subject"],
+        "status": "Новое",
+    }
+    # Message-ID - устойчивый ключ письма: время получения в Outlook и дата отправки
+    # в выгруженном .eml/mbox различаются, а Message-ID у них один
+    if message.get("message_id"):
+        offer_data["message_id"] = message["message_id"]
+    offer_data.update(result.fields)
+    return offer_data
+def parse_path(path):
+    """Разбирает .eml/.txt файл или все такие файлы каталога, выдает (файл, письмо, ParseResult)"""
+    from mailbox_reader import read_message_file
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path))
+    else:
+        files = [path]
+    for file in files:
+        message = read_message_file(file)
+        if message is not None:
+            yield file, message, parser.parse(message["body"])
+# --- Запуск из командной строки ---
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Использование: python offer_parser.py <файл .eml/.txt или каталог> [--diagnostics]")
+        sys.exit(1)
+    show_diagnostics = "--diagnostics" in sys.argv[2:]
+    for file, message, result in parse_path(sys.argv[1]):
+        record = {"file": file, **result.fields, "confidence": result.confidence}
+        if show_diagnostics:
+            record["diagnostics"] = result.diagnostics
+        print(json.dumps(record, ensure_ascii=False))
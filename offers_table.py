@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Таблица сравнения предложений: числовой расчет векторными операциями pandas,
+форматирование строк - только при выводе на экран"""
+import pandas as pd
+from offer_parser import COST_ITEMS
+# --- Колонки ---
+OFFER_FIELDS = ["email_date", "sender", "bid_id", "order_number", "status"]
+# Названия колонок пунктов стоимости в таблице на экране
+COST_COLUMNS = {item: item for item in COST_ITEMS}
+COST_COLUMNS["OTHC (Origin Terminal Handling Charges)"] = "OTHC"
+COST_PREFIX = "cost: "
+CURRENCY_PREFIX = "currency: "
+# Рубль и пустая валюта (строки без указания валюты) - курс 1 на любую дату
+BASE_CURRENCIES = ("RUB", "RUR", "")
+# --- Построение числовой таблицы ---
+def offers_frame(offers):
+    """Предложения -> DataFrame, по строке на предложение (индекс - позиция в списке)"""
+    frame = pd.DataFrame.from_records(
+        [{field: offer.get(field) for field in OFFER_FIELDS} for offer in offers],
+        columns=OFFER_FIELDS
+    )
+    frame["order_number"] = frame["order_number"].fillna("—")
+    frame["status"] = frame["status"].fillna("Новое")
+    return frame
+def costs_frame(offers):
+    """Все строки стоимости в длинном формате: offer (позиция предложения), ITEM, COST, CURRENCY"""
+    rows = [
+        (index, cost.get("ITEM"), cost.get("COST", 0), cost.get("CURRENCY", ""))
+        for index, offer in enumerate(offers)
+        for cost in offer.get("costs", [])
+        if cost.get("ITEM")
+    ]
+    costs = pd.DataFrame(rows, columns=["offer", "ITEM", "COST", "CURRENCY"])
+    costs["COST"] = pd.to_numeric(costs["COST"], errors="coerce").fillna(0.0)
+    costs["CURRENCY"] = costs["CURRENCY"].fillna("")
+    return costs
+def rate_history_frame(history):
+    """История курсов {"ГГГГ-ММ-ДД": {валюта: курс}} -> таблица date, CURRENCY, RATE,
+    отсортированная по дате (для merge_asof)"""
+    rows = [(day, code, value) for day, values in history.items() for code, value in values.items()]
+    table = pd.DataFrame(rows, columns=["date", "CURRENCY", "RATE"])
+    table["date"] = pd.to_datetime(table["date"], errors="coerce")
+    table["RATE"] = pd.to_numeric(table["RATE"], errors="coerce")
+    return table.dropna().sort_values("date", kind="stable").reset_index(drop=True)
+def rate_table(rates):
+    """Курсы {код: рублей за единицу} -> Series, индексированная кодом валюты.
+    Рубль (и пустая валюта - строки без указания валюты) идет по курсу 1"""
+    table = pd.Series({code: value for code, value in rates.items() if code != "date"}, dtype="float64")
+    return pd.concat([table, pd.Series(1.0, index=list(BASE_CURRENCIES))])
+def convert_costs(costs, rates, rate_history=None):
+    """Добавляет RATE, COST_RUB, UNKNOWN и FALLBACK: пересчет в рубли через таблицу курсов.
+    Валюты, которых нет в таблице курсов ЦБ, не пересчитываются (COST_RUB = 0) и
+    отмечаются в UNKNOWN. С rate_history каждая строка пересчитывается по курсу на свою
+    дату (колонка date): одно соединение merge_asof с последним курсом не позже этой даты;
+    строки, для которых в истории курса нет, пересчитываются по текущему курсу и
+    отмечаются в FALLBACK"""
+    rate = costs["CURRENCY"].map(rate_table(rates))
+    fallback = pd.Series(False, index=costs.index)
+    if rate_history is not None and not rate_history.empty and "date" in costs:
+        dated = costs.loc[costs["date"].notna(), ["date", "CURRENCY"]]
+        dated = dated.rename_axis("row").reset_index().sort_values("date", kind="stable")
+        # Ключи соединения приводятся к одним типам (разрешение дат и тип строк у pandas зависят от данных)
+        dated = dated.astype({"date": "datetime64[ns]", "CURRENCY": object})
+        rate_history = rate_history.astype({"date": "datetime64[ns]", "CURRENCY": object})
+        joined = pd.merge_asof(dated, rate_history, on="date", by="CURRENCY", direction="backward")
+        dated_rate = joined.set_index("row")["RATE"].reindex(costs.index)
+        fallback = dated_rate.isna() & rate.notna() & ~costs["CURRENCY"].isin(BASE_CURRENCIES)
+        rate = dated_rate.fillna(rate)
+    costs["RATE"] = rate
+    costs["UNKNOWN"] = rate.isna() & (costs["COST"] != 0)
+    costs["FALLBACK"] = fallback & (costs["COST"] != 0)
+    costs["COST_RUB"] = (costs["COST"] * rate).fillna(0.0)
+    return costs
+def build_comparison(offers, rates, rate_history=None, peer_offers=None):
+    """Числовая таблица сравнения: стоимость и валюта по каждому пункту, итог в рублях
+    и признак самого дешевого предложения в своей заявке.
+    rates - курсы {код: рублей за единицу}; rate_history (см. rate_history_frame) -
+    пересчет по курсу на дату получения предложения. Предложения с валютами без курса
+    (unknown_currencies) получают неполный итог и не участвуют в выборе лучшего;
+    валюты, пересчитанные по текущему курсу вместо курса на дату, - fallback_currencies.
+    peer_offers - все предложения по заявкам из offers, если offers - только страница
+    выборки: лучшее предложение определяется среди них"""
+    frame = offers_frame(offers)
+    costs = costs_frame(offers)
+    if rate_history is not None:
+        offer_dates = pd.to_datetime(frame["email_date"], errors="coerce").dt.normalize()
+        costs["date"] = offer_dates.reindex(costs["offer"]).to_numpy()
+    costs = convert_costs(costs, rates, rate_history)
+    # По каждому пункту в таблице показывается последняя строка (как и раньше), в итог идут все
+    last = costs.drop_duplicates(["offer", "ITEM"], keep="last")
+    cost_table = last.pivot(index="offer", columns="ITEM", values="COST")
+    currency_table = last.pivot(index="offer", columns="ITEM", values="CURRENCY")
+    for item in COST_ITEMS:
+        if item in cost_table.columns:
+            frame[COST_PREFIX + item] = cost_table[item].reindex(frame.index).fillna(0.0)
+            frame[CURRENCY_PREFIX + item] = currency_table[item].reindex(frame.index).fillna("")
+        else:
+            frame[COST_PREFIX + item] = 0.0
+            frame[CURRENCY_PREFIX + item] = ""
+    frame["total_rub"] = costs.groupby("offer")["COST_RUB"].sum().reindex(frame.index, fill_value=0.0)
+    unknown = costs.loc[costs["UNKNOWN"]].drop_duplicates(["offer", "CURRENCY"])
+    frame["unknown_currencies"] = (
+        unknown.groupby("offer")["CURRENCY"].agg(", ".join).reindex(frame.index).fillna("")
+    )
+    fallback = costs.loc[costs["FALLBACK"]].drop_duplicates(["offer", "CURRENCY"])
+    frame["fallback_currencies"] = (
+        fallback.groupby("offer")["CURRENCY"].agg(", ".join).reindex(frame.index).fillna("")
+    )
+    complete_total = frame["total_rub"].where(frame["unknown_currencies"] == "")
+    if peer_offers is not None:
+        peers = build_comparison(peer_offers, rates, rate_history)
+        frame["min_total_rub"] = frame["bid_id"].map(peers.groupby("bid_id")["min_total_rub"].min())
+    else:
+        frame["min_total_rub"] = complete_total.groupby(frame["bid_id"]).transform("min")
+    frame["is_best"] = complete_total == frame["min_total_rub"]
+    return frame
+# --- Форматирование для экрана ---
+def format_comparison(frame):
+    """Строит таблицу для отображения; индекс совпадает с индексом числовой таблицы"""
+    display = pd.DataFrame(index=frame.index)
+    display["Дата получения"] = frame["email_date"].astype(str).str[:10]
+    display["Перевозчик"] = frame["sender"].astype(str).str[:20]
+    display["ID заявки"] = frame["bid_id"]
+    display["Номер заказа"] = frame["order_number"]
+    for item in COST_ITEMS:
+        display[COST_COLUMNS[item]] = (
+            frame[COST_PREFIX + item].map("{:.2f}".format) + " " + frame[CURRENCY_PREFIX + item]
+        )
+    total = frame["total_rub"].map("{:.2f} ₽".format)
+    total = total.where(~frame["is_best"], "⭐ " + total)
+    # Неполный итог: часть строк в валютах без курса ЦБ
+    has_unknown = frame["unknown_currencies"] != ""
+    total = total.where(~has_unknown, "⚠️ " + total + " + " + frame["unknown_currencies"])
+    # Курса на дату предложения нет в истории: пересчитано по текущему курсу
+    has_fallback = frame["fallback_currencies"] != ""
+    display["Итого (RUB)"] = total.where(~has_fallback, total + " (курс на сегодня: " + frame["fallback_currencies"] + ")")
+    display["Статус"] = frame["status"]
+    return display
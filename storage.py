@@ -0,0 +1,794 @@
+# -*- coding: utf-8 -*-
+"""Хранилище заявок, предложений, перевозчиков и договоров.
+
+Два варианта (TT_STORAGE):
+    json   - файлы bids.json / offers.json / carriers.json / contracts.json (по умолчанию)
+    sqlite - встроенная база SQLite в режиме WAL с индексами; при первом запуске
+             данные переносятся из JSON файлов
+Оба варианта реализуют одинаковые методы, экраны работают с хранилищем только через них.
+"""
+import os
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import date, timedelta
+from metrics import span
+# --- Конфигурация ---
+STORAGE_BACKEND = os.environ.get("TT_STORAGE", "json")
+DB_FILE = os.environ.get("TT_DB_FILE", "tender.db")
+# Через сколько событий журнала предложений записывается новый снимок
+JOURNAL_COMPACT_EVERY = int(os.environ.get("TT_JOURNAL_COMPACT_EVERY", "500"))
+# Сколько предложений в одном запросе стоимостей SQLite (ограничение числа параметров - 999)
+COSTS_CHUNK = 500
+# --- Работа с JSON файлами ---
+def _file_stamp(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+# Общий для всех сессий кэш разобранных файлов: путь -> ((mtime_ns, размер), данные).
+# Данные кэша никому не отдаются: read_json возвращает копию, write_json кэширует копию
+# записанного, поэтому изменения у вызывающего кода не попадают в кэш.
+_json_cache = {}
+_json_cache_lock = threading.Lock()
+_json_cache_stats = {"hits": 0, "misses": 0}
+# Блокировки файлов: запись, замена и отметка (mtime, размер) одного файла идут по очереди
+_path_locks = {}
+def _path_lock(path):
+    with _json_cache_lock:
+        return _path_locks.setdefault(path, threading.Lock())
+def _copy_json(value):
+    """Глубокая копия данных JSON (словари, списки, скаляры) - быстрее copy.deepcopy"""
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+def read_json(filename):
+    """Читает JSON файл через кэш (пустой список, если файла нет) и возвращает копию данных.
+    Файл разбирается заново только если изменились его время изменения или размер."""
+    path = os.path.abspath(filename)
+    stamp = _file_stamp(path)
+    if stamp is None:
+        return []
+    with _json_cache_lock:
+        cached = _json_cache.get(path)
+        if cached and cached[0] == stamp:
+            _json_cache_stats["hits"] += 1
+            return _copy_json(cached[1])
+        _json_cache_stats["misses"] += 1
+    with _path_lock(path):
+        # Отметка и содержимое берутся под блокировкой файла: запись не может пройти между ними
+        stamp = _file_stamp(path)
+        if stamp is None:
+            return []
+        with span("json_load"), open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with _json_cache_lock:
+            _json_cache[path] = (stamp, data)
+    return _copy_json(data)
+def write_json(filename, data):
+    """Записывает JSON файл атомарно (временный файл и замена) и обновляет кэш"""
+    path = os.path.abspath(filename)
+    tmp_file = path + ".tmp"
+    cached = _copy_json(data)
+    with _path_lock(path), span("json_save"):
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cached, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, path)
+        stamp = _file_stamp(path)
+        with _json_cache_lock:
+            if stamp is None:
+                _json_cache.pop(path, None)
+            else:
+                _json_cache[path] = (stamp, cached)
+def cache_stats():
+    """Счетчики кэша JSON файлов: попадания, промахи и число файлов в кэше"""
+    with _json_cache_lock:
+        return dict(_json_cache_stats, entries=len(_json_cache))
+def clear_cache():
+    """Сбрасывает кэш JSON файлов"""
+    with _json_cache_lock:
+        _json_cache.clear()
+def offer_key(offer):
+    """Ключ предложения, которым пользуются экраны: (ID заявки, перевозчик)"""
+    return (offer.get("bid_id", ""), offer.get("sender", ""))
+# --- Выборка предложений ---
+OFFER_SORT_FIELDS = ("email_date", "bid_id", "sender", "status")
+class OfferQuery:
+    """Фильтры, сортировка и страница выборки предложений (page_size=None - без ограничения).
+
+    bid_prefix - начало ID заявки, carrier - часть имени перевозчика (оба без учета
+    регистра), statuses и delivery_methods - допустимые значения, date_from/date_to -
+    даты получения включительно."""
+
+    def __init__(self, bid_prefix="", carrier="", statuses=(), date_from=None, date_to=None,
+                 delivery_methods=(), sort_by="email_date", descending=True, page=1, page_size=50):
+        if sort_by not in OFFER_SORT_FIELDS:
+            raise ValueError(f"Сортировка по полю {sort_by} не поддерживается")
+        self.bid_prefix = (bid_prefix or "").strip()
+        self.carrier = (carrier or "").strip()
+        self.statuses = list(statuses or [])
+        self.date_from = str(date_from)[:10] if date_from else None
+        # Верхняя граница - начало следующего дня (email_date хранится с временем)
+        self.date_before = (date.fromisoformat(str(date_to)[:10]) + timedelta(days=1)).isoformat() if date_to else None
+        self.delivery_methods = list(delivery_methods or [])
+        self.sort_by = sort_by
+        self.descending = descending
+        self.page = max(1, int(page))
+        self.page_size = page_size
+
+    @property
+    def offset(self):
+        return (self.page - 1) * self.page_size if self.page_size else 0
+
+    def matches(self, offer, delivery_by_bid=None):
+        """Проверка одного предложения (для хранилищ без SQL)"""
+        if self.bid_prefix and not str(offer.get("bid_id", "")).lower().startswith(self.bid_prefix.lower()):
+            return False
+        if self.carrier and self.carrier.casefold() not in str(offer.get("sender", "")).casefold():
+            return False
+        if self.statuses and (offer.get("status") or "Новое") not in self.statuses:
+            return False
+        email_date = offer.get("email_date") or ""
+        if self.date_from and email_date < self.date_from:
+            return False
+        if self.date_before and email_date >= self.date_before:
+            return False
+        if self.delivery_methods and (delivery_by_bid or {}).get(offer.get("bid_id")) not in self.delivery_methods:
+            return False
+        return True
+def delivery_methods_by_bid(bids):
+    """ID заявки -> способ доставки"""
+    return {bid["id"]: bid.get("details", {}).get("delivery_method", "") for bid in bids}
+# --- Журнал предложений ---
+class OffersJournal:
+    """Предложения в виде снимка (offers.json) и журнала событий (offers.journal.jsonl).
+
+    Новые предложения, изменения статусов и удаления дописываются в журнал одной
+    строкой на событие. Каждые JOURNAL_COMPACT_EVERY событий состояние записывается
+    новым снимком, а журнал очищается. События идемпотентны (у предложения есть
+    offer_uid), поэтому сбой между записью снимка и очисткой журнала не страшен:
+    повторное применение хвоста дает то же состояние."""
+
+    def __init__(self, snapshot_file, journal_file=None, compact_every=None):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file or os.path.splitext(snapshot_file)[0] + ".journal.jsonl"
+        self.compact_every = compact_every or JOURNAL_COMPACT_EVERY
+        self._lock = threading.RLock()
+        self._offers = None      # offer_uid -> предложение, в порядке поступления
+        self._by_key = {}        # (ID заявки, перевозчик) -> список offer_uid
+        self._snapshot_stamp = None
+        self._journal_offset = 0  # сколько байт журнала уже применено
+        self._journal_events = 0
+
+    # Восстановление состояния
+    def _load_snapshot(self):
+        self._offers = {}
+        self._by_key = {}
+        for index, offer in enumerate(read_json(self.snapshot_file)):
+            self._put(offer.get("offer_uid") or f"legacy:{index}", offer)
+        self._snapshot_stamp = _file_stamp(self.snapshot_file)
+        self._journal_offset = 0
+        self._journal_events = 0
+
+    def _refresh(self):
+        """Подтягивает изменения: новый снимок - полная перезагрузка, иначе только хвост журнала"""
+        if self._offers is None or _file_stamp(self.snapshot_file) != self._snapshot_stamp:
+            self._load_snapshot()
+        journal_stamp = _file_stamp(self.journal_file)
+        journal_size = journal_stamp[1] if journal_stamp else 0
+        if journal_size < self._journal_offset:
+            # Журнал очищен другим процессом после записи снимка
+            self._load_snapshot()
+        if journal_size <= self._journal_offset:
+            return
+        with open(self.journal_file, 'rb') as f:
+            f.seek(self._journal_offset)
+            tail = f.read()
+        # Незавершенная последняя строка (запись еще идет или прервана сбоем) не применяется
+        complete = tail[:tail.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(event)
+            self._journal_events += 1
+        self._journal_offset += len(complete)
+
+    def _put(self, uid, offer):
+        self._offers[uid] = offer
+        self._by_key.setdefault(offer_key(offer), []).append(uid)
+
+    def _apply(self, event):
+        op = event.get("op")
+        if op == "insert":
+            offer = event["offer"]
+            if offer["offer_uid"] not in self._offers:
+                self._put(offer["offer_uid"], offer)
+        elif op == "update":
+            for uid in self._by_key.get(tuple(event["key"]), []):
+                self._offers[uid].update(event["fields"])
+        elif op == "delete":
+            for uid in self._by_key.pop(tuple(event["key"]), []):
+                self._offers.pop(uid, None)
+
+    # Запись
+    def _append(self, events):
+        lines = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in events)
+        with open(self.journal_file, 'ab') as f:
+            if f.tell() > 0:
+                # После сбоя в конце журнала может остаться оборванная строка
+                with open(self.journal_file, 'rb') as check:
+                    check.seek(-1, os.SEEK_END)
+                    if check.read(1) != b"\n":
+                        f.write(b"\n")
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        # Применяем свои же события через чтение хвоста, чтобы не разойтись с другими процессами
+        self._refresh()
+        if self._journal_events >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Записывает текущее состояние новым снимком и очищает журнал"""
+        with self._lock:
+            self._refresh()
+            offers = []
+            for uid, offer in self._offers.items():
+                offer.setdefault("offer_uid", uid if not uid.startswith("legacy:") else uuid.uuid4().hex)
+                offers.append(offer)
+            write_json(self.snapshot_file, offers)
+            with open(self.journal_file, 'wb'):
+                pass
+            self._load_snapshot()
+
+    # Операции
+    def load(self):
+        with self._lock:
+            self._refresh()
+            # Копии записей: экраны меняют полученные словари, кэш трогать нельзя
+            return [_copy_json(offer) for offer in self._offers.values()]
+
+    def find(self, bid_id, sender):
+        with self._lock:
+            self._refresh()
+            uids = self._by_key.get((bid_id, sender))
+            return _copy_json(self._offers[uids[0]]) if uids else None
+
+    def query(self, predicate, sort_field, descending=False, offset=0, limit=None):
+        """Отбирает предложения по условию, сортирует и возвращает (копии записей страницы, всего найдено)"""
+        with self._lock:
+            self._refresh()
+            matched = [offer for offer in self._offers.values() if predicate(offer)]
+            # Сортировка устойчивая: при равных значениях - в порядке поступления
+            matched.sort(key=lambda offer: str(offer.get(sort_field) or ""), reverse=descending)
+            page = matched[offset:offset + limit] if limit else matched[offset:]
+            return [_copy_json(offer) for offer in page], len(matched)
+
+    def insert(self, offers):
+        events = []
+        for offer in offers:
+            offer = dict(offer)
+            offer.setdefault("offer_uid", uuid.uuid4().hex)
+            events.append({"op": "insert", "offer": offer})
+        with self._lock:
+            self._append(events)
+
+    def update(self, changes):
+        events = [{"op": "update", "key": list(key), "fields": fields} for key, fields in changes.items()]
+        with self._lock:
+            self._append(events)
+
+    def delete(self, keys):
+        events = [{"op": "delete", "key": list(key)} for key in keys]
+        with self._lock:
+            self._append(events)
+
+    def replace(self, offers):
+        with self._lock:
+            for offer in offers:
+                offer.setdefault("offer_uid", uuid.uuid4().hex)
+            write_json(self.snapshot_file, list(offers))
+            with open(self.journal_file, 'wb'):
+                pass
+            self._load_snapshot()
+# --- JSON хранилище ---
+class JsonStore:
+    """Хранилище в JSON файлах. Предложения ведутся журналом событий (OffersJournal),
+    остальные файлы при записи перечитываются и перезаписываются целиком - под общей
+    блокировкой хранилища (locked), чтобы одновременные записи из сессий и фоновых
+    потоков не затирали друг друга"""
+    backend = "json"
+
+    def __init__(self, bids_file="bids.json", offers_file="offers.json",
+                 carriers_file="carriers.json", contracts_file="contracts.json"):
+        self.bids_file = bids_file
+        self.offers_file = offers_file
+        self.carriers_file = carriers_file
+        self.contracts_file = contracts_file
+        self.offers_journal = OffersJournal(offers_file)
+        self._lock = threading.RLock()
+
+    def locked(self):
+        """Блокировка записи: составные операции (перенос в архив) выполняются под ней,
+        и записи других сессий ждут их окончания"""
+        return self._lock
+
+    # Заявки
+    def load_bids(self):
+        return read_json(self.bids_file)
+
+    def get_bid(self, bid_id):
+        return next((bid for bid in read_json(self.bids_file) if bid["id"] == bid_id), None)
+
+    def add_bid(self, bid):
+        with self._lock:
+            write_json(self.bids_file, read_json(self.bids_file) + [bid])
+
+    def update_bid(self, bid_id, fields):
+        with self._lock:
+            bids = [dict(bid, **fields) if bid["id"] == bid_id else bid for bid in read_json(self.bids_file)]
+            write_json(self.bids_file, bids)
+
+    def delete_bids(self, bid_ids):
+        bid_ids = set(bid_ids)
+        with self._lock:
+            write_json(self.bids_file, [bid for bid in read_json(self.bids_file) if bid["id"] not in bid_ids])
+
+    # Предложения
+    def load_offers(self):
+        return self.offers_journal.load()
+
+    def find_offer(self, bid_id, sender):
+        return self.offers_journal.find(bid_id, sender)
+
+    def query_offers(self, query):
+        """Страница предложений по OfferQuery: (предложения, всего найдено)"""
+        delivery_by_bid = delivery_methods_by_bid(read_json(self.bids_file)) if query.delivery_methods else None
+        return self.offers_journal.query(
+            lambda offer: query.matches(offer, delivery_by_bid),
+            query.sort_by, query.descending, query.offset, query.page_size
+        )
+
+    def offers_for_bids(self, bid_ids):
+        """Все предложения по заявкам из списка"""
+        bid_ids = set(bid_ids)
+        offers, _ = self.offers_journal.query(lambda offer: offer.get("bid_id") in bid_ids, "email_date")
+        return offers
+
+    def add_offers(self, offers):
+        with self._lock:
+            self.offers_journal.insert(offers)
+
+    def update_offers(self, changes):
+        """changes: {(ID заявки, перевозчик): {поле: значение}}"""
+        with self._lock:
+            self.offers_journal.update(changes)
+
+    def delete_offers(self, keys):
+        with self._lock:
+            self.offers_journal.delete(keys)
+
+    def replace_offers(self, offers):
+        with self._lock:
+            self.offers_journal.replace(offers)
+
+    # Перевозчики
+    def load_carriers(self):
+        return read_json(self.carriers_file)
+
+    def replace_carriers(self, carriers):
+        with self._lock:
+            write_json(self.carriers_file, list(carriers))
+
+    # Договоры
+    def load_contracts(self):
+        return read_json(self.contracts_file)
+
+    def add_contract(self, contract):
+        self.add_contracts([contract])
+
+    def add_contracts(self, contracts):
+        with self._lock:
+            write_json(self.contracts_file, read_json(self.contracts_file) + list(contracts))
+
+    def delete_contracts(self, bid_ids):
+        """Удаляет записи о договорах по заявкам"""
+        bid_ids = set(bid_ids)
+        with self._lock:
+            write_json(self.contracts_file, [c for c in read_json(self.contracts_file) if c.get("bid_id") not in bid_ids])
+
+    # Обслуживание
+    def compact(self):
+        """Записывает новый снимок предложений после массовых удалений"""
+        self.offers_journal.compact()
+# --- SQLite хранилище ---
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS bids (
+    id TEXT PRIMARY KEY,
+    order_number TEXT,
+    date_created TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS offers (
+    offer_id INTEGER PRIMARY KEY,
+    bid_id TEXT,
+    sender TEXT,
+    sender_email TEXT,
+    email_date TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_offers_bid ON offers (bid_id);
+CREATE INDEX IF NOT EXISTS idx_offers_sender ON offers (sender);
+CREATE INDEX IF NOT EXISTS idx_offers_key ON offers (bid_id, sender);
+CREATE INDEX IF NOT EXISTS idx_offers_bid_nocase ON offers (bid_id COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_offers_date ON offers (email_date);
+CREATE INDEX IF NOT EXISTS idx_offers_status ON offers (status);
+CREATE TABLE IF NOT EXISTS offer_costs (
+    offer_id INTEGER NOT NULL REFERENCES offers (offer_id) ON DELETE CASCADE,
+    item TEXT,
+    cost REAL,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_offer_costs_offer ON offer_costs (offer_id);
+CREATE TABLE IF NOT EXISTS carriers (
+    carrier_id INTEGER PRIMARY KEY,
+    name TEXT,
+    email TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_carriers_name ON carriers (name);
+CREATE INDEX IF NOT EXISTS idx_carriers_email ON carriers (email);
+CREATE TABLE IF NOT EXISTS contracts (
+    contract_id INTEGER PRIMARY KEY,
+    bid_id TEXT,
+    carrier TEXT,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contracts_bid ON contracts (bid_id);
+"""
+def _nocase_prefix_range(prefix):
+    """Границы строк с началом prefix в сортировке NOCASE: (от, до не включая).
+    NOCASE приводит к нижнему регистру только латиницу; верхней границы нет,
+    если последний символ увеличить нельзя"""
+    lower = "".join(ch.lower() if ch.isascii() else ch for ch in prefix)
+    following = ord(lower[-1]) + 1
+    if following == 0xD800:
+        following = 0xE000  # суррогаты в строках UTF-8 не встречаются
+    upper = lower[:-1] + chr(following) if following <= 0x10FFFF else None
+    return lower, upper
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, default=str)
+class SqliteStore:
+    """Хранилище в SQLite: чтение и запись отдельных строк, индексы по bid_id и отправителю.
+
+    Полная запись хранится в колонке data (JSON), часто используемые поля
+    продублированы в индексируемых колонках. Стоимости предложений - в offer_costs."""
+    backend = "sqlite"
+
+    def __init__(self, db_file=DB_FILE, bids_file="bids.json", offers_file="offers.json",
+                 carriers_file="carriers.json", contracts_file="contracts.json"):
+        self.db_file = db_file
+        self.json_files = {
+            "bids": bids_file,
+            "offers": offers_file,
+            "carriers": carriers_file,
+            "contracts": contracts_file,
+        }
+        # sqlite3 соединение нельзя использовать из другого потока - у каждого потока свое
+        self._local = threading.local()
+        # Транзакции потоков процесса идут по очереди (между процессами - BEGIN IMMEDIATE)
+        self._lock = threading.RLock()
+        self._connect().executescript(SCHEMA)
+        self._migrate_from_json()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            # Поиск по части имени без учета регистра (встроенный LIKE не знает кириллицу)
+            conn.create_function("casefold", 1, lambda value: value.casefold() if value else "", deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def locked(self):
+        """Блокировка записи: составные операции (перенос в архив) выполняются под ней,
+        и транзакции других потоков ждут их окончания"""
+        return self._lock
+
+    class _Transaction:
+        def __init__(self, conn, lock):
+            self.conn = conn
+            self.lock = lock
+
+        def __enter__(self):
+            self.lock.acquire()
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+            except BaseException:
+                self.lock.release()
+                raise
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            try:
+                self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+            finally:
+                self.lock.release()
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self._connect(), self._lock)
+
+    def _migrate_from_json(self):
+        """Однократный перенос данных из JSON файлов"""
+        with self._transaction() as conn:
+            # Проверка внутри транзакции: другой процесс мог выполнить перенос раньше
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            for bid in read_json(self.json_files["bids"]):
+                self._insert_bid(conn, bid)
+            # Предложения читаем вместе с хвостом журнала
+            self._insert_offers(conn, OffersJournal(self.json_files["offers"]).load())
+            self._insert_carriers(conn, read_json(self.json_files["carriers"]))
+            for contract in read_json(self.json_files["contracts"]):
+                self._insert_contract(conn, contract)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', datetime('now'))")
+
+    # Заявки
+    @staticmethod
+    def _insert_bid(conn, bid):
+        conn.execute(
+            "INSERT OR REPLACE INTO bids (id, order_number, date_created, status, data) VALUES (?, ?, ?, ?, ?)",
+            (bid["id"], bid.get("order_number"), bid.get("date_created"), bid.get("status"), _dumps(bid))
+        )
+
+    def load_bids(self):
+        rows = self._connect().execute("SELECT data FROM bids ORDER BY date_created")
+        return [json.loads(data) for (data,) in rows]
+
+    def get_bid(self, bid_id):
+        row = self._connect().execute("SELECT data FROM bids WHERE id = ?", (bid_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_bid(self, bid):
+        with self._transaction() as conn:
+            self._insert_bid(conn, bid)
+
+    def update_bid(self, bid_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM bids WHERE id = ?", (bid_id,)).fetchone()
+            if row:
+                bid = json.loads(row[0])
+                bid.update(fields)
+                self._insert_bid(conn, bid)
+
+    def delete_bids(self, bid_ids):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM bids WHERE id = ?", [(bid_id,) for bid_id in bid_ids])
+
+    # Предложения
+    @staticmethod
+    def _insert_offers(conn, offers):
+        for offer in offers:
+            data = {k: v for k, v in offer.items() if k != "costs"}
+            cursor = conn.execute(
+                "INSERT INTO offers (bid_id, sender, sender_email, email_date, status, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (offer.get("bid_id", ""), offer.get("sender", ""), offer.get("sender_email", ""),
+                 offer.get("email_date", ""), offer.get("status", "Новое"), _dumps(data))
+            )
+            conn.executemany(
+                "INSERT INTO offer_costs (offer_id, item, cost, currency) VALUES (?, ?, ?, ?)",
+                [(cursor.lastrowid, c.get("ITEM", ""), c.get("COST", 0), c.get("CURRENCY", ""))
+                 for c in offer.get("costs", [])]
+            )
+
+    def _rows_to_offers(self, rows, whole_table=False):
+        """Записи предложений со стоимостями. whole_table - выбраны все предложения:
+        стоимости читаются одним проходом по offer_costs, иначе - по индексу частями
+        по COSTS_CHUNK идентификаторов"""
+        conn = self._connect()
+        offers = {}
+        for offer_id, data in rows:
+            offer = json.loads(data)
+            offer["costs"] = []
+            offers[offer_id] = offer
+        if not offers:
+            return []
+        if whole_table:
+            chunks = [conn.execute("SELECT offer_id, item, cost, currency FROM offer_costs ORDER BY rowid")]
+        else:
+            ids = list(offers)
+            chunks = (
+                conn.execute(
+                    "SELECT offer_id, item, cost, currency FROM offer_costs "
+                    f"WHERE offer_id IN ({','.join('?' * len(part))}) ORDER BY rowid", part
+                )
+                for part in (ids[start:start + COSTS_CHUNK] for start in range(0, len(ids), COSTS_CHUNK))
+            )
+        for cost_rows in chunks:
+            for offer_id, item, cost, currency in cost_rows:
+                if offer_id in offers:
+                    offers[offer_id]["costs"].append({"ITEM": item, "COST": cost, "CURRENCY": currency})
+        return list(offers.values())
+
+    def load_offers(self):
+        return self._rows_to_offers(
+            self._connect().execute("SELECT offer_id, data FROM offers ORDER BY offer_id"), whole_table=True
+        )
+
+    def find_offer(self, bid_id, sender):
+        rows = self._connect().execute(
+            "SELECT offer_id, data FROM offers WHERE bid_id = ? AND sender = ? ORDER BY offer_id LIMIT 1",
+            (bid_id, sender)
+        ).fetchall()
+        offers = self._rows_to_offers(rows)
+        return offers[0] if offers else None
+
+    def query_offers(self, query):
+        """Страница предложений по OfferQuery: (предложения, всего найдено).
+        Фильтрация, сортировка и LIMIT/OFFSET выполняются в SQL по индексам"""
+        where, params = [], []
+        if query.bid_prefix:
+            # Колонка bid_id - BINARY, поэтому LIKE индексом не пользуется. Диапазон по
+            # bid_id COLLATE NOCASE идет по индексу idx_offers_bid_nocase, LIKE уточняет
+            # результат (оба без учета регистра только для латиницы)
+            lower, upper = _nocase_prefix_range(query.bid_prefix)
+            where.append("bid_id COLLATE NOCASE >= ?")
+            params.append(lower)
+            if upper:
+                where.append("bid_id COLLATE NOCASE < ?")
+                params.append(upper)
+            escaped = query.bid_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("bid_id LIKE ? ESCAPE '\\'")
+            params.append(escaped + "%")
+        if query.carrier:
+            where.append("instr(casefold(sender), ?) > 0")
+            params.append(query.carrier.casefold())
+        if query.statuses:
+            where.append(f"status IN ({','.join('?' * len(query.statuses))})")
+            params.extend(query.statuses)
+        if query.date_from:
+            where.append("email_date >= ?")
+            params.append(query.date_from)
+        if query.date_before:
+            where.append("email_date < ?")
+            params.append(query.date_before)
+        if query.delivery_methods:
+            where.append(
+                "bid_id IN (SELECT id FROM bids WHERE json_extract(data, '$.details.delivery_method') "
+                f"IN ({','.join('?' * len(query.delivery_methods))}))"
+            )
+            params.extend(query.delivery_methods)
+        where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM offers{where_sql}", params).fetchone()[0]
+        sql = (f"SELECT offer_id, data FROM offers{where_sql} "
+               f"ORDER BY {query.sort_by} {'DESC' if query.descending else 'ASC'}, offer_id")
+        if query.page_size:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [query.page_size, query.offset]
+        return self._rows_to_offers(conn.execute(sql, params).fetchall()), total
+
+    def offers_for_bids(self, bid_ids):
+        """Все предложения по заявкам из списка"""
+        bid_ids = list(set(bid_ids))
+        offers = []
+        conn = self._connect()
+        for start in range(0, len(bid_ids), 500):
+            chunk = bid_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT offer_id, data FROM offers WHERE bid_id IN ({','.join('?' * len(chunk))}) ORDER BY offer_id",
+                chunk
+            ).fetchall()
+            offers.extend(self._rows_to_offers(rows))
+        return offers
+
+    def add_offers(self, offers):
+        with self._transaction() as conn:
+            self._insert_offers(conn, offers)
+
+    def update_offers(self, changes):
+        """changes: {(ID заявки, перевозчик): {поле: значение}}"""
+        with self._transaction() as conn:
+            for (bid_id, sender), fields in changes.items():
+                rows = conn.execute(
+                    "SELECT offer_id, data FROM offers WHERE bid_id = ? AND sender = ?", (bid_id, sender)
+                ).fetchall()
+                for offer_id, data in rows:
+                    offer = json.loads(data)
+                    offer.update({k: v for k, v in fields.items() if k != "costs"})
+                    conn.execute(
+                        "UPDATE offers SET status = ?, sender_email = ?, email_date = ?, data = ? WHERE offer_id = ?",
+                        (offer.get("status", "Новое"), offer.get("sender_email", ""), offer.get("email_date", ""),
+                         _dumps(offer), offer_id)
+                    )
+
+    def delete_offers(self, keys):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM offers WHERE bid_id = ? AND sender = ?", list(keys))
+
+    def replace_offers(self, offers):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM offers")
+            self._insert_offers(conn, offers)
+
+    # Перевозчики
+    @staticmethod
+    def _insert_carriers(conn, carriers):
+        conn.executemany(
+            "INSERT INTO carriers (name, email, data) VALUES (?, ?, ?)",
+            [(c.get("name"), c.get("email"), _dumps(c)) for c in carriers]
+        )
+
+    def load_carriers(self):
+        rows = self._connect().execute("SELECT data FROM carriers ORDER BY carrier_id")
+        return [json.loads(data) for (data,) in rows]
+
+    def replace_carriers(self, carriers):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM carriers")
+            self._insert_carriers(conn, carriers)
+
+    # Договоры
+    @staticmethod
+    def _insert_contract(conn, contract):
+        conn.execute(
+            "INSERT INTO contracts (bid_id, carrier, date, data) VALUES (?, ?, ?, ?)",
+            (contract.get("bid_id"), contract.get("carrier"), contract.get("date"), _dumps(contract))
+        )
+
+    def load_contracts(self):
+        rows = self._connect().execute("SELECT data FROM contracts ORDER BY contract_id")
+        return [json.loads(data) for (data,) in rows]
+
+    def add_contract(self, contract):
+        self.add_contracts([contract])
+
+    def add_contracts(self, contracts):
+        with self._transaction() as conn:
+            for contract in contracts:
+                self._insert_contract(conn, contract)
+
+    def delete_contracts(self, bid_ids):
+        """Удаляет записи о договорах по заявкам"""
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM contracts WHERE bid_id = ?", [(bid_id,) for bid_id in bid_ids])
+
+    # Обслуживание
+    def compact(self):
+        """Переносит WAL в основной файл базы после массовых удалений"""
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+# --- Выбор хранилища ---
+_stores = {}
+_stores_lock = threading.Lock()
+def open_store(backend=None, **files):
+    """Возвращает хранилище (один экземпляр на процесс для каждого набора параметров)"""
+    backend = (backend or STORAGE_BACKEND).lower()
+    key = (backend, tuple(sorted(files.items())))
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "sqlite":
+                _stores[key] = SqliteStore(**files)
+            elif backend == "json":
+                _stores[key] = JsonStore(**files)
+            else:
+                raise ValueError(f"Неизвестное хранилище: {backend}")
+        return _stores[key]